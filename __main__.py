@@ -1,7 +1,14 @@
 import argparse
 
-from skyportal_fink_client.skyportal_fink_client import poll_alerts, validate_config
-from skyportal_fink_client.utils import files
+from skyportal_fink_client.skyportal_fink_client import (
+    load_config,
+    poll_alerts,
+    redrive_dead_letters,
+    validate_config,
+    warm_up,
+)
+from skyportal_fink_client.utils.log import make_log
+from skyportal_fink_client.utils.workers import run_workers
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="SkyPortal Fink Client")
@@ -10,7 +17,66 @@ if __name__ == "__main__":
         default=None,
         help="Path to a config YAML file (default: config.yaml in the repo root)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of consumer processes sharing the topic partitions (default: 1)",
+    )
+    parser.add_argument(
+        "--replay",
+        nargs="+",
+        default=None,
+        metavar="PATH",
+        help="Post alerts from Avro/Parquet files or directories instead of Kafka, then exit",
+    )
+    parser.add_argument(
+        "--replay-topic",
+        default=None,
+        help="Topic the replayed alerts are treated as coming from (default: the first of fink_topics)",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    redrive = subparsers.add_parser(
+        "redrive",
+        help="Post the alerts of the dead-letter store (dead_letter_path) again, then exit",
+    )
+    redrive.add_argument(
+        "--stage",
+        nargs="+",
+        default=None,
+        help="Only re-drive the alerts that failed at these stages (e.g. photometry extract)",
+    )
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if args.replay and args.workers > 1:
+        parser.error(
+            "--replay runs in a single process, do not combine it with --workers"
+        )
+    if args.command == "redrive" and (args.replay or args.workers > 1):
+        parser.error("redrive cannot be combined with --replay or --workers")
     if args.config:
-        validate_config(files.yaml_to_dict(args.config))
-    poll_alerts(config_path=args.config)
+        validate_config(load_config(args.config))
+    if args.command == "redrive":
+        redrive_dead_letters(config_path=args.config, stages=args.stage)
+    elif args.workers > 1:
+        log = make_log("supervisor")
+        conf = load_config(args.config)
+        if conf.get("warm_up", True):
+            # loaded once before forking, the workers inherit the modules
+            warm_up(conf.get("survey", "ztf"), log=log)
+        run_workers(
+            args.workers,
+            poll_alerts,
+            kwargs={"config_path": args.config},
+            log=log,
+            index_kwarg="worker_index",
+        )
+    elif args.replay:
+        poll_alerts(
+            config_path=args.config,
+            replay_path=args.replay,
+            replay_topic=args.replay_topic,
+        )
+    else:
+        poll_alerts(config_path=args.config)
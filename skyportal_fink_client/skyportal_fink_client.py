@@ -1,34 +1,112 @@
 # coding: utf-8
+import glob
 import os
+import re
 import time
 import traceback
+from typing import TYPE_CHECKING
 
-import numpy as np
-import pandas as pd
-from astropy.time import Time
-from fink_client.consumer import AlertConsumer
+import requests
 
-from .utils import files, skyportal_api
-from .utils.log import make_log
+from .utils import files, metrics, skyportal_api, tracing
+from .utils.batching import (
+    DEFAULT_BATCH_MAX_AGE,
+    DEFAULT_BATCH_SIZE,
+    PhotometryBatcher,
+)
+from .utils.deadletter import DEFAULT_REDRIVE_CHUNK_SIZE, DeadLetterStore
+from .utils.log import LEVELS, configure_logging, log_debug, make_log
+from .utils.records import AlertRecord
+from .utils.registry import DEFAULT_CANDIDATE_INTERVAL, ObjectRegistry
+from .utils.replay import DEFAULT_CHUNK_SIZE, read_alerts
+from .utils.spool import (
+    DEFAULT_DRAIN_BATCH_SIZE,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_RETRY_INTERVAL,
+    AlertSpool,
+    SpoolDrainer,
+    is_retryable,
+)
 from .utils.switchers import (
     band_to_filter_lsst,
     fid_to_filter_ztf,
 )
+from .utils.times import jd_to_mjd
 
-conf = files.yaml_to_dict(
-    os.path.abspath(os.path.join(os.path.dirname(__file__))) + "/../config.yaml"
-)
+if TYPE_CHECKING:
+    from fink_client.consumer import AlertConsumer
+
+    from .utils.decode_pool import DecodePool
+    from .utils.delivery import ManualCommitConsumer, OffsetTracker
+
+# pandas, fink_client (and confluent_kafka through it) and fink_filters are
+# imported where they are first needed, so that importing this module, e.g. to
+# validate a config or re-drive dead letters, stays fast and LSST deployments
+# never load the ZTF classifier stack. warm_up() loads them before consuming.
 
-taxonomy_dict = files.yaml_to_dict(
-    os.path.abspath(os.path.join(os.path.dirname(__file__))) + "/data/taxonomy.yaml"
+_DEFAULT_CONFIG_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "../config.yaml")
+)
+_TAXONOMY_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "data/taxonomy.yaml")
 )
 
 schema = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "../tests/schemas/schema_test.avsc")
 )
 
+_default_config = None
+_taxonomy = None
+
+
+def load_config(config_path: str = None):
+    """
+    Read a config file. The default one (config.yaml in the repo root) is read
+    once, on first use, and cached.
+
+    Arguments
+    ----------
+    config_path : str
+        Path to a config YAML file, config.yaml in the repo root if omitted.
+
+    Returns
+    ----------
+    dict
+        Config
+    """
+    global _default_config
+    if config_path:
+        return files.yaml_to_dict(config_path)
+    if _default_config is None:
+        _default_config = files.yaml_to_dict(_DEFAULT_CONFIG_PATH)
+    return _default_config
+
+
+def load_taxonomy():
+    """Return the Fink taxonomy posted to SkyPortal, read once on first use."""
+    global _taxonomy
+    if _taxonomy is None:
+        _taxonomy = files.yaml_to_dict(_TAXONOMY_PATH)
+    return _taxonomy
+
+
+def __getattr__(name: str):
+    # ``conf`` and ``taxonomy_dict`` used to be read at import time
+    if name == "conf":
+        return load_config()
+    if name == "taxonomy_dict":
+        return load_taxonomy()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 _VALID_SURVEYS = {"ztf", "lsst"}
 
+# Possible names of each survey's instrument in SkyPortal
+_SURVEY_INSTRUMENTS = {
+    "ztf": ["CFH12k", "ZTF"],
+    "lsst": ["LSSTCam", "LSST"],
+}
+
 _REQUIRED_CONFIG_FIELDS = [
     "fink_topics",
     "fink_username",
@@ -41,6 +119,44 @@ _REQUIRED_CONFIG_FIELDS = [
     "whitelisted",
 ]
 
+# Optional performance settings; when present they must be positive integers.
+_POSITIVE_INT_CONFIG_FIELDS = [
+    "skyportal_pool_size",
+    "skyportal_instrument_ttl",
+    "photometry_batch_size",
+    "skyportal_rate_burst",
+    "skyportal_concurrency",
+    "fink_batch_size",
+    "skyportal_classification_cache_size",
+    "skyportal_classification_cache_ttl",
+    "replay_chunk_size",
+    "log_max_bytes",
+    "log_backup_count",
+    "spool_batch_size",
+    "spool_max_attempts",
+    "metrics_port",
+    "fink_decode_processes",
+]
+
+# Optional performance settings; when present they must be positive numbers.
+_POSITIVE_NUMBER_CONFIG_FIELDS = [
+    "photometry_batch_max_age",
+    "skyportal_rate_limit",
+    "fink_commit_interval",
+    "object_registry_candidate_interval",
+    "log_rotate_interval",
+    "spool_retry_interval",
+    "fink_dedup_window",
+]
+
+# Optional settings; when present they must be booleans.
+_BOOL_CONFIG_FIELDS = [
+    "fink_at_least_once",
+    "fink_projected_decoding",
+    "object_registry",
+    "warm_up",
+]
+
 
 def validate_config(conf: dict):
     """Validate a config dict and raise ValueError with a descriptive message on failure.
@@ -73,6 +189,45 @@ def validate_config(conf: dict):
         if not conf[field]:
             raise ValueError(f"{field!r} must not be empty.")
 
+    for field in _POSITIVE_INT_CONFIG_FIELDS:
+        value = conf.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(f"{field!r} must be a positive integer.")
+
+    for field in _POSITIVE_NUMBER_CONFIG_FIELDS:
+        value = conf.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"{field!r} must be a positive number.")
+
+    for field in _BOOL_CONFIG_FIELDS:
+        if field in conf and not isinstance(conf[field], bool):
+            raise ValueError(f"{field!r} must be true or false.")
+
+    for field in (
+        "object_registry_path",
+        "spool_path",
+        "dead_letter_path",
+        "trace_path",
+    ):
+        path = conf.get(field)
+        if path is not None and (not isinstance(path, str) or not path):
+            raise ValueError(f"{field!r} must be a non-empty path.")
+
+    rate = conf.get("trace_sample_rate")
+    if rate is not None and (
+        isinstance(rate, bool)
+        or not isinstance(rate, (int, float))
+        or not 0 < rate <= 1
+    ):
+        raise ValueError("'trace_sample_rate' must be a number between 0 and 1.")
+
+    if conf.get("log_level") is not None and conf["log_level"] not in LEVELS:
+        raise ValueError(f"'log_level' must be one of {list(LEVELS)}.")
+
 
 _KN_TOPICS_ZTF = {
     "fink_kn_candidates_ztf",
@@ -101,6 +256,15 @@ def _topic_to_classification(topic: str) -> str:
     return " ".join(word.capitalize() for word in name.split("_"))
 
 
+def _topic_ranker(topics: list):
+    """
+    Return the rank function of the AlertDeduplicator: the copy of an alert
+    from a ZTF kilonova topic wins, then the one from the topic listed first.
+    """
+    order = {topic: i for i, topic in enumerate(topics)}
+    return lambda topic: (topic not in _KN_TOPICS_ZTF, order.get(topic, len(order)))
+
+
 def init_skyportal(
     skyportal_url: str = None,
     skyportal_token: str = None,
@@ -108,6 +272,11 @@ def init_skyportal(
     skyportal_name: str = None,
     whitelisted: bool = None,
     log: callable = None,
+    pool_size: int = None,
+    survey: str = None,
+    instrument_ttl: int = None,
+    rate_limit: float = None,
+    rate_burst: int = None,
 ):
     """
     Initializes the group, stream, filter and taxonomy needed to post alerts to Skyportal.
@@ -121,30 +290,64 @@ def init_skyportal(
         skyportal_group : str
             Name of the group in Skyportal. Can be omitted, then the group is taken from the config file.
         whitelisted : bool
-            If False, we take a 1 second pause between alerts. Can be omitted, then the value is taken from the config file.
+            If False and no rate_limit is given, calls to SkyPortal are limited to DEFAULT_RATE_LIMIT requests per second. Can be omitted, then the value is taken from the config file.
         log : function
             Log function. Can be omitted if you do not desire to log.
+        pool_size : int
+            Number of keep-alive connections to SkyPortal. Can be omitted, then the value is taken from the config file (``skyportal_pool_size``, default 10).
+        survey : str
+            ``ztf`` or ``lsst``, used to resolve the survey's instrument id once. Can be omitted, then the survey is taken from the config file.
+        instrument_ttl : int
+            Seconds before the resolved instrument id is looked up again. Can be omitted, then the value is taken from the config file (``skyportal_instrument_ttl``, default 3600).
+        rate_limit : float
+            Maximum requests per second sent to SkyPortal. Can be omitted, then the value is taken from the config file (``skyportal_rate_limit``).
+        rate_burst : int
+            Requests that can be sent back to back. Can be omitted, then the value is taken from the config file (``skyportal_rate_burst``).
 
     Returns
     ----------
         group_id, stream_id, filter_id, taxonomy_id, skyportal_url, skyportal_token, whitelisted
     """
     if skyportal_url is None:
-        skyportal_url = conf["skyportal_url"]
+        skyportal_url = load_config()["skyportal_url"]
     if skyportal_token is None:
-        skyportal_token = conf["skyportal_token"]
+        skyportal_token = load_config()["skyportal_token"]
     if skyportal_group is None:
-        skyportal_group = conf["skyportal_group"]
+        skyportal_group = load_config()["skyportal_group"]
     if whitelisted is None:
-        whitelisted = conf["whitelisted"]
+        whitelisted = load_config()["whitelisted"]
 
     if skyportal_name is None:
-        skyportal_name = conf["skyportal_name"]
+        skyportal_name = load_config()["skyportal_name"]
+    if pool_size is None:
+        pool_size = load_config().get(
+            "skyportal_pool_size", skyportal_api.DEFAULT_POOL_SIZE
+        )
+
+    if survey is None:
+        survey = load_config().get("survey", "ztf")
+    if instrument_ttl is None:
+        instrument_ttl = load_config().get(
+            "skyportal_instrument_ttl", skyportal_api.DEFAULT_INSTRUMENT_TTL
+        )
+
+    if rate_limit is None:
+        rate_limit = load_config().get("skyportal_rate_limit")
+    if rate_burst is None:
+        rate_burst = load_config().get("skyportal_rate_burst")
+    if rate_limit is None and not whitelisted:
+        rate_limit = skyportal_api.DEFAULT_RATE_LIMIT
+
+    skyportal_api.init_session(skyportal_url, skyportal_token, pool_size=pool_size)
+    skyportal_api.init_rate_limit(skyportal_url, rate_limit, rate_burst)
+    if log is not None and rate_limit is not None:
+        log(f"Limiting SkyPortal calls to {rate_limit} requests per second")
 
     group_id, stream_id, filter_id = skyportal_api.init_skyportal_group(
         group=skyportal_group, url=skyportal_url, token=skyportal_token
     )
 
+    taxonomy_dict = load_taxonomy()
     status, taxonomy_id, latest = skyportal_api.get_fink_taxonomy_id(
         taxonomy_dict["version"], url=skyportal_url, token=skyportal_token
     )
@@ -165,6 +368,25 @@ def init_skyportal(
 
     if log is not None:
         log(f"Fink Taxonomy posted with id {taxonomy_id}")
+
+    # SkyPortal now holds the local version of the taxonomy, so index that one
+    skyportal_api.register_taxonomy_index(
+        taxonomy_id, taxonomy_dict["hierarchy"], url=skyportal_url
+    )
+
+    instruments = _SURVEY_INSTRUMENTS[survey]
+    _, instrument_id = skyportal_api.resolve_instrument_id(
+        instruments, url=skyportal_url, token=skyportal_token, ttl=instrument_ttl
+    )
+    if log is not None:
+        if instrument_id is None:
+            log(
+                "Warning: instruments named {} do not exist yet".format(
+                    " / ".join(instruments)
+                )
+            )
+        else:
+            log(f"Using instrument id {instrument_id} for {survey.upper()}")
     return (
         group_id,
         stream_id,
@@ -177,6 +399,44 @@ def init_skyportal(
     )
 
 
+def warm_up(survey: str, log: callable = None):
+    """
+    Import the modules that are otherwise loaded on the first alert, so that
+    it does not stall: the Kafka client, and for ZTF pandas and the Fink
+    classifier (fink_filters, which pulls in pyspark). Meant to be called
+    before subscribing, or before forking worker processes so that they share
+    the loaded modules. A classifier that cannot be loaded is only reported:
+    ZTF alerts then fail to be extracted as before.
+
+    Arguments
+    ----------
+    survey : str
+        ``ztf`` or ``lsst``
+    log : callable
+
+    Returns
+    ----------
+    bool
+        False if a module could not be loaded
+    """
+    start = time.monotonic()
+    try:
+        import fink_client.consumer  # noqa: F401
+
+        if survey == "ztf":
+            import pandas  # noqa: F401
+            from fink_filters.ztf.classification import (  # noqa: F401
+                extract_fink_classification_from_pdf,
+            )
+    except Exception as e:
+        if log is not None:
+            log(f"Warning: warm-up failed, modules are loaded on first use: {e!r}")
+        return False
+    if log is not None:
+        log(f"Warmed up in {time.monotonic() - start:.1f}s")
+    return True
+
+
 def init_consumer(
     survey: str = None,
     fink_username: str = None,
@@ -187,6 +447,9 @@ def init_consumer(
     testing: bool = None,
     schema_path: str = None,
     log: callable = None,
+    at_least_once: bool = None,
+    on_revoke: callable = None,
+    projected_decoding: bool = None,
 ):
     """
     Create and return an AlertConsumer connected to the Fink broker.
@@ -210,25 +473,39 @@ def init_consumer(
     schema_path : str
         Path to a local avsc schema for decoding (used in testing mode).
     log : callable
+    at_least_once : bool
+        If True, auto-commit is turned off and a ManualCommitConsumer is
+        returned: offsets must be committed once alerts are ingested.
+        Taken from config (``fink_at_least_once``) if omitted.
+    on_revoke : callable
+        Rebalance callback of the ManualCommitConsumer, see OffsetTracker.revoke.
+    projected_decoding : bool
+        If True, only the alert fields the client reads are decoded (see
+        _PROJECTED_FIELDS). Taken from config (``fink_projected_decoding``)
+        if omitted.
 
     Returns
     ----------
     consumer : AlertConsumer
     """
     if survey is None:
-        survey = conf.get("survey", "ztf")
+        survey = load_config().get("survey", "ztf")
     if fink_username is None:
-        fink_username = conf["fink_username"]
+        fink_username = load_config()["fink_username"]
     if fink_password is None:
-        fink_password = conf["fink_password"]
+        fink_password = load_config()["fink_password"]
     if fink_group_id is None:
-        fink_group_id = conf["fink_group_id"]
+        fink_group_id = load_config()["fink_group_id"]
     if fink_servers is None:
-        fink_servers = conf["fink_servers"]
+        fink_servers = load_config()["fink_servers"]
     if fink_topics is None:
-        fink_topics = conf["fink_topics"]
+        fink_topics = load_config()["fink_topics"]
     if testing is None:
-        testing = conf["testing"]
+        testing = load_config()["testing"]
+    if at_least_once is None:
+        at_least_once = load_config().get("fink_at_least_once", False)
+    if projected_decoding is None:
+        projected_decoding = load_config().get("fink_projected_decoding", False)
 
     if testing:
         fink_servers = "localhost:9093"
@@ -252,19 +529,42 @@ def init_consumer(
         else:
             log(f"Using live Fink Broker ({survey.upper()})")
 
-    consumer = AlertConsumer(
-        topics=fink_topics,
-        config=fink_config,
-        survey=survey,
-        schema_path=schema_path if testing else None,
-    )
+    decoder = None
+    if projected_decoding:
+        from .utils.decoding import ProjectedDecoder
+
+        decoder = ProjectedDecoder(_PROJECTED_FIELDS[survey])
+        if log is not None:
+            log(f"Decoding only the alert fields {_PROJECTED_FIELDS[survey]}")
+
+    if at_least_once:
+        from .utils.delivery import ManualCommitConsumer
+
+        consumer = ManualCommitConsumer(
+            topics=fink_topics,
+            config=fink_config,
+            survey=survey,
+            schema_path=schema_path if testing else None,
+            on_revoke=on_revoke,
+            decoder=decoder,
+        )
+    else:
+        from .utils.decoding import ProjectedAlertConsumer
+
+        consumer = ProjectedAlertConsumer(
+            topics=fink_topics,
+            config=fink_config,
+            decoder=decoder,
+            survey=survey,
+            schema_path=schema_path if testing else None,
+        )
 
     if log is not None:
         log(f"Subscribed to topics: {fink_topics}")
     return consumer
 
 
-def poll_alert(consumer: AlertConsumer, maxtimeout: int, log: callable = None):
+def poll_alert(consumer: "AlertConsumer", maxtimeout: int, log: callable = None):
     """
     Poll the consumer once and return (topic, alert).
 
@@ -281,11 +581,14 @@ def poll_alert(consumer: AlertConsumer, maxtimeout: int, log: callable = None):
     alert : dict or None
     """
     try:
-        topic, alert, key = consumer.poll(maxtimeout)
+        # fink_client decodes the alert while polling
+        with tracing.span("consume"):
+            topic, alert, key = consumer.poll(maxtimeout)
         if topic is None:
             if log is not None:
                 log(f"No alerts received in the last {maxtimeout} seconds (timeout)")
             return None, None
+        metrics.ALERTS.inc(topic, "polled")
         if alert is None:
             if log is not None:
                 log(
@@ -293,8 +596,9 @@ def poll_alert(consumer: AlertConsumer, maxtimeout: int, log: callable = None):
                     "but alert could not be decoded"
                 )
             return None, None
+        metrics.ALERTS.inc(topic, "decoded")
         if log is not None:
-            log(f"Decoded alert from topic={topic}")
+            log_debug(log, "Decoded alert from topic=%s", topic)
         return topic, alert
     except Exception as e:
         if log is not None:
@@ -305,31 +609,67 @@ def poll_alert(consumer: AlertConsumer, maxtimeout: int, log: callable = None):
         return None, None
 
 
-def _extract_ztf_data(topic: str, alert: dict):
-    """Extract a flat list of standardised alert fields from a ZTF alert."""
+# Alert fields read by fink_filters' extract_fink_classification_from_pdf
+_ZTF_CLASSIFIER_FIELDS = [
+    "candidate",
+    "cdsxmatch",
+    "roid",
+    "mulens",
+    "snn_snia_vs_nonia",
+    "snn_sn_vs_all",
+    "rf_snia_vs_nonia",
+    "rf_kn_vs_nonkn",
+]
+
+# Top-level alert fields read by the extraction, the only ones decoded with
+# fink_projected_decoding: cutouts, prv_candidates (ZTF) and the other
+# science modules are skipped.
+_PROJECTED_FIELDS = {
+    "ztf": ["objectId", "candid", *_ZTF_CLASSIFIER_FIELDS],
+    "lsst": ["diaSource", "diaObject", "mpc_orbits"],
+}
+
+
+def _is_valid_ztf_alert(alert: dict):
+    """Tell if a ZTF alert has all the fields needed to post it."""
     if alert is None:
-        return None
+        return False
     if "objectId" not in alert or "candidate" not in alert:
-        return None
+        return False
     cand = alert["candidate"]
     required = ["jd", "fid", "magpsf", "sigmapsf", "diffmaglim", "ra", "dec"]
-    if any(cand.get(k) is None for k in required):
-        return None
+    return not any(cand.get(k) is None for k in required)
 
+
+@tracing.traced("classify")
+def _classify_ztf_alerts(alerts: list):
+    """Classify ZTF alerts with the Fink classifier, in a single vectorized call."""
+    import pandas as pd
     from fink_filters.ztf.classification import extract_fink_classification_from_pdf
 
-    alert_pd = pd.DataFrame([alert])
-    alert_pd["tracklet"] = ""
-    classification = extract_fink_classification_from_pdf(alert_pd)[0]
+    # Only the classifier's columns: cutouts and history are not copied into pandas.
+    alerts_pd = pd.DataFrame(
+        {
+            field: [alert.get(field) for alert in alerts]
+            for field in _ZTF_CLASSIFIER_FIELDS
+        }
+    )
+    alerts_pd["tracklet"] = ""
+    return list(extract_fink_classification_from_pdf(alerts_pd))
+
+
+def _ztf_record(topic: str, alert: dict, classification: str):
+    """Build the AlertRecord of a classified ZTF alert."""
+    cand = alert["candidate"]
 
     # Force kilonova classification for known KN topics
     if topic in _KN_TOPICS_ZTF and "kilonova" not in classification.lower():
         classification = "Kilonova candidate"
 
-    return [
+    return AlertRecord(
         alert["objectId"],
-        Time(cand["jd"], format="jd").mjd,
-        ["CFH12k", "ZTF"],
+        jd_to_mjd(cand["jd"]),
+        _SURVEY_INSTRUMENTS["ztf"],
         fid_to_filter_ztf(cand["fid"]),
         cand["magpsf"],
         cand["sigmapsf"],
@@ -339,11 +679,31 @@ def _extract_ztf_data(topic: str, alert: dict):
         cand["dec"],
         classification,
         False,  # is_flux: ZTF uses mag space
-    ]
+        alert.get("candid"),
+    )
+
+
+def _extract_ztf_data(topic: str, alert: dict):
+    """Extract the AlertRecord of a ZTF alert."""
+    if not _is_valid_ztf_alert(alert):
+        return None
+    return _ztf_record(topic, alert, _classify_ztf_alerts([alert])[0])
+
+
+def _extract_ztf_batch(topics: list, alerts: list):
+    """Extract ZTF alerts like _extract_ztf_data, classifying them all at once."""
+    valid = [i for i, alert in enumerate(alerts) if _is_valid_ztf_alert(alert)]
+    records = [None] * len(alerts)
+    if not valid:
+        return records
+    classifications = _classify_ztf_alerts([alerts[i] for i in valid])
+    for i, classification in zip(valid, classifications):
+        records[i] = _ztf_record(topics[i], alerts[i], classification)
+    return records
 
 
 def _extract_lsst_data(topic: str, alert: dict):
-    """Extract a flat list of standardised alert fields from an LSST/Rubin alert."""
+    """Extract the AlertRecord of an LSST/Rubin alert."""
     if alert is None:
         return None
 
@@ -359,7 +719,7 @@ def _extract_lsst_data(topic: str, alert: dict):
 
     diaobj = alert.get("diaObject")
     if diaobj is not None:
-        object_id = str(np.int64(diaobj["diaObjectId"]))
+        object_id = str(int(diaobj["diaObjectId"]))
         ra = diaobj.get("ra") or dia.get("ra")
         dec = diaobj.get("dec") or dia.get("dec")
     elif alert.get("mpc_orbits") is not None:
@@ -377,10 +737,10 @@ def _extract_lsst_data(topic: str, alert: dict):
         return None
 
     # flux/fluxerr are in nJy; zp=31.4 gives AB mags (m = -2.5*log10(flux) + 31.4).
-    return [
+    return AlertRecord(
         object_id,
         dia["midpointMjdTai"],
-        ["LSSTCam", "LSST"],
+        _SURVEY_INSTRUMENTS["lsst"],
         filter_,
         dia["psfFlux"],  # flux in nJy
         dia["psfFluxErr"],  # fluxerr in nJy
@@ -390,9 +750,11 @@ def _extract_lsst_data(topic: str, alert: dict):
         dec,
         _topic_to_classification(topic),
         True,  # is_flux: LSST uses flux space (no limiting mag available)
-    ]
+        dia.get("diaSourceId"),
+    )
 
 
+@tracing.traced("extract")
 def extract_alert_data(survey: str, topic: str, alert: dict):
     """
     Dispatch alert data extraction to the correct survey handler.
@@ -408,9 +770,9 @@ def extract_alert_data(survey: str, topic: str, alert: dict):
 
     Returns
     ----------
-    list or None
-        [object_id, mjd, instruments, filter, mag, magerr,
-         limiting_mag, magsys, ra, dec, classification]
+    AlertRecord or None
+        (object_id, mjd, instruments, filter, mag, magerr, limiting_mag,
+         magsys, ra, dec, classification, is_flux, alert_id)
         Returns None if the alert could not be parsed.
     """
     if survey == "ztf":
@@ -421,6 +783,302 @@ def extract_alert_data(survey: str, topic: str, alert: dict):
         raise ValueError(f"Unknown survey: {survey!r}. Must be 'ztf' or 'lsst'.")
 
 
+@tracing.traced("extract")
+def extract_alerts_data(survey: str, topics: list, alerts: list):
+    """
+    Extract the data of several alerts at once. Equivalent to calling
+    extract_alert_data on each alert, but ZTF alerts are classified with a
+    single call to the Fink classifier.
+
+    Arguments
+    ----------
+    survey : str
+        ``ztf`` or ``lsst``
+    topics : list
+        Kafka topic each alert was received from
+    alerts : list
+        Raw alert dicts
+
+    Returns
+    ----------
+    list
+        One entry per alert, in the same order: the extracted data (see
+        extract_alert_data), or None if the alert could not be parsed.
+    """
+    if survey == "ztf":
+        return _extract_ztf_batch(topics, alerts)
+    elif survey == "lsst":
+        return [
+            _extract_lsst_data(topic, alert) for topic, alert in zip(topics, alerts)
+        ]
+    else:
+        raise ValueError(f"Unknown survey: {survey!r}. Must be 'ztf' or 'lsst'.")
+
+
+def _count_alerts(messages: list):
+    """Count polled and decoded (topic, alert, ...) messages in the metrics."""
+    for message in messages:
+        metrics.ALERTS.inc(message[0], "polled")
+        if message[1] is not None:
+            metrics.ALERTS.inc(message[0], "decoded")
+
+
+def _count_extracted(topics: list, records: list):
+    """Count the alerts whose data could be extracted in the metrics."""
+    for topic, data in zip(topics, records):
+        if data is not None:
+            metrics.ALERTS.inc(topic, "extracted")
+
+
+def poll_alerts_batch(
+    consumer: "AlertConsumer",
+    survey: str,
+    batch_size: int,
+    maxtimeout: int,
+    log: callable = None,
+    on_unparsed: callable = None,
+):
+    """
+    Consume up to ``batch_size`` alerts and extract their data in one pass.
+
+    Arguments
+    ----------
+    consumer : AlertConsumer
+    survey : str
+        ``ztf`` or ``lsst``
+    batch_size : int
+        Maximum number of alerts to consume.
+    maxtimeout : int
+        Seconds to wait for the batch to fill before returning what was received.
+    log : callable
+    on_unparsed : callable
+        Called with (topic, alert, (topic, partition, offset)) for each message
+        that could not be decoded (alert is then None) or extracted. Can be
+        omitted.
+
+    Returns
+    ----------
+    list
+        (topic, data) tuples of the alerts that could be decoded and extracted.
+    """
+    from .utils.decoding import message_timestamp
+
+    try:
+        # decoded one by one, so that a bad message does not discard the batch
+        messages = consumer.poll_messages(batch_size, maxtimeout)
+    except Exception as e:
+        if log is not None:
+            log(
+                f"Exception during consume: {type(e).__name__}: {e}\n"
+                f"{traceback.format_exc()}"
+            )
+        return []
+    if not messages:
+        if log is not None:
+            log(f"No alerts received in the last {maxtimeout} seconds (timeout)")
+        return []
+    _count_alerts(messages)
+
+    topics = [topic for topic, _, _ in messages]
+    records = extract_alerts_data(survey, topics, [alert for _, alert, _ in messages])
+    if log is not None:
+        decoded = sum(alert is not None for _, alert, _ in messages)
+        log(
+            f"Decoded {decoded} of {len(messages)} alerts, "
+            f"{sum(r is not None for r in records)} extracted"
+        )
+    _count_extracted(topics, records)
+    alerts_data = []
+    for (topic, alert, message), data in zip(messages, records):
+        if data is not None:
+            alerts_data.append(
+                (topic, data._replace(timestamp=message_timestamp(message)))
+            )
+        elif on_unparsed is not None:
+            on_unparsed(topic, alert, (topic, message.partition(), message.offset()))
+    return alerts_data
+
+
+def _poll_tracked_alerts(
+    consumer: "ManualCommitConsumer",
+    survey: str,
+    batch_size: int,
+    maxtimeout: int,
+    offset_tracker: "OffsetTracker",
+    parts: int,
+    log: callable,
+    on_unparsed: callable = None,
+):
+    """Poll and extract alerts, tracking the offset of every message received."""
+    from .utils.decoding import message_timestamp
+
+    messages = consumer.poll_messages(batch_size, maxtimeout)
+    if not messages:
+        log(f"No alerts received in the last {maxtimeout} seconds (timeout)")
+        return []
+    _count_alerts(messages)
+    topics = [topic for topic, _, _ in messages]
+    records = extract_alerts_data(survey, topics, [alert for _, alert, _ in messages])
+    _count_extracted(topics, records)
+    alerts_data = []
+    for (topic, alert, message), data in zip(messages, records):
+        if data is None:
+            # nothing will be posted, so the message is done already
+            token = offset_tracker.track(message, parts=0)
+            if on_unparsed is not None:
+                on_unparsed(topic, alert, token)
+        else:
+            data = data._replace(timestamp=message_timestamp(message))
+            alerts_data.append((topic, data, offset_tracker.track(message, parts)))
+    return alerts_data
+
+
+def _poll_pooled_alerts(
+    consumer: "AlertConsumer",
+    decode_pool: "DecodePool",
+    batch_size: int,
+    maxtimeout: int,
+    offset_tracker: "OffsetTracker",
+    parts: int,
+    log: callable,
+    on_unparsed: callable = None,
+):
+    """
+    Consume raw messages for the decode pool and return the alerts it
+    extracted so far, in the order they were consumed. Offsets are tracked
+    when the messages are consumed, so they are committed in order.
+    """
+    from .utils.decoding import message_timestamp
+
+    pending = len(decode_pool) > 0
+    messages = []
+    if not decode_pool.full():
+        with tracing.span("consume"):
+            # while chunks are being decoded, only take what is already there
+            messages = consumer.consume_messages(
+                batch_size, 0 if pending else maxtimeout
+            )
+        for message in messages:
+            metrics.ALERTS.inc(message.topic(), "polled")
+        # (offset token, Kafka timestamp) of each message
+        tokens = [
+            (
+                offset_tracker.track(message, parts)
+                if offset_tracker is not None
+                else None,
+                message_timestamp(message),
+            )
+            for message in messages
+        ]
+        decode_pool.submit(messages, tokens)
+    if not messages and not pending:
+        log(f"No alerts received in the last {maxtimeout} seconds (timeout)")
+        return []
+    with tracing.span("decode"):
+        results = decode_pool.results(wait=not messages or decode_pool.full())
+    alerts_data = []
+    for topic, decoded, data, alert, (token, timestamp) in results:
+        if decoded:
+            metrics.ALERTS.inc(topic, "decoded")
+        if data is None:
+            if token is not None:
+                # nothing will be posted, so the message is done already
+                for _ in range(parts):
+                    offset_tracker.ack(token)
+            if on_unparsed is not None:
+                on_unparsed(topic, alert, token)
+        else:
+            metrics.ALERTS.inc(topic, "extracted")
+            alerts_data.append((topic, data._replace(timestamp=timestamp), token))
+    return alerts_data
+
+
+def replay_alerts(
+    survey: str,
+    path,
+    topic: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    log: callable = None,
+    on_unparsed: callable = None,
+    projected_decoding: bool = False,
+):
+    """
+    Read alerts from Avro/Parquet files instead of Kafka and extract their data,
+    one chunk at a time.
+
+    Arguments
+    ----------
+    survey : str
+        ``ztf`` or ``lsst``
+    path : str or list
+        Avro (.avro, .avro.gz) or Parquet (.parquet) file, directory holding
+        such files, or list of them
+    topic : str
+        Topic the alerts are treated as coming from; it drives their
+        classification like for alerts read from Kafka.
+    chunk_size : int
+        Maximum number of alerts read and extracted at once
+    log : callable
+    on_unparsed : callable
+        Called with (topic, alert, None) for each alert that could not be
+        extracted. Can be omitted.
+    projected_decoding : bool
+        If True, only the alert fields in _PROJECTED_FIELDS are read.
+
+    Returns
+    ----------
+    generator
+        Lists of (topic, data) tuples, see extract_alert_data.
+    """
+    replayed = 0
+    fields = _PROJECTED_FIELDS[survey] if projected_decoding else None
+    for alerts in read_alerts(path, chunk_size, fields):
+        metrics.ALERTS.inc(topic, "polled", value=len(alerts))
+        metrics.ALERTS.inc(topic, "decoded", value=len(alerts))
+        alerts_data = extract_alerts_data(survey, [topic] * len(alerts), alerts)
+        _count_extracted([topic] * len(alerts), alerts_data)
+        chunk = [(topic, data) for data in alerts_data if data is not None]
+        if on_unparsed is not None:
+            for alert, data in zip(alerts, alerts_data):
+                if data is None:
+                    on_unparsed(topic, alert, None)
+        replayed += len(alerts)
+        if log is not None:
+            if len(chunk) < len(alerts):
+                log(
+                    f"Skipped {len(alerts) - len(chunk)} alerts that could not be parsed"
+                )
+            log(f"Replayed {replayed} alerts")
+        yield chunk
+
+
+def _worker_path(path: str, worker_index: int = None):
+    """
+    Return the file of a worker process for a file setting, e.g.
+    ``spool.3.sqlite`` for ``spool.sqlite`` and worker 3, so that the workers
+    never share a SQLite store or a trace file. Unchanged without a worker.
+    """
+    if not path or worker_index is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{worker_index}{extension}"
+
+
+def _worker_paths(path: str):
+    """Return ``path`` and the files of the workers made from it that exist."""
+    root, extension = os.path.splitext(path)
+    pattern = re.compile(re.escape(root) + r"\.\d+" + re.escape(extension) + "$")
+    workers = sorted(
+        (
+            file
+            for file in glob.glob(f"{glob.escape(root)}.*{extension}")
+            if pattern.match(file)
+        ),
+        key=lambda file: int(file[len(root) + 1 : len(file) - len(extension)]),
+    )
+    return ([path] if os.path.exists(path) else []) + workers
+
+
 def poll_alerts(
     skyportal_url: str = None,
     skyportal_token: str = None,
@@ -437,6 +1095,14 @@ def poll_alerts(
     log: callable = None,
     maxtimeout: int = 5,
     config_path: str = None,
+    photometry_batch_size: int = None,
+    photometry_batch_max_age: float = None,
+    skyportal_concurrency: int = None,
+    fink_batch_size: int = None,
+    fink_at_least_once: bool = None,
+    replay_path=None,
+    replay_topic: str = None,
+    worker_index: int = None,
 ):
     """
     Connect to Fink and continuously post incoming alerts to SkyPortal.
@@ -459,17 +1125,54 @@ def poll_alerts(
     testing : bool
         Use a local Kafka instance with fake alerts.
     whitelisted : bool
-        Skip the 1-second inter-alert delay if your IP is whitelisted.
+        Do not rate limit the calls to SkyPortal (unless ``skyportal_rate_limit``
+        is set) if your IP is whitelisted.
     log : callable
     maxtimeout : int
         Seconds to wait for an alert before polling again. Default 5.
     config_path : str
         Path to a config YAML file. Defaults to config.yaml in the repo root.
+    photometry_batch_size : int
+        If set, photometry is posted in columnar batches of up to this many
+        points instead of one request per alert.
+    photometry_batch_max_age : float
+        Seconds after which a non-full photometry batch is posted. Default 2.
+    skyportal_concurrency : int
+        If set, alerts are posted with the asyncio client, up to this many at
+        the same time, instead of one after the other.
+    fink_batch_size : int
+        If set, alerts are consumed and extracted in batches of up to this many
+        alerts (ZTF alerts are then classified with one call per batch).
+    fink_at_least_once : bool
+        If True, Kafka offsets are committed only once the alerts were
+        written to SkyPortal, instead of being auto-committed when polled.
+    replay_path : str or list
+        If set, alerts are read from these Avro/Parquet files or directories
+        instead of Kafka, and the function returns once they are all posted.
+    replay_topic : str
+        Topic the replayed alerts are treated as coming from. Defaults to the
+        first of ``fink_topics``.
+    worker_index : int
+        Index of the worker process running this function (see run_workers).
+        Worker ``i`` serves its metrics on ``metrics_port + i``.
     """
     if log is None:
         log = make_log("fink")
 
-    _conf = files.yaml_to_dict(config_path) if config_path else conf
+    _conf = load_config(config_path)
+
+    configure_logging(
+        level=_conf.get("log_level"),
+        max_bytes=_conf.get("log_max_bytes"),
+        rotate_interval=_conf.get("log_rotate_interval"),
+        backup_count=_conf.get("log_backup_count"),
+    )
+
+    trace_path = _worker_path(_conf.get("trace_path"), worker_index)
+    if trace_path:
+        sample_rate = _conf.get("trace_sample_rate", tracing.DEFAULT_SAMPLE_RATE)
+        tracing.configure_tracing(trace_path, sample_rate)
+        log(f"Tracing {sample_rate:.0%} of the alerts to {trace_path}")
 
     # Resolve all values: kwargs take precedence over the config file.
     survey = survey if survey is not None else _conf.get("survey", "ztf")
@@ -498,6 +1201,39 @@ def poll_alerts(
     fink_servers = fink_servers if fink_servers is not None else _conf["fink_servers"]
     fink_topics = fink_topics if fink_topics is not None else _conf["fink_topics"]
     testing = testing if testing is not None else _conf["testing"]
+    photometry_batch_size = (
+        photometry_batch_size
+        if photometry_batch_size is not None
+        else _conf.get("photometry_batch_size")
+    )
+    photometry_batch_max_age = (
+        photometry_batch_max_age
+        if photometry_batch_max_age is not None
+        else _conf.get("photometry_batch_max_age", DEFAULT_BATCH_MAX_AGE)
+    )
+    skyportal_concurrency = (
+        skyportal_concurrency
+        if skyportal_concurrency is not None
+        else _conf.get("skyportal_concurrency")
+    )
+    fink_batch_size = (
+        fink_batch_size if fink_batch_size is not None else _conf.get("fink_batch_size")
+    )
+    fink_at_least_once = (
+        fink_at_least_once
+        if fink_at_least_once is not None
+        else _conf.get("fink_at_least_once", False)
+    )
+    pool_size = _conf.get("skyportal_pool_size", skyportal_api.DEFAULT_POOL_SIZE)
+    instrument_ttl = _conf.get(
+        "skyportal_instrument_ttl", skyportal_api.DEFAULT_INSTRUMENT_TTL
+    )
+    rate_limit = _conf.get("skyportal_rate_limit")
+    rate_burst = _conf.get("skyportal_rate_burst")
+    skyportal_api.init_classification_cache(
+        size=_conf.get("skyportal_classification_cache_size"),
+        ttl=_conf.get("skyportal_classification_cache_ttl"),
+    )
 
     (
         group_id,
@@ -515,43 +1251,698 @@ def poll_alerts(
         skyportal_name,
         whitelisted,
         log,
+        pool_size,
+        survey,
+        instrument_ttl,
+        rate_limit,
+        rate_burst,
     )
 
-    consumer = init_consumer(
-        survey=survey,
-        fink_username=fink_username,
-        fink_password=fink_password,
-        fink_group_id=fink_group_id,
-        fink_servers=fink_servers,
-        fink_topics=fink_topics,
-        testing=testing,
-        schema_path=schema,
-        log=log,
-    )
+    object_registry = None
+    registry_path = _worker_path(_conf.get("object_registry_path"), worker_index)
+    if _conf.get("object_registry", False) or registry_path:
+        object_registry = ObjectRegistry(
+            registry_path,
+            candidate_interval=_conf.get(
+                "object_registry_candidate_interval", DEFAULT_CANDIDATE_INTERVAL
+            ),
+        )
+        log(
+            f"Object registry: {len(object_registry)} known objects"
+            + (f" (stored in {registry_path})" if registry_path else "")
+        )
+
+    dead_letters = None
+    on_unparsed = None
+    dead_letter_path = _worker_path(_conf.get("dead_letter_path"), worker_index)
+    if dead_letter_path:
+        dead_letters = DeadLetterStore(dead_letter_path)
+        log(
+            f"Recording failed alerts in {dead_letter_path} "
+            f"({len(dead_letters)} already there)"
+        )
+
+        def on_unparsed(topic, alert, token):
+            stage = "extract" if alert is not None else "decode"
+            dead_letters.add(stage, topic, alert=alert, token=token)
+            metrics.ALERTS.inc(topic, "dead_lettered")
+
+        def on_reject(points, key, status, body):
+            for point in points:
+                tag = point.get("tag")
+                # an offset token in at-least-once mode, a timestamp otherwise
+                tag = tag if isinstance(tag, tuple) else None
+                dead_letters.add(
+                    "photometry",
+                    tag[0] if tag is not None else None,
+                    status=status,
+                    body=body,
+                    data={
+                        "point": {k: v for k, v in point.items() if k != "tag"},
+                        "key": key,
+                    },
+                    token=tag,
+                )
+
+    replay = None
+    if replay_path is not None:
+        replay_topic = replay_topic if replay_topic is not None else fink_topics[0]
+        replay_chunk_size = _conf.get(
+            "replay_chunk_size", fink_batch_size or DEFAULT_CHUNK_SIZE
+        )
+        replay = replay_alerts(
+            survey,
+            replay_path,
+            replay_topic,
+            replay_chunk_size,
+            log,
+            on_unparsed,
+            projected_decoding=_conf.get("fink_projected_decoding", False),
+        )
+        log(f"Replaying alerts from {replay_path} as topic {replay_topic}")
+        # offsets only exist for alerts read from Kafka
+        fink_at_least_once = False
+
+    if _conf.get("warm_up", True):
+        warm_up(survey, log)
+
+    decode_pool = None
+    decode_processes = _conf.get("fink_decode_processes")
+    if decode_processes and replay is None:
+        from .utils.decode_pool import DEFAULT_BATCH_SIZE, DecodePool
+
+        decode_batch_size = fink_batch_size or DEFAULT_BATCH_SIZE
+        decode_pool = DecodePool(
+            extract_alerts_data,
+            survey,
+            decode_processes,
+            schema_path=schema if testing else None,
+            fields=_PROJECTED_FIELDS[survey]
+            if _conf.get("fink_projected_decoding", False)
+            else None,
+            initializer=warm_up,
+            initargs=(survey,),
+        )
+        log(f"Decoding and extracting alerts in {decode_processes} processes")
+
+    offset_tracker = None
+    if fink_at_least_once:
+        from .utils.delivery import DEFAULT_COMMIT_INTERVAL, OffsetTracker
+
+        offset_tracker = OffsetTracker(
+            commit_interval=_conf.get("fink_commit_interval", DEFAULT_COMMIT_INTERVAL),
+            log=log,
+        )
+        log(
+            "At-least-once delivery: offsets are committed once alerts are in SkyPortal"
+        )
+
+    consumer = None
+    if replay is None:
+        consumer = init_consumer(
+            survey=survey,
+            fink_username=fink_username,
+            fink_password=fink_password,
+            fink_group_id=fink_group_id,
+            fink_servers=fink_servers,
+            fink_topics=fink_topics,
+            testing=testing,
+            schema_path=schema,
+            log=log,
+            at_least_once=fink_at_least_once,
+            on_revoke=offset_tracker.revoke if offset_tracker is not None else None,
+            projected_decoding=_conf.get("fink_projected_decoding", False),
+        )
+
+    photometry_batcher = None
+    if photometry_batch_size:
+
+        def on_flush(sent, failed):
+            if offset_tracker is None:
+                # the tags are the Kafka timestamps of the alerts
+                now = time.time()
+                for point in sent:
+                    if point.get("tag") is not None:
+                        metrics.ALERT_LATENCY.observe(now - point["tag"])
+                return
+            if dead_letters is not None:
+                # the rejected points are kept in the dead-letter store
+                sent, failed = sent + failed, []
+            for point in failed:
+                metrics.ALERTS.inc(point["tag"][0], "dropped")
+            offset_tracker.ack_points(sent, failed)
+
+        def forget_rejected(points, key, status, body):
+            if not skyportal_api._is_unknown_instrument_error(status, body):
+                # e.g. the source was deleted: post it again next time
+                object_registry.forget(points[0]["object_id"])
+
+        def on_batch_reject(points, key, status, body):
+            if object_registry is not None:
+                forget_rejected(points, key, status, body)
+            if dead_letters is not None:
+                on_reject(points, key, status, body)
+
+        photometry_batcher = PhotometryBatcher(
+            skyportal_url,
+            skyportal_token,
+            max_size=photometry_batch_size,
+            max_age=photometry_batch_max_age,
+            log=log,
+            on_flush=on_flush,
+            on_reject=on_batch_reject
+            if object_registry is not None or dead_letters is not None
+            else None,
+        )
+        log(
+            f"Batching photometry by {photometry_batch_size} points "
+            f"or {photometry_batch_max_age} seconds"
+        )
+    # a batched alert is done once its photometry is posted as well
+    parts = 2 if photometry_batcher is not None else 1
+
+    post_kwargs = {
+        "probability": None,
+        "group_id": group_id,
+        "filter_id": filter_id,
+        "stream_id": stream_id,
+        "taxonomy_id": taxonomy_id,
+        "whitelisted": whitelisted,
+        "url": skyportal_url,
+        "token": skyportal_token,
+        "skyportal_name": skyportal_name,
+        "log": log,
+        "photometry_batcher": photometry_batcher,
+        "object_registry": object_registry,
+    }
+
+    spool = None
+    spool_drainer = None
+    spool_path = _worker_path(_conf.get("spool_path"), worker_index)
+    if spool_path:
+        spool = AlertSpool(spool_path)
+        spool_batcher = None
+        if photometry_batcher is not None:
+            # flushed by the drainer after each chunk of spooled alerts; the
+            # points rejected are posted again with their alert
+            spool_batcher = PhotometryBatcher(
+                skyportal_url,
+                skyportal_token,
+                max_size=photometry_batch_size,
+                log=log,
+                on_reject=forget_rejected if object_registry is not None else None,
+            )
+        spool_drainer = SpoolDrainer(
+            spool,
+            lambda topic, data, tag=None: skyportal_api.from_fink_to_skyportal(
+                *data[:11],
+                is_flux=data[11],
+                photometry_tag=tag,
+                **{**post_kwargs, "photometry_batcher": spool_batcher},
+            ),
+            probe=lambda: skyportal_api.is_available(skyportal_url, skyportal_token),
+            retry_interval=_conf.get("spool_retry_interval", DEFAULT_RETRY_INTERVAL),
+            batch_size=_conf.get("spool_batch_size", DEFAULT_DRAIN_BATCH_SIZE),
+            max_attempts=_conf.get("spool_max_attempts", DEFAULT_MAX_ATTEMPTS),
+            on_drop=(
+                lambda topic, data, status: dead_letters.add(
+                    "post", topic, status=status, data=data
+                )
+            )
+            if dead_letters is not None
+            else None,
+            log=log,
+            photometry_batcher=spool_batcher,
+        ).start()
+        log(f"Spooling alerts to {spool_path} when SkyPortal is unavailable")
+        if len(spool):
+            log(f"{len(spool)} alerts left in the spool by a previous run")
+
+    def settle_alert(topic, data, token, status, errors=()):
+        """
+        Spool the alert if SkyPortal was unavailable, record it as a dead letter
+        if it failed otherwise, and acknowledge it.
+        """
+        if status == 200:
+            metrics.ALERTS.inc(topic, "posted")
+            if token is not None:
+                offset_tracker.ack(token)
+            elif photometry_batcher is None and data.timestamp is not None:
+                # batched photometry is timed when its batch is posted
+                metrics.ALERT_LATENCY.observe(time.time() - data.timestamp)
+        elif spool is not None and is_retryable(status):
+            spool.add(topic, data)
+            # the next alerts go to the spool until SkyPortal answers again
+            spool_drainer.mark_unavailable()
+            metrics.ALERTS.inc(topic, "spooled")
+            if token is not None:
+                offset_tracker.release(token)
+        elif dead_letters is not None:
+            stage, status, body = errors[-1] if errors else ("post", status, None)
+            dead_letters.add(
+                stage, topic, status=status, body=body, data=data, token=token
+            )
+            metrics.ALERTS.inc(topic, "dead_lettered")
+            if token is not None:
+                offset_tracker.release(token)
+        else:
+            metrics.ALERTS.inc(topic, "dropped")
+            if token is not None:
+                offset_tracker.ack(token, False)
+
+    def settle_future(future, topic, data, token, errors):
+        error = future.exception()
+        if error is not None:
+            errors.append(("post", None, f"{type(error).__name__}: {error}"))
+        settle_alert(
+            topic, data, token, future.result() if error is None else None, errors
+        )
+
+    alert_poster = None
+    post_alert = skyportal_api.from_fink_to_skyportal
+    if skyportal_concurrency:
+        from .utils import skyportal_api_async
+
+        alert_poster = skyportal_api_async.AlertPoster(skyportal_concurrency, log=log)
+        alert_poster.run(
+            skyportal_api_async.init_session(
+                skyportal_url, skyportal_token, pool_size=pool_size
+            )
+        )
+        post_alert = alert_poster.submit
+        log(f"Posting up to {skyportal_concurrency} alerts concurrently")
+
+    metrics_server = None
+    exported = []
+    metrics_port = _conf.get("metrics_port")
+    if metrics_port:
+        metrics_port += worker_index or 0
+        metrics_server = metrics.start_metrics_server(
+            metrics_port, _conf.get("metrics_host", metrics.DEFAULT_METRICS_HOST)
+        )
+        exported.append(
+            metrics.Gauge(
+                "skyportal_skipped_classification_writes",
+                "Classification updates skipped because nothing changed",
+                skyportal_api.skipped_classification_writes,
+            )
+        )
+        if photometry_batcher is not None:
+            exported.append(
+                metrics.Gauge(
+                    "skyportal_photometry_batch_points",
+                    "Photometry points waiting to be posted in a batch",
+                    lambda: len(photometry_batcher),
+                )
+            )
+        if object_registry is not None:
+            exported.append(
+                metrics.Gauge(
+                    "fink_object_registry_objects",
+                    "Objects known to the object registry",
+                    lambda: len(object_registry),
+                )
+            )
+        if spool is not None:
+            exported.append(
+                metrics.Gauge(
+                    "fink_spooled_alerts",
+                    "Alerts waiting in the spool",
+                    lambda: len(spool),
+                )
+            )
+        if dead_letters is not None:
+            exported.append(
+                metrics.Gauge(
+                    "fink_dead_letters",
+                    "Alerts in the dead-letter store",
+                    lambda: len(dead_letters),
+                )
+            )
+        for metric in exported:
+            metrics.register(metric)
+        log(f"Serving metrics on port {metrics_port}")
+
+    deduplicator = None
+    dedup_window = _conf.get("fink_dedup_window")
+    if dedup_window:
+        from .utils.dedup import AlertDeduplicator
+
+        deduplicator = AlertDeduplicator(_topic_ranker(fink_topics), dedup_window)
+        log(f"Dropping the copies of alerts received within {dedup_window}s")
+
+    def on_duplicate(topic, data, token):
+        metrics.ALERTS.inc(topic, "deduplicated")
+        log_debug(log, "Dropped the copy of %s from topic %s", data.object_id, topic)
+        if token is not None:
+            # the copy that is kept holds the alert back if it fails
+            for _ in range(parts):
+                offset_tracker.ack(token)
+
+    def on_reclassified(topic, data, token):
+        # the alert was posted from another topic: only its classification changes
+        metrics.ALERTS.inc(topic, "deduplicated")
+        status = skyportal_api.post_fink_classification(
+            data.object_id,
+            data.classification,
+            post_kwargs["probability"],
+            group_id,
+            taxonomy_id,
+            skyportal_url,
+            skyportal_token,
+            skyportal_name,
+            log,
+        )
+        if status != 200:
+            log(
+                f"Warning: could not update the classification of {data.object_id} "
+                f"to {data.classification} ({status})"
+            )
+        if token is not None:
+            for _ in range(parts):
+                offset_tracker.ack(token)
 
     try:
         while True:
-            topic, alert = poll_alert(consumer, maxtimeout, log)
-            data = extract_alert_data(survey, topic, alert)
-            if data is not None:
-                log(f"Received alert from topic {topic} with classification {data[10]}")
-                skyportal_api.from_fink_to_skyportal(
-                    *data[:11],
-                    probability=None,
-                    group_id=group_id,
-                    filter_id=filter_id,
-                    stream_id=stream_id,
-                    taxonomy_id=taxonomy_id,
-                    whitelisted=whitelisted,
-                    url=skyportal_url,
-                    token=skyportal_token,
-                    skyportal_name=skyportal_name,
-                    log=log,
-                    is_flux=data[11],
+            with tracing.trace("poll") as poll_trace:
+                if replay is not None:
+                    chunk = next(replay, None)
+                    if chunk is None:
+                        log("Replay done")
+                        break
+                    alerts_data = [(topic, data, None) for topic, data in chunk]
+                elif decode_pool is not None:
+                    alerts_data = _poll_pooled_alerts(
+                        consumer,
+                        decode_pool,
+                        decode_batch_size,
+                        maxtimeout,
+                        offset_tracker,
+                        parts,
+                        log,
+                        on_unparsed,
+                    )
+                elif offset_tracker is not None:
+                    alerts_data = _poll_tracked_alerts(
+                        consumer,
+                        survey,
+                        fink_batch_size or 1,
+                        maxtimeout,
+                        offset_tracker,
+                        parts,
+                        log,
+                        on_unparsed,
+                    )
+                elif fink_batch_size:
+                    alerts_data = [
+                        (topic, data, None)
+                        for topic, data in poll_alerts_batch(
+                            consumer,
+                            survey,
+                            fink_batch_size,
+                            maxtimeout,
+                            log,
+                            on_unparsed,
+                        )
+                    ]
+                else:
+                    topic, alert = poll_alert(consumer, maxtimeout, log)
+                    data = extract_alert_data(survey, topic, alert)
+                    alerts_data = []
+                    if data is not None:
+                        # kept by the consumer when it decoded the message
+                        timestamp = getattr(consumer, "timestamp", None)
+                        alerts_data.append(
+                            (topic, data._replace(timestamp=timestamp), None)
+                        )
+                    _count_extracted([topic], [data])
+                    if data is None and alert is not None and on_unparsed is not None:
+                        on_unparsed(topic, alert, None)
+                if deduplicator is not None:
+                    alerts_data = deduplicator.dedup(
+                        alerts_data, on_duplicate, on_reclassified
+                    )
+                poll_trace.set(alerts=len(alerts_data))
+            for topic, data, token in alerts_data:
+                log_debug(
+                    log,
+                    "Received alert from topic %s with classification %s",
+                    topic,
+                    data.classification,
                 )
+                if spool_drainer is not None and not spool_drainer.available():
+                    # SkyPortal is unavailable: spool the alert without trying
+                    settle_alert(topic, data, token, None)
+                    continue
+                errors = []
+                try:
+                    status = post_alert(
+                        *data[:11],
+                        is_flux=data.is_flux,
+                        # the Kafka timestamp gives the latency when
+                        # there is no offset to acknowledge
+                        photometry_tag=token if token is not None else data.timestamp,
+                        on_error=lambda *error, errors=errors: errors.append(error),
+                        **post_kwargs,
+                    )
+                except requests.RequestException as e:
+                    if spool is None and dead_letters is None:
+                        raise
+                    log(f"Warning: could not reach SkyPortal: {e}")
+                    status = None
+                    errors.append(("post", None, f"{type(e).__name__}: {e}"))
+                if alert_poster is not None and status is not None:
+                    status.add_done_callback(
+                        lambda future, topic=topic, data=data, token=token, errors=errors: (
+                            settle_future(future, topic, data, token, errors)
+                        )
+                    )
+                else:
+                    settle_alert(topic, data, token, status, errors)
+            if photometry_batcher is not None:
+                photometry_batcher.flush_if_due()
+            if offset_tracker is not None:
+                offset_tracker.commit_if_due(consumer)
     except KeyboardInterrupt:
         log("interrupted!")
+    if decode_pool is not None:
+        # chunks still being decoded were not tracked as done, so at-least-once
+        # delivery reads them again after a restart
+        decode_pool.close()
+    if spool_drainer is not None:
+        spool_drainer.stop()
+    if alert_poster is not None:
+        alert_poster.close()
+    if photometry_batcher is not None:
+        photometry_batcher.flush()
+    if offset_tracker is not None:
+        offset_tracker.commit(consumer, asynchronous=False)
+    if consumer is not None:
         consumer.close()
+    if object_registry is not None:
+        object_registry.close()
+    if spool is not None:
+        if len(spool):
+            log(f"{len(spool)} alerts left in the spool, posted at the next start")
+        spool.close()
+    if dead_letters is not None:
+        log(f"{len(dead_letters)} failed alerts in {dead_letter_path}")
+        dead_letters.close()
+    skyportal_api.close_sessions()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+        for metric in exported:
+            metrics.unregister(metric.name)
+    if trace_path:
+        tracing.configure_tracing(None)
+    if deduplicator is not None:
+        log(f"{deduplicator.dropped} copies of alerts from other topics were dropped")
+    log(
+        f"{skyportal_api.skipped_classification_writes()} unchanged "
+        "classification updates were skipped"
+    )
+
+
+def redrive_dead_letters(
+    config_path: str = None,
+    stages: list = None,
+    log: callable = None,
+    chunk_size: int = DEFAULT_REDRIVE_CHUNK_SIZE,
+):
+    """
+    Post the alerts of the dead-letter store (``dead_letter_path``) again, e.g.
+    once the cause of their failure was fixed. Alerts that could not be
+    extracted are extracted again, and photometry goes through a photometry
+    batcher. Entries posted successfully are removed from the store; the others
+    are kept with their new failing stage. Entries recorded while re-driving
+    (rejected photometry points) are left for the next run. Messages that could
+    not be decoded cannot be posted again: they are counted in the log and left
+    in the store.
+
+    Arguments
+    ----------
+    config_path : str
+        Path to a config YAML file. Defaults to config.yaml in the repo root.
+    stages : list
+        Only re-drive the entries that failed at these stages, e.g.
+        ["photometry"]. All entries if omitted.
+    log : callable
+    chunk_size : int
+        Number of entries read from the store at once
+
+    Returns
+    ----------
+    posted, failed : int, int
+        Number of entries posted, and of entries that failed again
+    """
+    if log is None:
+        log = make_log("redrive")
+
+    _conf = load_config(config_path)
+    dead_letter_path = _conf.get("dead_letter_path")
+    if not dead_letter_path:
+        raise ValueError("'dead_letter_path' is not set in the config.")
+    survey = _conf.get("survey", "ztf")
+
+    (
+        group_id,
+        stream_id,
+        filter_id,
+        taxonomy_id,
+        skyportal_url,
+        skyportal_token,
+        skyportal_name,
+        whitelisted,
+    ) = init_skyportal(
+        _conf["skyportal_url"],
+        _conf["skyportal_token"],
+        _conf["skyportal_group"],
+        _conf.get("skyportal_name"),
+        _conf["whitelisted"],
+        log,
+        _conf.get("skyportal_pool_size", skyportal_api.DEFAULT_POOL_SIZE),
+        survey,
+        _conf.get("skyportal_instrument_ttl", skyportal_api.DEFAULT_INSTRUMENT_TTL),
+        _conf.get("skyportal_rate_limit"),
+        _conf.get("skyportal_rate_burst"),
+    )
+
+    posted, failed = 0, 0
+    # with --workers, each worker has its own store
+    for path in _worker_paths(dead_letter_path) or [dead_letter_path]:
+        path_posted, path_failed = _redrive_store(
+            path,
+            survey,
+            stages,
+            chunk_size,
+            log,
+            {
+                "probability": None,
+                "group_id": group_id,
+                "filter_id": filter_id,
+                "stream_id": stream_id,
+                "taxonomy_id": taxonomy_id,
+                "whitelisted": whitelisted,
+                "url": skyportal_url,
+                "token": skyportal_token,
+                "skyportal_name": skyportal_name,
+                "log": log,
+            },
+            _conf.get("photometry_batch_size", DEFAULT_BATCH_SIZE),
+        )
+        posted += path_posted
+        failed += path_failed
+
+    skyportal_api.close_sessions()
+    return posted, failed
+
+
+def _redrive_store(
+    dead_letter_path: str,
+    survey: str,
+    stages: list,
+    chunk_size: int,
+    log: callable,
+    post_kwargs: dict,
+    batch_size: int,
+):
+    """Re-drive the entries of one dead-letter store, see redrive_dead_letters."""
+    dead_letters = DeadLetterStore(dead_letter_path)
+
+    def on_reject(points, key, status, body):
+        for point in points:
+            dead_letters.add(
+                "photometry",
+                status=status,
+                body=body,
+                data={"point": point, "key": key},
+            )
+
+    photometry_batcher = PhotometryBatcher(
+        post_kwargs["url"],
+        post_kwargs["token"],
+        max_size=batch_size,
+        log=log,
+        on_reject=on_reject,
+    )
+    last_id = dead_letters.last_id()
+    undecodable = dead_letters.undecodable()
+    log(
+        f"Re-driving up to {len(dead_letters) - undecodable} dead letters "
+        f"from {dead_letter_path}"
+    )
+    if undecodable:
+        log(
+            f"Skipping {undecodable} messages that could not be decoded: only "
+            "their topic, partition and offset are known"
+        )
+
+    posted, failed, after_id = 0, 0, 0
+    while True:
+        entries = dead_letters.entries(
+            after_id, last_id, stages, chunk_size, redrivable=True
+        )
+        if not entries:
+            break
+        done = []
+        for entry in entries:
+            after_id = entry["id"]
+            data = entry["data"]
+            if entry["alert"] is not None:
+                data = extract_alert_data(survey, entry["topic"], entry["alert"])
+                if data is None:
+                    dead_letters.update(entry["id"], "extract")
+                    failed += 1
+                    continue
+            elif isinstance(data, dict):
+                photometry_batcher.add(data["point"], *data["key"])
+                done.append(entry["id"])
+                continue
+            else:
+                data = AlertRecord(*data)
+            errors = []
+            status = skyportal_api.from_fink_to_skyportal(
+                *data[:11],
+                is_flux=data.is_flux,
+                photometry_batcher=photometry_batcher,
+                on_error=lambda *error, errors=errors: errors.append(error),
+                **post_kwargs,
+            )
+            if status == 200:
+                done.append(entry["id"])
+            else:
+                stage, status, body = errors[-1] if errors else ("post", status, None)
+                dead_letters.update(entry["id"], stage, status, body)
+                failed += 1
+        # entries are only removed once their photometry is posted
+        photometry_batcher.flush()
+        dead_letters.remove(done)
+        posted += len(done)
+
+    log(f"Re-drove {posted} dead letters, {failed} failed again")
+    dead_letters.close()
+    return posted, failed
 
 
 if __name__ == "__main__":
@@ -0,0 +1,201 @@
+import threading
+import time
+
+from . import skyportal_api, tracing
+from .records import PhotometryBatch
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_MAX_AGE = 2.0
+
+
+class PhotometryBatcher:
+    """
+    Collect photometry points and post them to SkyPortal as columnar batches,
+    one request per (instrument, group, stream, flux/mag space) combination.
+
+    Queued points are stored by column (see PhotometryBatch), so a large
+    batch takes little memory; they are handed back to the callbacks and
+    callers as dicts.
+
+    A batch is posted when it holds ``max_size`` points or when its oldest point
+    has waited ``max_age`` seconds. If SkyPortal rejects a batch, its points are
+    posted again object by object, so one bad object does not drop the others.
+    Points can be added from several threads; batches are posted outside the lock.
+
+    Arguments
+    ----------
+        url : str
+            Skyportal url
+        token : str
+            Skyportal token
+        max_size : int
+            Number of points that triggers a flush of a batch
+        max_age : float
+            Seconds after which a batch is flushed by flush_if_due
+        log : function
+            Function to log messages. Can be omitted.
+        on_flush : function
+            Called with (sent, failed), the points posted and rejected, after
+            each batch is posted. Can be omitted.
+        on_reject : function
+            Called with (points, key, status, body) for the points of each
+            object SkyPortal rejected, key being (instrument_id, group_id,
+            stream_id, is_flux). Can be omitted.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        max_size: int = DEFAULT_BATCH_SIZE,
+        max_age: float = DEFAULT_BATCH_MAX_AGE,
+        log: callable = None,
+        on_flush: callable = None,
+        on_reject: callable = None,
+    ):
+        self.url = url
+        self.token = token
+        self.max_size = max_size
+        self.max_age = max_age
+        self.log = log
+        self.on_flush = on_flush
+        self.on_reject = on_reject
+        # (instrument_id, group_id, stream_id, is_flux) -> [first_added_at, PhotometryBatch]
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(points) for _, points in self._batches.values())
+
+    def add(
+        self,
+        point: dict,
+        instrument_id: int,
+        group_id: int,
+        stream_id: int,
+        is_flux: bool = False,
+    ):
+        """
+        Queue a photometry point, flushing its batch if it is full.
+
+        Arguments
+        ----------
+            point : dict
+                object_id, mjd, filter, mag, magerr, limiting_mag, magsys, ra and dec.
+                Other keys (e.g. a tag identifying the alert) are kept but not posted.
+            instrument_id : int
+                id of the instrument used for the observation
+            group_id : int
+                id of the group to post the photometry to
+            stream_id : int
+                id of the stream to post the photometry to
+            is_flux : bool
+                True if mag/magerr/limiting_mag hold flux/fluxerr/zp
+
+        Returns
+        ----------
+            sent, failed : list, list
+                Points posted and points rejected, if the batch was flushed
+        """
+        key = (instrument_id, group_id, stream_id, is_flux)
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = [time.monotonic(), PhotometryBatch()]
+            batch[1].append(point)
+            if len(batch[1]) < self.max_size:
+                return [], []
+            del self._batches[key]
+        return self._post_batch(key, batch[1])
+
+    def flush_if_due(self):
+        """
+        Post the batches whose oldest point is older than ``max_age``.
+
+        Returns
+        ----------
+            sent, failed : list, list
+                Points posted and points rejected
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                key
+                for key, (added_at, _) in self._batches.items()
+                if now - added_at >= self.max_age
+            ]
+            batches = [(key, self._batches.pop(key)[1]) for key in due]
+        return self._post_batches(batches)
+
+    def flush(self):
+        """
+        Post all the pending batches.
+
+        Returns
+        ----------
+            sent, failed : list, list
+                Points posted and points rejected
+        """
+        with self._lock:
+            batches = [(key, points) for key, (_, points) in self._batches.items()]
+            self._batches.clear()
+        return self._post_batches(batches)
+
+    def _post_batches(self, batches: list):
+        sent, failed = [], []
+        for key, points in batches:
+            key_sent, key_failed = self._post_batch(key, points)
+            sent.extend(key_sent)
+            failed.extend(key_failed)
+        return sent, failed
+
+    @tracing.traced("photometry_batch")
+    def _post_batch(self, key: tuple, points: PhotometryBatch):
+        sent, failed = self._post_points(key, points)
+        if self.on_flush is not None:
+            self.on_flush(sent, failed)
+        return sent, failed
+
+    def _post_points(self, key: tuple, points: PhotometryBatch):
+        status, _, body = self._post(points, key)
+        if status == 200:
+            if self.log is not None:
+                self.log(f"Posted a batch of {len(points)} photometry points")
+            return points.points(), []
+
+        if self.log is not None:
+            self.log(
+                f"Warning: photometry batch of {len(points)} points returned {status}, "
+                "posting them object by object"
+            )
+        sent, failed = [], []
+        for object_id, indices in points.indices_by_object().items():
+            object_points = points.select(indices)
+            status, _, body = self._post(object_points, key)
+            if status == 200:
+                sent.extend(object_points.points())
+            else:
+                failed.extend(object_points.points())
+                if self.on_reject is not None:
+                    self.on_reject(object_points.points(), key, status, body)
+                if self.log is not None:
+                    self.log(
+                        f"Warning: post_photometry returned {status} for {object_id}: {body}"
+                    )
+        return sent, failed
+
+    def _post(self, points: PhotometryBatch, key: tuple):
+        instrument_id, group_id, stream_id, is_flux = key
+        status, ids, body = skyportal_api.post_photometry_batch(
+            points,
+            instrument_id,
+            [group_id],
+            [stream_id],
+            url=self.url,
+            token=self.token,
+            is_flux=is_flux,
+        )
+        if skyportal_api._is_unknown_instrument_error(status, body):
+            skyportal_api.invalidate_instrument_id(url=self.url)
+        return status, ids, body
@@ -0,0 +1,229 @@
+import base64
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_REDRIVE_CHUNK_SIZE = 500
+
+# entries of messages that could not be decoded hold neither an alert nor data,
+# only their offset: they cannot be posted again
+_REDRIVABLE = "(alert IS NOT NULL OR data IS NOT NULL)"
+
+
+def _to_json(value):
+    """Convert the values json cannot serialise (numpy, bytes) to Python values."""
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def _compact_alert(alert: dict):
+    """Drop the image cutouts, by far the largest part of an alert and not needed to post it."""
+    return {key: value for key, value in alert.items() if not key.startswith("cutout")}
+
+
+def _pack(value):
+    if value is None:
+        return None
+    return zlib.compress(json.dumps(value, default=_to_json).encode())
+
+
+def _unpack(value):
+    if value is None:
+        return None
+    return json.loads(zlib.decompress(value))
+
+
+class DeadLetterStore:
+    """
+    Keep the alerts that could not be extracted or written to SkyPortal in a
+    SQLite file, with the failing stage and SkyPortal's answer, so that they
+    can be posted again (see redrive_dead_letters) once the cause is fixed
+    instead of being lost. Safe to use from several threads.
+
+    An entry holds the raw alert (without its cutouts) if it could not be
+    extracted, the extracted data if its writes failed, or a photometry point
+    and its batch key (instrument_id, group_id, stream_id, is_flux) if a
+    photometry batch rejected it. Alerts and data are stored as compressed JSON.
+    Messages that could not be decoded only have their Kafka offset recorded:
+    they cannot be re-driven, and are kept so they can be read again from Kafka.
+
+    Arguments
+    ----------
+        path : str
+            SQLite file of the dead letters, created if needed
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters (id INTEGER PRIMARY KEY "
+            "AUTOINCREMENT, created_at REAL, attempts INTEGER, stage TEXT, "
+            "status INTEGER, body TEXT, topic TEXT, partition INTEGER, "
+            "offset INTEGER, alert BLOB, data BLOB)"
+        )
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def add(
+        self,
+        stage: str,
+        topic: str = None,
+        status: int = None,
+        body=None,
+        data=None,
+        alert: dict = None,
+        token: tuple = None,
+    ):
+        """
+        Record a failed alert.
+
+        Arguments
+        ----------
+            stage : str
+                Step that failed, e.g. "extract", "source" or "photometry"
+            topic : str
+                Topic the alert was received from
+            status : int
+                Status returned by SkyPortal, if any
+            body : str or dict
+                Response body returned by SkyPortal, if any
+            data : list or dict
+                Extracted alert data, or {"point": point, "key": key} for a
+                rejected photometry point
+            alert : dict
+                Raw alert, for alerts that could not be extracted
+            token : tuple
+                (topic, partition, offset) of the Kafka message, if known
+
+        Returns
+        ----------
+            None
+        """
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body, default=_to_json)
+        partition, offset = token[1:] if token is not None else (None, None)
+        row = (
+            time.time(),
+            stage,
+            status,
+            body,
+            topic,
+            partition,
+            offset,
+            _pack(_compact_alert(alert) if alert is not None else None),
+            _pack(list(data) if isinstance(data, (list, tuple)) else data),
+        )
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO dead_letters (created_at, attempts, stage, status, "
+                "body, topic, partition, offset, alert, data) "
+                "VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            self._db.commit()
+
+    def last_id(self):
+        """Id of the latest entry, 0 if there is none."""
+        with self._lock:
+            return (
+                self._db.execute("SELECT MAX(id) FROM dead_letters").fetchone()[0] or 0
+            )
+
+    def undecodable(self):
+        """Number of entries that cannot be re-driven, see DeadLetterStore."""
+        with self._lock:
+            return self._db.execute(
+                f"SELECT COUNT(*) FROM dead_letters WHERE NOT {_REDRIVABLE}"
+            ).fetchone()[0]
+
+    def entries(
+        self,
+        after_id: int = 0,
+        until_id: int = None,
+        stages: list = None,
+        count=None,
+        redrivable: bool = False,
+    ):
+        """
+        Return entries in insertion order.
+
+        Arguments
+        ----------
+            after_id : int
+                Only return entries with a greater id
+            until_id : int
+                Only return entries up to this id
+            stages : list
+                Only return entries of these stages
+            count : int
+                Maximum number of entries returned
+            redrivable : bool
+                If True, leave out the entries that cannot be re-driven
+
+        Returns
+        ----------
+            list
+                dicts with the id, created_at, attempts, stage, status, body,
+                topic, partition, offset, alert and data of each entry
+        """
+        query = "SELECT * FROM dead_letters WHERE id > ?"
+        args = [after_id]
+        if until_id is not None:
+            query += " AND id <= ?"
+            args.append(until_id)
+        if stages:
+            query += f" AND stage IN ({', '.join('?' * len(stages))})"
+            args.extend(stages)
+        if redrivable:
+            query += f" AND {_REDRIVABLE}"
+        query += " ORDER BY id"
+        if count is not None:
+            query += " LIMIT ?"
+            args.append(count)
+        with self._lock:
+            cursor = self._db.execute(query, args)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        entries = [dict(zip(columns, row)) for row in rows]
+        for entry in entries:
+            entry["alert"] = _unpack(entry["alert"])
+            entry["data"] = _unpack(entry["data"])
+        return entries
+
+    def update(self, id: int, stage: str, status: int = None, body=None):
+        """Record that posting an entry again failed, possibly at another stage."""
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body, default=_to_json)
+        with self._lock:
+            self._db.execute(
+                "UPDATE dead_letters SET attempts = attempts + 1, stage = ?, "
+                "status = ?, body = ? WHERE id = ?",
+                (stage, status, body, id),
+            )
+            self._db.commit()
+
+    def remove(self, ids: list):
+        """Remove entries, once they were posted."""
+        if not ids:
+            return
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM dead_letters WHERE id = ?", [(id,) for id in ids]
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
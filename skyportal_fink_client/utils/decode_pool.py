@@ -0,0 +1,219 @@
+import math
+import multiprocessing
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from fink_client.consumer import AlertConsumer
+
+from .decoding import ProjectedDecoder, ProjectedDecodingMixin
+
+DEFAULT_BATCH_SIZE = 500
+
+# processes must not be forked once threads run, see DecodePool
+_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# decoder of the current pool process, set by _init_process
+_decoder = None
+
+
+class _RawMessage:
+    """The parts of a Kafka message that decoding reads, sent to the pool."""
+
+    __slots__ = ("_topic", "_key", "_value")
+
+    def __init__(self, topic: str, key: bytes, value: bytes):
+        self._topic = topic
+        self._key = key
+        self._value = value
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return self._topic
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+
+class _Decoder(ProjectedDecodingMixin, AlertConsumer):
+    """AlertConsumer that only decodes messages, without a Kafka connection."""
+
+    def __init__(self, decoder: ProjectedDecoder, schema_path: str = None):
+        self.decoder = decoder
+        self.schema_path = schema_path
+        self.dump_schema = False
+
+
+def _init_process(schema_path: str, fields: list, initializer: callable, initargs):
+    """Set up a pool process."""
+    global _decoder
+    # Ctrl+C is handled by the polling process, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _decoder = _Decoder(ProjectedDecoder(fields), schema_path)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _decode_and_extract(extract: callable, survey: str, messages: list):
+    """
+    Decode (topic, key, value) messages and extract the alerts, in a pool
+    process. Returns one (decoded, data, alert) tuple per message; the alert
+    dict is only sent back if it was decoded but could not be extracted.
+    """
+    topics = [topic for topic, _, _ in messages]
+    alerts = []
+    for topic, key, value in messages:
+        try:
+            alerts.append(_decoder.process_message(_RawMessage(topic, key, value))[1])
+        except Exception:
+            alerts.append(None)
+    valid = [i for i, alert in enumerate(alerts) if alert is not None]
+    records = [None] * len(messages)
+    if valid:
+        extracted = extract(
+            survey, [topics[i] for i in valid], [alerts[i] for i in valid]
+        )
+        for i, data in zip(valid, extracted):
+            records[i] = data
+    return [
+        (alert is not None, data, alert if data is None else None)
+        for alert, data in zip(alerts, records)
+    ]
+
+
+class DecodePool:
+    """
+    Decode and extract alerts in a pool of processes, so that neither the Avro
+    decoding nor the classification hold the polling loop back. Only the
+    message keys and values are sent to the processes, and only the extracted
+    AlertRecords come back, along with the alerts that could not be extracted.
+
+    Results are returned in the order the messages were submitted, so the
+    alerts of a partition (and of an object) are still posted in order, and
+    their offsets are committed in order.
+
+    The processes are started from a fork server rather than forked from the
+    polling process, which already runs threads (Kafka, posting, metrics)
+    whose locks a forked child could inherit held.
+
+    Arguments
+    ----------
+        extract : callable
+            Module-level function called as extract(survey, topics, alerts) in
+            the processes, e.g. extract_alerts_data
+        survey : str
+            ``ztf`` or ``lsst``
+        processes : int
+            Number of processes
+        schema_path : str
+            Avro schema of the messages that do not carry theirs
+        fields : list
+            Names of the top-level alert fields to decode, all if omitted
+        initializer : callable
+            Module-level function called with ``initargs`` when a process
+            starts, e.g. warm_up
+        initargs : tuple
+        max_pending : int
+            Number of chunks decoded at once, twice ``processes`` by default
+    """
+
+    def __init__(
+        self,
+        extract: callable,
+        survey: str,
+        processes: int,
+        schema_path: str = None,
+        fields: list = None,
+        initializer: callable = None,
+        initargs: tuple = (),
+        max_pending: int = None,
+    ):
+        self.extract = extract
+        self.survey = survey
+        self.processes = processes
+        self.max_pending = max_pending or 2 * processes
+        self._executor = ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context(_START_METHOD),
+            initializer=_init_process,
+            initargs=(schema_path, fields, initializer, initargs),
+        )
+        # (messages, tokens, future) of the submitted chunks, oldest first
+        self._pending = deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def full(self):
+        """Return True if no more chunks should be submitted before results are taken."""
+        return len(self._pending) >= self.max_pending
+
+    def submit(self, messages: list, tokens: list = None):
+        """
+        Decode and extract Kafka messages, split in one chunk per process.
+
+        Arguments
+        ----------
+            messages : list
+                confluent_kafka.Message
+            tokens : list
+                Value returned along with each message, e.g. its OffsetTracker
+                token. Can be omitted.
+
+        Returns
+        ----------
+            None
+        """
+        if tokens is None:
+            tokens = [None] * len(messages)
+        size = max(math.ceil(len(messages) / self.processes), 1)
+        for start in range(0, len(messages), size):
+            chunk = messages[start : start + size]
+            future = self._executor.submit(
+                _decode_and_extract,
+                self.extract,
+                self.survey,
+                [
+                    (message.topic(), message.key(), message.value())
+                    for message in chunk
+                ],
+            )
+            self._pending.append((chunk, tokens[start : start + size], future))
+
+    def results(self, wait: bool = False):
+        """
+        Return the results of the oldest chunks that are done, in order.
+
+        Arguments
+        ----------
+            wait : bool
+                If True, wait for the oldest chunk if it is not done yet
+
+        Returns
+        ----------
+            list
+                (topic, decoded, data, alert, token) tuples: data is the
+                extracted AlertRecord, or None if the alert could not be
+                decoded (decoded is False) or extracted (alert is then the
+                decoded alert)
+        """
+        results = []
+        while self._pending and (self._pending[0][2].done() or (wait and not results)):
+            messages, tokens, future = self._pending.popleft()
+            for message, token, (decoded, data, alert) in zip(
+                messages, tokens, future.result()
+            ):
+                results.append((message.topic(), decoded, data, alert, token))
+        return results
+
+    def close(self):
+        """Stop the processes, dropping the chunks that were not decoded yet."""
+        self._pending.clear()
+        self._executor.shutdown(cancel_futures=True)
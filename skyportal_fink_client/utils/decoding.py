@@ -0,0 +1,240 @@
+import gzip
+import io
+import json
+import threading
+
+import confluent_kafka
+import fastavro
+from fink_client.consumer import AlertConsumer
+
+from . import tracing
+
+DEFAULT_MAX_SCHEMAS = 16
+
+
+def project_schema(schema: dict, fields: list):
+    """
+    Build a reader schema that keeps only some top-level fields of an alert
+    schema. Decoding with it skips the other fields (e.g. cutouts and
+    prv_candidates for ZTF) instead of building them.
+
+    Arguments
+    ----------
+        schema : dict
+            Writer schema of the alerts, as JSON
+        fields : list
+            Names of the top-level fields to keep; the ones missing from the
+            schema are ignored
+
+    Returns
+    ----------
+        dict or None
+            Parsed reader schema, or None if it cannot be used, e.g. if a kept
+            field refers to a type defined in a dropped one
+    """
+    keep = set(fields)
+    projected = {
+        **schema,
+        "fields": [field for field in schema["fields"] if field["name"] in keep],
+    }
+    try:
+        return fastavro.parse_schema(projected)
+    except (fastavro.schema.SchemaParseException, fastavro.schema.UnknownType):
+        return None
+
+
+class ProjectedDecoder:
+    """
+    Decode Fink alerts keeping only some top-level fields, with the writer
+    schema sent as the Kafka message key. Parsed schemas are cached by key, so
+    a schema is parsed once instead of once per message. Safe to use from
+    several threads.
+
+    Arguments
+    ----------
+        fields : list
+            Names of the top-level alert fields to keep. If None, alerts are
+            decoded in full, only the schemas are cached.
+        max_schemas : int
+            Number of schemas kept in the cache
+    """
+
+    def __init__(self, fields: list, max_schemas: int = DEFAULT_MAX_SCHEMAS):
+        self.fields = list(fields) if fields is not None else None
+        self.max_schemas = max_schemas
+        # message key -> (writer schema, reader schema), or None if not a schema
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def schemas(self, key):
+        """
+        Return the parsed (writer, reader) schemas of a message key, or None if
+        the key does not hold a schema (older Fink streams and test alerts).
+        The reader schema is None if the projection cannot be used.
+        """
+        if key is None:
+            return None
+        with self._lock:
+            if key in self._schemas:
+                return self._schemas[key]
+        try:
+            schema = json.loads(key)
+            writer = fastavro.parse_schema(schema)
+        except (ValueError, TypeError, fastavro.schema.SchemaParseException):
+            schemas = None
+        else:
+            reader = None
+            if self.fields is not None:
+                reader = project_schema(schema, self.fields)
+            schemas = (writer, reader)
+        with self._lock:
+            if len(self._schemas) >= self.max_schemas:
+                self._schemas.clear()
+            self._schemas[key] = schemas
+        return schemas
+
+    def decode(self, schemas: tuple, value: bytes):
+        """Decode a message value with schemas returned by schemas()."""
+        writer, reader = schemas
+        return fastavro.schemaless_reader(io.BytesIO(value), writer, reader)
+
+
+def message_timestamp(message):
+    """
+    Return the Kafka timestamp of a message, in seconds.
+
+    Arguments
+    ----------
+        message : confluent_kafka.Message
+
+    Returns
+    ----------
+        float or None
+            None if the message has no timestamp
+    """
+    if not hasattr(message, "timestamp"):
+        return None
+    kind, value = message.timestamp()
+    if kind == confluent_kafka.TIMESTAMP_NOT_AVAILABLE:
+        return None
+    return value / 1000
+
+
+class ProjectedDecodingMixin:
+    """
+    Mixin for AlertConsumer classes: messages are decoded with ``decoder``
+    (a ProjectedDecoder) when it is set, and by AlertConsumer otherwise, or
+    when the message key does not hold a schema. Also consumes messages
+    without decoding them (consume_messages) or decoding them one by one
+    (poll_messages). The Kafka timestamp of the last message processed is
+    kept in ``timestamp``.
+    """
+
+    decoder = None
+    timestamp = None
+
+    def poll_messages(self, num_alerts: int = 1, timeout: float = -1):
+        """
+        Consume up to ``num_alerts`` messages and decode them one by one, so a
+        message that cannot be decoded does not discard the others.
+
+        Arguments
+        ----------
+            num_alerts : int
+                Maximum number of messages to return
+            timeout : float
+                Maximum time to block waiting for messages
+
+        Returns
+        ----------
+            list
+                (topic, alert, message) tuples; alert is None if the message
+                could not be decoded. Empty on timeout.
+        """
+        with tracing.span("consume"):
+            if num_alerts == 1:
+                message = self._consumer.poll(timeout)
+                messages = [] if message is None else [message]
+            else:
+                messages = self._consumer.consume(num_alerts, timeout)
+        alerts = []
+        for message in messages:
+            try:
+                with tracing.span("decode"):
+                    topic, alert, _ = self.process_message(message)
+            except Exception:
+                topic, alert = message.topic(), None
+            alerts.append((topic, alert, message))
+        return alerts
+
+    def consume_messages(self, num_alerts: int, timeout: float):
+        """
+        Consume up to ``num_alerts`` Kafka messages without decoding them.
+
+        Returns
+        ----------
+            list
+                confluent_kafka.Message, without the ones reporting an error
+        """
+        messages = self._consumer.consume(num_alerts, timeout)
+        return [message for message in messages if not message.error()]
+
+    def process_message(self, msg):
+        self.timestamp = message_timestamp(msg)
+        decoder = self.decoder
+        if decoder is None or msg.error():
+            return super().process_message(msg)
+        key = msg.key()
+        schemas = decoder.schemas(key)
+        if schemas is None:
+            return super().process_message(msg)
+        return msg.topic(), decoder.decode(schemas, msg.value()), key
+
+
+class ProjectedAlertConsumer(ProjectedDecodingMixin, AlertConsumer):
+    """
+    AlertConsumer decoding only some top-level fields of the alerts, or all of
+    them if ``decoder`` is None.
+
+    Arguments
+    ----------
+        topics : list
+            Topics to subscribe to
+        config : dict
+            Same configuration as AlertConsumer
+        decoder : ProjectedDecoder
+            Can be None
+        **kwargs
+            Other AlertConsumer arguments (survey, schema_path)
+    """
+
+    def __init__(self, topics: list, config: dict, decoder: ProjectedDecoder, **kwargs):
+        self.decoder = decoder
+        super().__init__(topics, config, **kwargs)
+
+
+def read_avro_file(path: str, fields: list = None):
+    """
+    Read the alerts of an Avro file (.avro or .avro.gz), keeping only
+    ``fields`` at the top level if given.
+
+    Arguments
+    ----------
+        path : str
+            Avro file
+        fields : list
+            Names of the top-level alert fields to keep, all if omitted
+
+    Returns
+    ----------
+        list
+            Alert dicts
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        reader_schema = None
+        if fields is not None:
+            schema = json.loads(fastavro.reader(file).metadata["avro.schema"])
+            reader_schema = project_schema(schema, fields)
+            file.seek(0)
+        return list(fastavro.reader(file, reader_schema=reader_schema))
@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict
+
+# Seconds during which the copies of an alert received on other topics are dropped
+DEFAULT_DEDUP_WINDOW = 600.0
+
+# Alerts remembered at most, the oldest are forgotten first
+DEFAULT_MAX_ALERTS = 1_000_000
+
+
+class AlertDeduplicator:
+    """
+    Drop the copies of an alert that Fink sent on several of the subscribed
+    topics, so that it is only posted to SkyPortal once. Alerts are identified
+    by their object and AlertRecord.alert_id (candid for ZTF, diaSourceId for
+    LSST); records without an alert_id are never dropped.
+
+    The copies received in the same poll are merged into one alert, at the
+    position of the first one, carrying the classification of the copy whose
+    topic ranks best. A copy received later, within ``window`` seconds, is
+    dropped; if its topic ranks better than the one already posted, it is
+    handed to ``on_reclassified`` instead, so that only the classification of
+    the alert is updated. Not thread-safe.
+
+    Arguments
+    ----------
+        rank : callable
+            Called with a topic, returns a sortable rank: the copy with the
+            lowest rank is kept
+        window : float
+            Seconds an alert is remembered for
+        max_alerts : int
+            Number of alerts remembered at most
+    """
+
+    def __init__(
+        self,
+        rank: callable,
+        window: float = DEFAULT_DEDUP_WINDOW,
+        max_alerts: int = DEFAULT_MAX_ALERTS,
+    ):
+        self.rank = rank
+        self.window = window
+        self.max_alerts = max_alerts
+        # (object_id, alert_id) -> (rank of the copy posted, time first seen)
+        self._seen = OrderedDict()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _expire(self, now: float):
+        while self._seen and (
+            len(self._seen) > self.max_alerts
+            or next(iter(self._seen.values()))[1] <= now - self.window
+        ):
+            self._seen.popitem(last=False)
+
+    def dedup(
+        self,
+        alerts_data: list,
+        on_duplicate: callable = None,
+        on_reclassified: callable = None,
+    ):
+        """
+        Drop the copies of alerts already received.
+
+        Arguments
+        ----------
+            alerts_data : list
+                (topic, data, token) tuples of a poll, data being an AlertRecord
+            on_duplicate : callable
+                Called with (topic, data, token) for each copy dropped, e.g. to
+                acknowledge its offset. Can be omitted.
+            on_reclassified : callable
+                Called with (topic, data, token) for each copy of an alert
+                posted by an earlier poll whose topic ranks better, to update
+                the classification. Such copies are dropped if omitted.
+
+        Returns
+        ----------
+            list
+                The (topic, data, token) tuples to post, in the same order
+        """
+        now = time.monotonic()
+        self._expire(now)
+        kept = []
+        # key -> index in kept of the copy of this poll
+        batch = {}
+        for entry in alerts_data:
+            topic, data, _ = entry
+            if data.alert_id is None:
+                kept.append(entry)
+                continue
+            key = (data.object_id, data.alert_id)
+            rank = self.rank(topic)
+            if key in batch:
+                index = batch[key]
+                duplicate = entry
+                if rank < self.rank(kept[index][0]):
+                    duplicate, kept[index] = kept[index], entry
+                    self._seen[key] = (rank, self._seen[key][1])
+            elif key in self._seen:
+                duplicate = entry
+                if rank < self._seen[key][0] and on_reclassified is not None:
+                    self._seen[key] = (rank, self._seen[key][1])
+                    on_reclassified(*entry)
+                    continue
+            else:
+                batch[key] = len(kept)
+                kept.append(entry)
+                self._seen[key] = (rank, now)
+                continue
+            self.dropped += 1
+            if on_duplicate is not None:
+                on_duplicate(*duplicate)
+        self._expire(now)
+        return kept
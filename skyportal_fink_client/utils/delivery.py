@@ -0,0 +1,301 @@
+import logging
+import threading
+import time
+
+import confluent_kafka
+from fink_client.consumer import AlertConsumer
+
+from . import metrics
+from .decoding import ProjectedDecoder, ProjectedDecodingMixin, message_timestamp
+
+DEFAULT_COMMIT_INTERVAL = 5.0
+DEFAULT_COMMIT_EVERY = 1000
+
+
+class ManualCommitConsumer(ProjectedDecodingMixin, AlertConsumer):
+    """
+    AlertConsumer with Kafka auto-commit turned off, for at-least-once delivery:
+    offsets are only committed through commit(), once the alerts are in SkyPortal.
+
+    Arguments
+    ----------
+        topics : list
+            Topics to subscribe to
+        config : dict
+            Same configuration as AlertConsumer
+        survey : str
+            ``ztf`` or ``lsst``
+        schema_path : str
+            Path to a local avsc schema for decoding
+        on_revoke : callable
+            Called with (consumer, partitions) before partitions are taken away
+            from this consumer, e.g. to commit what was processed for them.
+        decoder : ProjectedDecoder
+            If given, only some top-level fields of the alerts are decoded.
+    """
+
+    def __init__(
+        self,
+        topics: list,
+        config: dict,
+        survey: str,
+        schema_path: str = None,
+        on_revoke: callable = None,
+        decoder: ProjectedDecoder = None,
+    ):
+        self.decoder = decoder
+        # subscribed below, once the consumer has auto-commit turned off, so
+        # that the group is only joined once (AlertConsumer warns otherwise)
+        previous = logging.root.manager.disable
+        logging.disable(logging.WARNING)
+        try:
+            super().__init__(
+                [],
+                {**config, "enable.auto.commit": False},
+                survey=survey,
+                schema_path=schema_path,
+            )
+        finally:
+            logging.disable(previous)
+        self._topics = topics
+        if self._kafka_config.get("enable.auto.commit") is not False:
+            # fink_client only passes some keys of the configuration on to
+            # Kafka: the consumer, not subscribed yet, is replaced
+            self._consumer.close()
+            self._kafka_config = {**self._kafka_config, "enable.auto.commit": False}
+            self._consumer = confluent_kafka.Consumer(self._kafka_config)
+        if on_revoke is not None:
+            self._consumer.subscribe(self._topics, on_revoke=on_revoke)
+        else:
+            self._consumer.subscribe(self._topics)
+
+    def commit(self, offsets: list, asynchronous: bool = True):
+        """
+        Commit offsets to Kafka.
+
+        Arguments
+        ----------
+            offsets : list
+                confluent_kafka.TopicPartition with the next offset to read
+            asynchronous : bool
+                If False, wait for the broker to acknowledge the commit
+
+        Returns
+        ----------
+            None
+        """
+        if offsets:
+            self._consumer.commit(offsets=offsets, asynchronous=asynchronous)
+
+
+class OffsetTracker:
+    """
+    Track which Kafka messages have been fully ingested in SkyPortal, and
+    commit for each partition the offset after the last message that was
+    ingested along with all the messages before it.
+
+    A message can need several acknowledgements (``parts``), e.g. one for the
+    source/candidate/classification writes and one for its batched photometry.
+    A message is committed once all its parts are acknowledged, even if a write
+    failed for good: the failure is logged and counted by the caller, and
+    holding the partition back would keep every later message in memory and
+    post them all again after a restart. Messages that are not acknowledged
+    yet (e.g. still being posted) are delivered again after a restart.
+    Acknowledgements can come from any thread.
+
+    Arguments
+    ----------
+        commit_interval : float
+            Seconds between two commits triggered by commit_if_due
+        commit_every : int
+            Number of acknowledgements that trigger a commit in commit_if_due
+        log : function
+            Function to log messages. Can be omitted.
+    """
+
+    def __init__(
+        self,
+        commit_interval: float = DEFAULT_COMMIT_INTERVAL,
+        commit_every: int = DEFAULT_COMMIT_EVERY,
+        log: callable = None,
+    ):
+        self.commit_interval = commit_interval
+        self.commit_every = commit_every
+        self.log = log
+        # (topic, partition) -> {offset: [parts left, ok, Kafka timestamp]}, in offset order
+        self._pending = {}
+        self._acks = 0
+        self._committed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def track(self, message, parts: int = 1):
+        """
+        Start tracking a message.
+
+        Arguments
+        ----------
+            message : confluent_kafka.Message
+            parts : int
+                Number of acknowledgements needed. With 0 the message is
+                done right away (e.g. an alert that will not be posted).
+
+        Returns
+        ----------
+            token : tuple
+                (topic, partition, offset), to pass to ack
+        """
+        token = (message.topic(), message.partition(), message.offset())
+        timestamp = message_timestamp(message)
+        with self._lock:
+            self._pending.setdefault(token[:2], {})[token[2]] = [parts, True, timestamp]
+        return token
+
+    def ack(self, token: tuple, ok: bool = True):
+        """
+        Acknowledge one part of a tracked message.
+
+        Arguments
+        ----------
+            token : tuple
+                Token returned by track
+            ok : bool
+                False if the SkyPortal write failed for good: the message is
+                committed, but not counted in the latency histogram
+
+        Returns
+        ----------
+            None
+        """
+        with self._lock:
+            entry = self._pending.get(token[:2], {}).get(token[2])
+            if entry is None:
+                # partition revoked in the meantime
+                return
+            entry[0] -= 1
+            entry[1] = entry[1] and ok
+            self._acks += 1
+            if entry[0] == 0 and entry[1] and entry[2] is not None:
+                # the alert is fully in SkyPortal, batched photometry included
+                metrics.ALERT_LATENCY.observe(time.time() - entry[2])
+
+    def release(self, token: tuple):
+        """
+        Stop tracking a message whose alert was handed over elsewhere, e.g.
+        written to the spool, so that it no longer holds back the commit.
+        Later acknowledgements of its parts are ignored.
+
+        Arguments
+        ----------
+            token : tuple
+                Token returned by track
+
+        Returns
+        ----------
+            None
+        """
+        with self._lock:
+            self._pending.get(token[:2], {}).pop(token[2], None)
+            self._acks += 1
+
+    def ack_points(self, sent: list, failed: list):
+        """
+        Acknowledge batched photometry points tagged with tokens, meant to be
+        used as the PhotometryBatcher ``on_flush`` callback.
+
+        Arguments
+        ----------
+            sent : list
+                Points posted to SkyPortal
+            failed : list
+                Points SkyPortal rejected
+
+        Returns
+        ----------
+            None
+        """
+        for point in sent:
+            if point.get("tag") is not None:
+                self.ack(point["tag"])
+        for point in failed:
+            if point.get("tag") is not None:
+                self.ack(point["tag"], ok=False)
+
+    def _offsets_to_commit(self):
+        """Pop the handled prefix of each partition and return the offsets to commit."""
+        offsets = []
+        for (topic, partition), entries in self._pending.items():
+            last = None
+            while entries:
+                offset = next(iter(entries))
+                parts, ok, _ = entries[offset]
+                if parts > 0:
+                    break
+                if not ok and self.log is not None:
+                    self.log(
+                        f"Warning: offset {offset} of {topic}[{partition}] was not "
+                        "ingested, committed anyway"
+                    )
+                last = offset
+                del entries[offset]
+            if last is not None:
+                offsets.append(
+                    confluent_kafka.TopicPartition(topic, partition, last + 1)
+                )
+        return offsets
+
+    def commit(self, consumer: ManualCommitConsumer, asynchronous: bool = True):
+        """
+        Commit the offsets of all the partitions that progressed.
+
+        Arguments
+        ----------
+            consumer : ManualCommitConsumer
+            asynchronous : bool
+                If False, wait for the broker to acknowledge the commit
+
+        Returns
+        ----------
+            offsets : list
+                Committed confluent_kafka.TopicPartition
+        """
+        with self._lock:
+            offsets = self._offsets_to_commit()
+            self._acks = 0
+            self._committed_at = time.monotonic()
+        consumer.commit(offsets, asynchronous=asynchronous)
+        return offsets
+
+    def commit_if_due(self, consumer: ManualCommitConsumer):
+        """
+        Commit if ``commit_every`` acknowledgements were received or
+        ``commit_interval`` seconds passed since the last commit.
+
+        Returns
+        ----------
+            offsets : list
+                Committed confluent_kafka.TopicPartition
+        """
+        with self._lock:
+            due = (
+                self._acks >= self.commit_every
+                or time.monotonic() - self._committed_at >= self.commit_interval
+            )
+        if not due:
+            return []
+        return self.commit(consumer)
+
+    def revoke(self, consumer: ManualCommitConsumer, partitions: list):
+        """
+        Commit what was ingested for revoked partitions and stop tracking them.
+        Meant to be used as the consumer's ``on_revoke`` callback.
+
+        Returns
+        ----------
+            None
+        """
+        with self._lock:
+            offsets = self._offsets_to_commit()
+            for partition in partitions:
+                self._pending.pop((partition.topic, partition.partition), None)
+        if offsets:
+            consumer.commit(offsets=offsets, asynchronous=False)
@@ -1,4 +1,9 @@
+import atexit
 import os
+import queue
+import sys
+import threading
+import time
 import zlib
 from datetime import datetime
 
@@ -18,8 +23,19 @@ COLOR_TABLE = [
     "default",
 ]
 
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+DEFAULT_LOG_DIR = "logs"
+DEFAULT_LOG_LEVEL = "debug"
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+# Messages waiting to be written after which new ones are dropped
+DEFAULT_MAX_QUEUE = 100_000
+
+_COLORS = ["red", "green", "yellow", "blue", "magenta", "cyan", "white"]
+
 # Here, to stay consistent with the rest of SkyPortal's & baselayer's code, we use the same methods for logging.
-# The only addition is the save_to_file method.
+# The additions are the save_to_file method and the LogWriter backend.
 
 
 def save_to_file(app, message):
@@ -97,9 +113,290 @@ def colorize(s, fg=None, bg=None, bold=False, underline=False, reverse=False):
     return style_start + s + style_end
 
 
-def log(app, message):
+class LogWriter:
+    """
+    Background log writer: messages are put on a queue and a single thread
+    prints them and appends them to ``{directory}/{app}.log``. The log files
+    stay open, everything read from the queue at once is written and flushed
+    together, and files are rotated by size and/or age. If the thread falls
+    behind by ``max_queue`` messages, new ones are dropped and counted in
+    ``dropped`` instead of filling the memory, and a warning with their number
+    is logged once the queue has room again.
+
+    Arguments
+    ----------
+        directory : str
+            Directory of the log files
+        max_bytes : int
+            Rotate a file once it reaches this size. None to disable.
+        rotate_interval : float
+            Rotate a file once it has been open for this many seconds.
+            None to disable.
+        backup_count : int
+            Number of rotated files to keep ({app}.log.1 is the most recent)
+        console : bool
+            Whether to print the messages as well
+        max_queue : int
+            Number of queued messages after which new ones are dropped
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_LOG_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        rotate_interval: float = None,
+        backup_count: int = DEFAULT_BACKUP_COUNT,
+        console: bool = True,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.console = console
+        self.max_queue = max_queue
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._thread = None
+        # messages dropped because the queue was full, and how many of them
+        # were reported in the log
+        self.dropped = 0
+        self._reported = 0
+        # app -> [file, size, opened_at]
+        self._files = {}
+
+    def write(self, app: str, message: str, timestamp: float = None):
+        """Queue a message, starting the writer thread if needed."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="log-writer", daemon=True
+                    )
+                    self._thread.start()
+        try:
+            self._queue.put_nowait((app, message, timestamp or time.time()))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def configure(self, **settings):
+        """
+        Change directory, max_bytes, rotate_interval, backup_count or console.
+        Applied in order with the queued messages; open files are reopened.
+        """
+        unknown = set(settings) - {
+            "directory",
+            "max_bytes",
+            "rotate_interval",
+            "backup_count",
+            "console",
+        }
+        if unknown:
+            raise ValueError(f"Unknown log settings: {sorted(unknown)}")
+        self._call(self._apply, settings)
+
+    def flush(self):
+        """Wait until all the messages queued so far are written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._call(lambda: None)
+
+    def close(self):
+        """Write the queued messages, stop the writer thread and close the files."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._close_files()
+        self._thread = None
+
+    def _call(self, function, *args):
+        """Run function in the writer thread (or here if it is not running) and wait."""
+        if self._thread is None or not self._thread.is_alive():
+            function(*args)
+            return
+        done = threading.Event()
+        self._queue.put((function, args, done))
+        done.wait()
+
+    def _apply(self, settings):
+        self._close_files()
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            try:
+                while True:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            for item in items:
+                if item is None:
+                    self._write_batch(lines)
+                    return
+                if len(item) == 3 and callable(item[0]):
+                    # flush/configure: everything before it must be written first
+                    self._write_batch(lines)
+                    lines = []
+                    function, args, done = item
+                    try:
+                        function(*args)
+                    finally:
+                        done.set()
+                    continue
+                lines.append(item)
+            dropped = self.dropped - self._reported
+            if dropped and lines:
+                self._reported += dropped
+                lines.append(
+                    (
+                        lines[-1][0],
+                        f"Warning: {dropped} log messages were dropped, "
+                        "the log queue was full",
+                        time.time(),
+                    )
+                )
+            self._write_batch(lines)
+
+    def _write_batch(self, lines: list):
+        if not lines:
+            return
+        console = []
+        touched = set()
+        for app, message, timestamp in lines:
+            when = datetime.fromtimestamp(timestamp)
+            if self.console:
+                color = _COLORS[zlib.crc32(app.encode("ascii")) % len(_COLORS)]
+                console.append(
+                    colorize(
+                        f"[{when.strftime('%H:%M:%S')} {app}] {message}",
+                        fg=color,
+                        bold=True,
+                    )
+                )
+            try:
+                entry = self._file(app, timestamp)
+                data = f"{when.strftime('%Y-%m-%d %H:%M:%S')} {message}\n"
+                entry[0].write(data)
+                entry[1] += len(data.encode())
+                touched.add(app)
+            except OSError as e:
+                console.append(f"Could not write log file of {app}: {e}")
+        for app in touched:
+            try:
+                self._files[app][0].flush()
+            except OSError:
+                pass
+        if console:
+            try:
+                sys.stdout.write("\n".join(console) + "\n")
+                sys.stdout.flush()
+            except (OSError, ValueError):
+                pass
+
+    def _file(self, app: str, now: float):
+        """Return the [file, size, opened_at] entry of app, rotating it if due."""
+        entry = self._files.get(app)
+        if entry is not None and (
+            (self.max_bytes and entry[1] >= self.max_bytes)
+            or (self.rotate_interval and now - entry[2] >= self.rotate_interval)
+        ):
+            entry[0].close()
+            del self._files[app]
+            self._rotate(app)
+            entry = None
+        if entry is None:
+            os.makedirs(self.directory, exist_ok=True)
+            f = open(os.path.join(self.directory, f"{app}.log"), "a")
+            entry = self._files[app] = [f, f.tell(), now]
+        return entry
+
+    def _rotate(self, app: str):
+        path = os.path.join(self.directory, f"{app}.log")
+        if not self.backup_count:
+            os.remove(path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        os.replace(path, f"{path}.1")
+
+    def _close_files(self):
+        for entry in self._files.values():
+            try:
+                entry[0].close()
+            except OSError:
+                pass
+        self._files = {}
+
+
+_writer = LogWriter()
+_level = LEVELS[DEFAULT_LOG_LEVEL]
+
+atexit.register(_writer.close)
+# a forked process (e.g. a worker) starts without the parent's writer thread
+os.register_at_fork(after_in_child=_writer._reset)
+
+
+def configure_logging(
+    level: str = None,
+    directory: str = None,
+    max_bytes: int = None,
+    rotate_interval: float = None,
+    backup_count: int = None,
+):
     """
-    Logs a message the console and saves it to a file.
+    Configure the logging backend. Settings left to None are unchanged.
+
+    Arguments
+    ---------
+        level : str
+            Minimum level of the messages to log: debug, info, warning or error.
+        directory : str
+            Directory of the log files.
+        max_bytes : int
+            Rotate a log file once it reaches this size.
+        rotate_interval : float
+            Rotate a log file once it has been open for this many seconds.
+        backup_count : int
+            Number of rotated files to keep per app.
+
+    Returns
+    -------
+        None
+    """
+    global _level
+    if level is not None:
+        if level not in LEVELS:
+            raise ValueError(
+                f"Invalid log level {level!r}, must be one of {list(LEVELS)}"
+            )
+        _level = LEVELS[level]
+    settings = {
+        "directory": directory,
+        "max_bytes": max_bytes,
+        "rotate_interval": rotate_interval,
+        "backup_count": backup_count,
+    }
+    settings = {name: value for name, value in settings.items() if value is not None}
+    if settings:
+        _writer.configure(**settings)
+
+
+def flush_logs():
+    """Wait until all the queued log messages are written."""
+    _writer.flush()
+
+
+def log(app, message, level="info"):
+    """
+    Logs a message to the console and saves it to a file. The message is
+    written by a background thread, so this returns right away.
 
     Arguments
     ---------
@@ -107,20 +404,48 @@ def log(app, message):
             The name of the app.
         message : str
             The message to log.
+        level : str
+            debug, info, warning or error. Messages below the configured
+            level are dropped.
 
     Returns
     -------
         None
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"{timestamp} {app}: {message}")
-    save_to_file(app, message)
-    color_table = ["red", "green", "yellow", "blue", "magenta", "cyan", "white"]
-    color = color_table[zlib.crc32(app.encode("ascii")) % len(color_table)]
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    formatted_message = f"[{timestamp} {app}] {message}"
-    print(colorize(formatted_message, fg=color, bold=True))
-    save_to_file(app, message)
+    if LEVELS[level] < _level:
+        return
+    _writer.write(app, message)
+
+
+def log_debug(log, message, *args):
+    """
+    Log a per-alert message at debug level. Functions from make_log drop it
+    when the level is above debug; other log callables get the message as is.
+    The message is only formatted with ``args`` once it is known to be kept,
+    so a dropped message costs no formatting.
+
+    Arguments
+    ---------
+        log : function
+            Function to log messages.
+        message : str
+            The message to log, as a %-format string if args are given.
+        *args
+            Values formatted into the message.
+
+    Returns
+    -------
+        None
+    """
+    leveled = getattr(log, "leveled", False)
+    if leveled and LEVELS["debug"] < _level:
+        return
+    if args:
+        message = message % args
+    if leveled:
+        log(message, level="debug")
+    else:
+        log(message)
 
 
 def make_log(app):
@@ -140,4 +465,5 @@ def make_log(app):
     def app_log(*args, **kwargs):
         log(app, *args, **kwargs)
 
+    app_log.leveled = True
     return app_log
@@ -0,0 +1,301 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# loopback only: listening on all interfaces (0.0.0.0) has to be asked for
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ALERT_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple):
+    if not names:
+        return ""
+    pairs = (f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """
+    Prometheus counter, with one value per combination of label values.
+    Updates take a lock and a dict lookup, cheap enough for every alert.
+
+    Arguments
+    ----------
+        name : str
+            Metric name, e.g. fink_alerts_total
+        help : str
+            Description of the metric
+        labels : tuple
+            Names of the labels, whose values are given to inc in that order
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, value: float = 1):
+        """Add ``value`` to the counter of the given label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_labels(self.labels, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Histogram:
+    """
+    Prometheus histogram, with one set of buckets per combination of label values.
+
+    Arguments
+    ----------
+        name : str
+            Metric name, e.g. skyportal_request_duration_seconds
+        help : str
+            Description of the metric
+        labels : tuple
+            Names of the labels, whose values are given to observe in that order
+        buckets : tuple
+            Upper bounds of the buckets, in increasing order
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), buckets=DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (not cumulative), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        """Record ``value`` for the given label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            return entry[2] if entry is not None else 0
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total, count))
+                for labels, (counts, total, count) in self._values.items()
+            )
+        lines = []
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(
+                    f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """
+    Prometheus gauge whose value is read from a function when scraped, e.g. the
+    number of alerts in the spool.
+
+    Arguments
+    ----------
+        name : str
+            Metric name
+        help : str
+            Description of the metric
+        function : callable
+            Called without arguments, returns the current value
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, function: callable):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def render(self):
+        try:
+            return [f"{self.name} {self.function()}"]
+        except Exception:
+            # e.g. the object it reads was closed in the meantime
+            return []
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def register(metric):
+    """Add a metric to the exported ones, replacing the one with the same name."""
+    with _metrics_lock:
+        _metrics[metric.name] = metric
+    return metric
+
+
+def unregister(name: str):
+    with _metrics_lock:
+        _metrics.pop(name, None)
+
+
+def render():
+    """Return all the metrics in the Prometheus text exposition format."""
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Set all counters and histograms back to zero, exported or not."""
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        if hasattr(metric, "reset"):
+            metric.reset()
+
+
+def endpoint_label(url: str):
+    """
+    Turn a SkyPortal API url into an endpoint label without ids, e.g.
+    http://host/api/sources/ZTF21abc/classifications -> /api/sources/{id}/classifications
+    """
+    path = url.split("/api/", 1)[-1].split("?", 1)[0]
+    segments = path.strip("/").split("/")
+    return "/api/" + "/".join(
+        segment if i % 2 == 0 else "{id}" for i, segment in enumerate(segments)
+    )
+
+
+ALERTS = register(
+    Counter(
+        "fink_alerts_total",
+        "Alerts per topic and processing state (polled, decoded, extracted, "
+        "posted, spooled, dead_lettered, dropped)",
+        ("topic", "state"),
+    )
+)
+SKYPORTAL_REQUESTS = register(
+    Counter(
+        "skyportal_requests_total",
+        "SkyPortal API requests per method, endpoint and status code",
+        ("method", "endpoint", "status"),
+    )
+)
+SKYPORTAL_REQUEST_DURATION = register(
+    Histogram(
+        "skyportal_request_duration_seconds",
+        "Duration of the SkyPortal API requests",
+        ("method", "endpoint"),
+    )
+)
+SKYPORTAL_RATE_LIMITED = register(
+    Counter(
+        "skyportal_rate_limited_total",
+        "SkyPortal API requests answered with 429 Too Many Requests",
+        ("endpoint",),
+    )
+)
+SKYPORTAL_RETRY_SLEEP = register(
+    Counter(
+        "skyportal_retry_sleep_seconds_total",
+        "Seconds waited before retrying requests answered with 429",
+    )
+)
+ALERT_LATENCY = register(
+    Histogram(
+        "fink_alert_latency_seconds",
+        "Time from the Kafka message timestamp to the alert being fully "
+        "written to SkyPortal, photometry included",
+        buckets=ALERT_LATENCY_BUCKETS,
+    )
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        payload = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = DEFAULT_METRICS_HOST):
+    """
+    Serve the metrics on http://host:port/metrics from a background thread.
+
+    Arguments
+    ----------
+        port : int
+            Port to listen on
+        host : str
+            Address to listen on, the loopback interface by default;
+            "0.0.0.0" for all interfaces
+
+    Returns
+    ----------
+        server : ThreadingHTTPServer
+            Call its shutdown() and server_close() methods to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    return server
@@ -0,0 +1,79 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: ``rate`` tokens are added per second, up to
+    ``burst`` tokens. Each call to acquire takes one token, waiting if needed.
+
+    Arguments
+    ----------
+        rate : float
+            Tokens added per second, i.e. the sustained number of requests per second
+        burst : int
+            Maximum number of tokens, i.e. requests that can be sent back to back
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        # time up to which tokens were refilled, in the future while deferred
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take one token without waiting. Used by asyncio callers, which must
+        sleep with asyncio.sleep rather than block in acquire.
+
+        Returns
+        ----------
+            wait : float
+                Seconds the caller must wait before using the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now > self._updated_at:
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+            self._tokens -= 1
+            wait = self._updated_at - now
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+            return wait
+
+    def acquire(self):
+        """
+        Take one token, sleeping until it is available.
+
+        Returns
+        ----------
+            waited : float
+                Seconds spent waiting
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def defer(self, seconds: float):
+        """
+        Hold back every caller for ``seconds``, e.g. when the server answered
+        with a Retry-After header, and empty the bucket so no burst follows.
+
+        Arguments
+        ----------
+            seconds : float
+                Seconds to wait before the next token is handed out
+
+        Returns
+        ----------
+            None
+        """
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0)
+            self._updated_at = max(self._updated_at, time.monotonic() + seconds)
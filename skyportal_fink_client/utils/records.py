@@ -0,0 +1,151 @@
+import math
+from array import array
+from typing import NamedTuple
+
+
+class AlertRecord(NamedTuple):
+    """
+    Standardised fields of an alert, as extracted from a ZTF or LSST alert.
+    The first eleven are the positional arguments of from_fink_to_skyportal.
+    Being a tuple, it is stored in the spool and the dead-letter store as a
+    JSON list, and read back with AlertRecord(*data).
+    """
+
+    object_id: str
+    mjd: float
+    instruments: list
+    filter: str
+    mag: float
+    magerr: float
+    limiting_mag: float
+    magsys: str
+    ra: float
+    dec: float
+    classification: str
+    # True if mag/magerr/limiting_mag hold flux/fluxerr/zp
+    is_flux: bool
+    # candid (ZTF) or diaSourceId (LSST), the same for the copies of an alert
+    # sent on several topics; None in records stored by older versions
+    alert_id: int = None
+    # Kafka timestamp of the message, in seconds; None for replayed alerts
+    timestamp: float = None
+
+
+# Fields of the photometry points of a PhotometryBatch
+PHOTOMETRY_NUMBERS = ("mjd", "mag", "magerr", "limiting_mag", "ra", "dec")
+PHOTOMETRY_STRINGS = ("object_id", "filter", "magsys")
+PHOTOMETRY_FIELDS = PHOTOMETRY_STRINGS + PHOTOMETRY_NUMBERS
+
+_NO_TAG = object()
+
+
+class PhotometryBatch:
+    """
+    Photometry points stored by column, for the points queued in a
+    PhotometryBatcher: numbers in typed arrays (8 bytes each) instead of one
+    dict and six float objects per point, and the columns are posted to
+    SkyPortal as they are. Not thread-safe.
+
+    A point is a dict with the PHOTOMETRY_FIELDS keys, and optionally a "tag"
+    (e.g. the Kafka offset of its alert) and other keys, kept but not posted.
+    Missing numbers (None) are stored as NaN and given back as None.
+    """
+
+    __slots__ = PHOTOMETRY_FIELDS + ("tags", "extras", "_missing")
+
+    def __init__(self, points=()):
+        for field in PHOTOMETRY_STRINGS:
+            setattr(self, field, [])
+        for field in PHOTOMETRY_NUMBERS:
+            setattr(self, field, array("d"))
+        self.tags = []
+        # dict of the other keys of each point, or None
+        self.extras = []
+        self._missing = False
+        for point in points:
+            self.append(point)
+
+    def __len__(self):
+        return len(self.object_id)
+
+    def __iter__(self):
+        return (self.point(i) for i in range(len(self)))
+
+    def append(self, point: dict):
+        """Add a point, given as a dict."""
+        numbers = [point[field] for field in PHOTOMETRY_NUMBERS]
+        if None in numbers:
+            numbers = [math.nan if value is None else value for value in numbers]
+            self._missing = True
+        # checked before anything is appended, so the columns stay aligned
+        numbers = [float(value) for value in numbers]
+        for field, value in zip(PHOTOMETRY_NUMBERS, numbers):
+            getattr(self, field).append(value)
+        self.object_id.append(point["object_id"])
+        self.filter.append(point["filter"])
+        self.magsys.append(point["magsys"])
+        self.tags.append(point.get("tag", _NO_TAG))
+        if len(point) > len(PHOTOMETRY_FIELDS) + ("tag" in point):
+            self.extras.append(
+                {
+                    key: value
+                    for key, value in point.items()
+                    if key != "tag" and key not in PHOTOMETRY_FIELDS
+                }
+            )
+        else:
+            self.extras.append(None)
+
+    def column(self, field: str):
+        """
+        Return a column as a list, e.g. to be posted.
+
+        Arguments
+        ----------
+            field : str
+                One of PHOTOMETRY_FIELDS
+
+        Returns
+        ----------
+            list
+        """
+        values = getattr(self, field)
+        if isinstance(values, list):
+            return list(values)
+        values = values.tolist()
+        if self._missing:
+            values = [None if value != value else value for value in values]
+        return values
+
+    def point(self, index: int):
+        """Return a point as the dict it was added as."""
+        point = {field: self._value(field, index) for field in PHOTOMETRY_FIELDS}
+        if self.extras[index] is not None:
+            point.update(self.extras[index])
+        if self.tags[index] is not _NO_TAG:
+            point["tag"] = self.tags[index]
+        return point
+
+    def _value(self, field: str, index: int):
+        value = getattr(self, field)[index]
+        return None if value != value else value
+
+    def points(self):
+        """Return all the points as dicts."""
+        return [self.point(i) for i in range(len(self))]
+
+    def select(self, indices: list):
+        """Return a new batch with the points at these indices."""
+        batch = PhotometryBatch()
+        for field in PHOTOMETRY_FIELDS + ("tags", "extras"):
+            values = getattr(self, field)
+            getattr(batch, field).extend(values[i] for i in indices)
+        batch._missing = self._missing
+        return batch
+
+    def indices_by_object(self):
+        """Return object_id -> indices of its points, in the order of the batch."""
+        indices = {}
+        for i, object_id in enumerate(self.object_id):
+            indices.setdefault(object_id, []).append(i)
+        return indices
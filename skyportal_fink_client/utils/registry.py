@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+
+# Alert time (days) after which a known object's candidate is posted again,
+# so that it resurfaces in the scanning page with its new detections.
+DEFAULT_CANDIDATE_INTERVAL = 1.0
+
+# New entries are written to the SQLite file by groups of this size
+DEFAULT_SYNC_EVERY = 100
+
+
+class ObjectRegistry:
+    """
+    Remember which objects were already saved to SkyPortal, so that repeat
+    detections skip the source and candidate writes and only post photometry
+    and classification.
+
+    A source is recorded once it was saved to a group. A candidate is recorded
+    with the MJD of the alert that passed the filter, and is only posted again
+    for an alert at least ``candidate_interval`` days later. With a ``path``,
+    the registry is kept in a SQLite file, so a restart does not post every
+    known object again. Safe to use from several threads.
+
+    Arguments
+    ----------
+        path : str
+            SQLite file to persist the registry to. In memory only if omitted.
+        candidate_interval : float
+            Days of alert time between two candidate posts of the same object
+            and filter.
+        sync_every : int
+            Number of new entries written to the file at once. Entries not yet
+            written when the process dies are posted again after a restart.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        candidate_interval: float = DEFAULT_CANDIDATE_INTERVAL,
+        sync_every: int = DEFAULT_SYNC_EVERY,
+    ):
+        self.path = path
+        self.candidate_interval = candidate_interval
+        self.sync_every = sync_every
+        # object_id -> ids of the groups the source was saved to
+        self._sources = {}
+        # object_id -> {filter_id: mjd of the last candidate posted}
+        self._candidates = {}
+        self._pending_sources = []
+        self._pending_candidates = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sources "
+                "(object_id TEXT, group_id INTEGER, PRIMARY KEY (object_id, group_id))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS candidates (object_id TEXT, "
+                "filter_id INTEGER, mjd REAL, PRIMARY KEY (object_id, filter_id))"
+            )
+            self._db.commit()
+            for object_id, group_id in self._db.execute(
+                "SELECT object_id, group_id FROM sources"
+            ):
+                self._sources.setdefault(object_id, set()).add(group_id)
+            for object_id, filter_id, mjd in self._db.execute(
+                "SELECT object_id, filter_id, mjd FROM candidates"
+            ):
+                self._candidates.setdefault(object_id, {})[filter_id] = mjd
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sources)
+
+    def has_source(self, object_id: str, group_id: int):
+        """Tell if the source was already saved to the group."""
+        return group_id in self._sources.get(object_id, ())
+
+    def candidate_due(self, object_id: str, filter_id: int, mjd: float):
+        """Tell if a candidate must be posted for an alert observed at ``mjd``."""
+        last = self._candidates.get(object_id, {}).get(filter_id)
+        return last is None or mjd - last >= self.candidate_interval
+
+    def add_source(self, object_id: str, group_id: int):
+        """Record that the source was saved to the group."""
+        with self._lock:
+            groups = self._sources.setdefault(object_id, set())
+            if group_id in groups:
+                return
+            groups.add(group_id)
+            self._pending_sources.append((object_id, group_id))
+            self._sync_if_due()
+
+    def add_candidate(self, object_id: str, filter_id: int, mjd: float):
+        """Record that a candidate was posted for an alert observed at ``mjd``."""
+        with self._lock:
+            filters = self._candidates.setdefault(object_id, {})
+            if mjd <= filters.get(filter_id, float("-inf")):
+                return
+            filters[filter_id] = mjd
+            self._pending_candidates[(object_id, filter_id)] = mjd
+            self._sync_if_due()
+
+    def forget(self, object_id: str):
+        """
+        Drop an object, e.g. when SkyPortal no longer knows it, so that its
+        source and candidate are posted again with its next alert.
+        """
+        with self._lock:
+            self._sources.pop(object_id, None)
+            self._candidates.pop(object_id, None)
+            self._pending_sources = [
+                key for key in self._pending_sources if key[0] != object_id
+            ]
+            for key in [key for key in self._pending_candidates if key[0] == object_id]:
+                del self._pending_candidates[key]
+            if self._db is not None:
+                self._db.execute(
+                    "DELETE FROM sources WHERE object_id = ?", (object_id,)
+                )
+                self._db.execute(
+                    "DELETE FROM candidates WHERE object_id = ?", (object_id,)
+                )
+                self._db.commit()
+
+    def sync(self):
+        """Write the new entries to the SQLite file."""
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        """Write the new entries and close the SQLite file."""
+        with self._lock:
+            self._sync()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _sync_if_due(self):
+        if (
+            len(self._pending_sources) + len(self._pending_candidates)
+            >= self.sync_every
+        ):
+            self._sync()
+
+    def _sync(self):
+        if self._db is not None:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO sources VALUES (?, ?)", self._pending_sources
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO candidates VALUES (?, ?, ?)",
+                [key + (mjd,) for key, mjd in self._pending_candidates.items()],
+            )
+            self._db.commit()
+        self._pending_sources = []
+        self._pending_candidates = {}
@@ -0,0 +1,103 @@
+import glob
+import os
+
+DEFAULT_CHUNK_SIZE = 1000
+
+_AVRO_EXTENSIONS = (".avro", ".avro.gz")
+_PARQUET_EXTENSIONS = (".parquet",)
+
+
+def alert_files(path):
+    """
+    List the alert files to replay, in name order.
+
+    Arguments
+    ----------
+        path : str or list
+            Avro (.avro, .avro.gz) or Parquet (.parquet) file, directory
+            holding such files, or list of files and directories
+
+    Returns
+    ----------
+        list
+            Paths of the alert files
+    """
+    if isinstance(path, (list, tuple)):
+        return [file for entry in path for file in alert_files(entry)]
+    if os.path.isdir(path):
+        # a directory named like an alert file (e.g. sample.avro/) is read as well
+        return [
+            file
+            for entry in sorted(glob.glob(os.path.join(path, "*")))
+            if entry.endswith(_AVRO_EXTENSIONS + _PARQUET_EXTENSIONS)
+            for file in alert_files(entry)
+        ]
+    if not path.endswith(_AVRO_EXTENSIONS + _PARQUET_EXTENSIONS):
+        raise ValueError(
+            f"Cannot replay {path!r}: expected an .avro, .avro.gz or .parquet "
+            "file, or a directory holding such files."
+        )
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return [path]
+
+
+def _read_parquet(path: str, chunk_size: int, fields: list = None):
+    """Yield the alerts of a Fink data-transfer Parquet file as lists of dicts."""
+    # optional dependency, only needed to replay Parquet dumps
+    import pyarrow.parquet as pq
+
+    with pq.ParquetFile(path) as parquet_file:
+        columns = None
+        if fields is not None:
+            names = parquet_file.schema_arrow.names
+            columns = [field for field in fields if field in names]
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pylist()
+
+
+def read_alerts(path, chunk_size: int = DEFAULT_CHUNK_SIZE, fields: list = None):
+    """
+    Read alerts from Avro and Parquet files, in chunks of up to ``chunk_size``
+    alerts, so that a large dump is never loaded at once.
+
+    Avro files are decoded with fink_client's AlertReader, one file at a time.
+    Parquet files, such as the ones from the Fink data transfer service, are
+    read by batches of rows. With ``fields``, only these top-level fields are
+    decoded (Avro) or read (Parquet).
+
+    Arguments
+    ----------
+        path : str or list
+            Avro (.avro, .avro.gz) or Parquet (.parquet) file, directory
+            holding such files, or list of files and directories
+        chunk_size : int
+            Maximum number of alerts per chunk
+        fields : list
+            Names of the top-level alert fields to keep, all if omitted
+
+    Returns
+    ----------
+        generator
+            Lists of alert dicts, as decoded from Kafka
+    """
+    chunk = []
+    for file in alert_files(path):
+        if file.endswith(_PARQUET_EXTENSIONS):
+            batches = _read_parquet(file, chunk_size, fields)
+        elif fields is not None:
+            from .decoding import read_avro_file
+
+            batches = [read_avro_file(file, fields)]
+        else:
+            from fink_client.avro_utils import AlertReader
+
+            batches = [AlertReader(file).to_list()]
+        for alerts in batches:
+            for alert in alerts:
+                chunk.append(alert)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
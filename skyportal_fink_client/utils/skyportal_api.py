@@ -1,7 +1,163 @@
+import threading
 import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 
 import requests
-from astropy.time import Time
+from requests.adapters import HTTPAdapter
+
+from . import metrics, tracing
+from .log import log_debug
+from .ratelimit import TokenBucket
+from .records import PhotometryBatch
+from .times import mjd_to_isot
+
+DEFAULT_POOL_SIZE = 10
+
+# Used when the IP is not whitelisted and no rate limit is configured
+DEFAULT_RATE_LIMIT = 5.0
+DEFAULT_RATE_BURST = 10
+
+MAX_ATTEMPTS = 5
+
+# One pooled, keep-alive session per (SkyPortal base url, token), so that the
+# TCP/TLS handshake is paid once per connection instead of once per call.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _base_url(endpoint: str):
+    """Return the ``scheme://host[:port]`` part of an endpoint url."""
+    parts = urlsplit(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _new_session(token: str, pool_size: int):
+    """Build a keep-alive session with a connection pool and the auth header set."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(
+        {"Authorization": f"token {token}", "Connection": "keep-alive"}
+    )
+    return session
+
+
+def init_session(url: str, token: str, pool_size: int = DEFAULT_POOL_SIZE):
+    """
+    Create the pooled HTTP session used for all the calls to a SkyPortal instance.
+    If a session already exists for this url and token, it is closed and replaced.
+
+    Arguments
+    ----------
+        url : str
+            Skyportal url
+        token : str
+            Skyportal token
+        pool_size : int
+            Maximum number of connections kept alive to the SkyPortal host
+
+    Returns
+    ----------
+        session : requests.Session
+            Session with the connection pool and default auth headers set
+    """
+    session = _new_session(token, pool_size)
+    with _sessions_lock:
+        previous = _sessions.pop((_base_url(url), token), None)
+        _sessions[(_base_url(url), token)] = session
+    if previous is not None:
+        previous.close()
+    return session
+
+
+def get_session(url: str, token: str):
+    """
+    Get the pooled HTTP session for a SkyPortal instance, creating it with the
+    default pool size if it does not exist yet.
+
+    Arguments
+    ----------
+        url : str
+            Skyportal url (or any endpoint of that SkyPortal instance)
+        token : str
+            Skyportal token
+
+    Returns
+    ----------
+        session : requests.Session
+    """
+    key = (_base_url(url), token)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _new_session(token, DEFAULT_POOL_SIZE)
+    return session
+
+
+def close_sessions():
+    """
+    Close all the pooled HTTP sessions and their connections.
+
+    Returns
+    ----------
+        None
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+# Token buckets shared by all the calls to a SkyPortal instance, keyed by base url
+_rate_limiters = {}
+
+
+def init_rate_limit(url: str, rate: float = None, burst: int = None):
+    """
+    Limit the calls made to a SkyPortal instance with a shared token bucket.
+
+    Arguments
+    ----------
+        url : str
+            Skyportal url
+        rate : float
+            Requests per second. If None, calls to this instance are not limited.
+        burst : int
+            Number of requests that can be sent back to back. Defaults to
+            DEFAULT_RATE_BURST, or to rate if it is larger.
+
+    Returns
+    ----------
+        limiter : TokenBucket or None
+    """
+    if rate is None:
+        _rate_limiters.pop(_base_url(url), None)
+        return None
+    if burst is None:
+        burst = max(DEFAULT_RATE_BURST, int(rate))
+    limiter = _rate_limiters[_base_url(url)] = TokenBucket(rate, burst)
+    return limiter
+
+
+def _retry_after(response: requests.Response):
+    """Return the delay asked by a Retry-After header in seconds, None if absent."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 def api(
@@ -11,7 +167,9 @@ def api(
     token=None,
 ):
     """
-    Make an API call to skyportal
+    Make an API call to skyportal, reusing the pooled session of the instance.
+    Calls go through the instance's rate limiter if one is set (see init_rate_limit),
+    and are retried on 429 after the delay given by the Retry-After header.
 
     Arguments
     ----------
@@ -30,16 +188,63 @@ def api(
             Response from skyportal
 
     """
-    headers = {"Authorization": f"token {token}"}
-    for attempt in range(5):
-        response = requests.request(method, endpoint, json=data, headers=headers)
+    session = get_session(endpoint, token)
+    limiter = _rate_limiters.get(_base_url(endpoint))
+    label = metrics.endpoint_label(endpoint)
+    for attempt in range(MAX_ATTEMPTS):
+        if limiter is not None:
+            with tracing.span("rate_limit"):
+                limiter.acquire()
+        start = time.perf_counter()
+        try:
+            with tracing.span("skyportal", method=method, endpoint=label) as span:
+                response = session.request(method, endpoint, json=data)
+                span.set(status=response.status_code)
+        except requests.RequestException:
+            metrics.SKYPORTAL_REQUESTS.inc(method, label, "error")
+            raise
+        metrics.SKYPORTAL_REQUEST_DURATION.observe(
+            time.perf_counter() - start, method, label
+        )
+        metrics.SKYPORTAL_REQUESTS.inc(method, label, response.status_code)
         if response.status_code != 429:
             return response
-        wait = 2**attempt
-        time.sleep(wait)
+        metrics.SKYPORTAL_RATE_LIMITED.inc(label)
+        wait = _retry_after(response)
+        if wait is None:
+            wait = 2**attempt
+        metrics.SKYPORTAL_RETRY_SLEEP.inc(value=wait)
+        if limiter is not None:
+            # other threads using this instance have to wait as well
+            limiter.defer(wait)
+        else:
+            time.sleep(wait)
     return response
 
 
+def is_available(url: str, token: str):
+    """
+    Tell if SkyPortal answers, with a lightweight call (its system info).
+
+    Arguments
+    ----------
+        url : str
+            Skyportal url
+        token : str
+            Skyportal token
+
+    Returns
+    ----------
+        bool
+            False if SkyPortal could not be reached or failed (5xx)
+    """
+    try:
+        response = api("GET", f"{url}/api/sysinfo", token=token)
+    except requests.RequestException:
+        return False
+    return response.status_code < 500
+
+
 def get_all_group_ids(url: str, token: str):
     """
     Get all group ids from skyportal using its API
@@ -126,6 +331,110 @@ def get_all_instruments(url: str, token: str):
     return instruments.status_code, data
 
 
+DEFAULT_INSTRUMENT_TTL = 3600
+
+# Resolved instrument ids, keyed by (SkyPortal base url, instrument names).
+# Each entry is [instrument_id, expires_at, ttl].
+_instrument_ids = {}
+
+
+def _match_instrument(instruments: list, skyportal_instruments: dict):
+    """Return the id of the SkyPortal instrument whose name contains one of ``instruments``."""
+    instrument_id = None
+    for existing_instrument in skyportal_instruments:
+        for instrument in instruments:
+            if instrument.lower() in existing_instrument.lower():
+                instrument_id = skyportal_instruments[existing_instrument]
+                break
+    return instrument_id
+
+
+def resolve_instrument_id(instruments: list, url: str, token: str, ttl: float = None):
+    """
+    Get the id of the SkyPortal instrument matching one of the given names.
+    The result is cached per SkyPortal instance and instrument names, so the
+    instruments table is only fetched again once the cached value has expired.
+
+    Arguments
+    ----------
+        instruments : list
+            List of possible names of the instrument
+        url : str
+            Skyportal url
+        token : str
+            Skyportal token
+        ttl : float
+            Seconds the resolved id stays valid. If omitted, the ttl the entry
+            was created with is kept (DEFAULT_INSTRUMENT_TTL for new entries).
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code (200 when the id comes from the cache)
+        instrument_id : int
+            Id of the instrument, None if no SkyPortal instrument matches
+    """
+    instrument_id = _cached_instrument_id(instruments, url)
+    if instrument_id is not None:
+        return 200, instrument_id
+
+    status, skyportal_instruments = get_all_instruments(url=url, token=token)
+    return status, _cache_instrument_id(instruments, url, skyportal_instruments, ttl)
+
+
+def _cached_instrument_id(instruments: list, url: str):
+    """Return the cached instrument id if it has not expired, None otherwise."""
+    entry = _instrument_ids.get((_base_url(url), tuple(instruments)))
+    if entry is not None and entry[0] is not None and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def _cache_instrument_id(
+    instruments: list, url: str, skyportal_instruments: dict, ttl: float = None
+):
+    """Match the instrument in a fresh instruments table and cache its id."""
+    key = (_base_url(url), tuple(instruments))
+    entry = _instrument_ids.get(key)
+    if ttl is None:
+        ttl = entry[2] if entry is not None else DEFAULT_INSTRUMENT_TTL
+    instrument_id = _match_instrument(instruments, skyportal_instruments)
+    # unresolved names are not cached, so a newly created instrument is picked up
+    _instrument_ids[key] = [instrument_id, time.monotonic() + ttl, ttl]
+    return instrument_id
+
+
+def invalidate_instrument_id(instruments: list = None, url: str = None):
+    """
+    Drop cached instrument ids, e.g. after SkyPortal rejected one of them.
+
+    Arguments
+    ----------
+        instruments : list
+            Instrument names whose entry to drop. If omitted, all the entries
+            of the SkyPortal instance are dropped.
+        url : str
+            Skyportal url. If omitted, the entries of every instance are dropped.
+
+    Returns
+    ----------
+        None
+    """
+    for key in list(_instrument_ids):
+        if url is not None and key[0] != _base_url(url):
+            continue
+        if instruments is not None and key[1] != tuple(instruments):
+            continue
+        entry = _instrument_ids.get(key)
+        if entry is not None:
+            entry[0] = None
+
+
+def _is_unknown_instrument_error(status: int, body: str):
+    """Tell if a photometry response means the instrument id was not recognised."""
+    return status in (400, 404) and "instrument" in (body or "").lower()
+
+
 def get_all_source_ids(url: str, token: str):
     """
     Get all source ids from skyportal using its API
@@ -252,6 +561,10 @@ def classification_exists_for_objs(
         author_id : int
             Author id if it exists, None otherwise
     """
+    entry = _cached_classification(object_id, taxonomy_id, url)
+    if entry is not None:
+        return entry[0], entry[1]
+
     classifications = api(
         "GET",
         f"{url}/api/sources/{object_id}/classifications",
@@ -262,19 +575,426 @@ def classification_exists_for_objs(
     if classifications.status_code == 200:
         data = classifications.json()["data"]
 
+    return _classification_lookup_result(
+        data, object_id, skyportal_name, taxonomy_id, url, token
+    )
+
+
+def _find_classification(classifications: list, skyportal_name: str, taxonomy_id: int):
+    """Return (classification_id, author_id) of our classification in a list, or (None, None)."""
+    classification = _find_classification_entry(
+        classifications, skyportal_name, taxonomy_id
+    )
+    if classification is None:
+        return None, None
+    return classification["id"], classification["author_id"]
+
+
+def _find_classification_entry(
+    classifications: list, skyportal_name: str, taxonomy_id: int
+):
+    """Return our classification in a list of classifications, or None."""
     # find a classification with author_name = skyportal_name
-    classification_id = None
-    author_id = None
-    for classification in data:
+    for classification in classifications:
         if (
             classification["author_name"] == skyportal_name
             and classification["taxonomy_id"] == taxonomy_id
         ):
-            classification_id = classification["id"]
-            author_id = classification["author_id"]
-            break
+            return classification
+    return None
+
+
+DEFAULT_CLASSIFICATION_CACHE_SIZE = 100_000
+DEFAULT_CLASSIFICATION_CACHE_TTL = 3600
+
+# Our classification of each object, keyed by (SkyPortal base url, object id,
+# taxonomy id), least recently used first. Each entry is
+# [classification_id, author_id, classification, probability, expires_at].
+# It is filled from our own posts and updates, so the classifications of an
+# object are only fetched the first time it is seen.
+_classifications = OrderedDict()
+_classifications_lock = threading.Lock()
+_classification_cache_size = DEFAULT_CLASSIFICATION_CACHE_SIZE
+_classification_cache_ttl = DEFAULT_CLASSIFICATION_CACHE_TTL
+
+# Id of the SkyPortal user behind each (SkyPortal base url, token), learnt from
+# the classifications it authored.
+_author_ids = {}
+
+# Number of classification updates skipped because nothing changed
+_skipped_classification_writes = 0
+_skipped_classification_writes_lock = threading.Lock()
+
+
+def init_classification_cache(size: int = None, ttl: float = None):
+    """
+    Configure the classification cache.
+
+    Arguments
+    ----------
+        size : int
+            Maximum number of objects in the cache; the least recently used
+            ones are dropped first. Default DEFAULT_CLASSIFICATION_CACHE_SIZE.
+        ttl : float
+            Seconds an entry stays valid, after which the classifications of
+            the object are fetched again. Default DEFAULT_CLASSIFICATION_CACHE_TTL.
+
+    Returns
+    ----------
+        None
+    """
+    global _classification_cache_size, _classification_cache_ttl
+    with _classifications_lock:
+        if size is not None:
+            _classification_cache_size = size
+        if ttl is not None:
+            _classification_cache_ttl = ttl
+        while len(_classifications) > _classification_cache_size:
+            _classifications.popitem(last=False)
+
+
+def _cached_classification(object_id: str, taxonomy_id: int, url: str):
+    """Return a copy of the cached entry of an object if it has not expired, None otherwise."""
+    key = (_base_url(url), object_id, taxonomy_id)
+    with _classifications_lock:
+        entry = _classifications.get(key)
+        if entry is None:
+            return None
+        if entry[4] <= time.monotonic():
+            del _classifications[key]
+            return None
+        _classifications.move_to_end(key)
+        return list(entry)
+
+
+def _cache_classification(
+    object_id: str,
+    taxonomy_id: int,
+    url: str,
+    classification_id: int,
+    author_id: int,
+    classification: str,
+    probability: float,
+):
+    """Store our classification of an object, evicting the least recently used entries."""
+    key = (_base_url(url), object_id, taxonomy_id)
+    with _classifications_lock:
+        _classifications[key] = [
+            classification_id,
+            author_id,
+            classification,
+            probability,
+            time.monotonic() + _classification_cache_ttl,
+        ]
+        _classifications.move_to_end(key)
+        while len(_classifications) > _classification_cache_size:
+            _classifications.popitem(last=False)
+
+
+def invalidate_classification(
+    object_id: str = None, taxonomy_id: int = None, url: str = None
+):
+    """
+    Drop cached classifications, e.g. after SkyPortal rejected an update.
+
+    Arguments
+    ----------
+        object_id : str
+            Object whose entries to drop. If omitted, all the objects.
+        taxonomy_id : int
+            Taxonomy whose entries to drop. If omitted, all the taxonomies.
+        url : str
+            Skyportal url. If omitted, the entries of every instance are dropped.
+
+    Returns
+    ----------
+        None
+    """
+    with _classifications_lock:
+        for key in list(_classifications):
+            if url is not None and key[0] != _base_url(url):
+                continue
+            if object_id is not None and key[1] != object_id:
+                continue
+            if taxonomy_id is not None and key[2] != taxonomy_id:
+                continue
+            del _classifications[key]
+
+
+def classification_unchanged(
+    object_id: str,
+    taxonomy_id: int,
+    url: str,
+    classification: str,
+    probability: float,
+):
+    """
+    Tell if the classification we last posted for an object, as remembered in
+    the classification cache, is the same as the given one. Updates found
+    unchanged are counted in skipped_classification_writes.
+
+    Arguments
+    ----------
+        object_id : str
+            Object id
+        taxonomy_id : int
+            Taxonomy id
+        url : str
+            Skyportal url
+        classification : str
+            New classification of the object
+        probability : float
+            New probability of the classification
+
+    Returns
+    ----------
+        bool
+            True if the update can be skipped
+    """
+    global _skipped_classification_writes
+    entry = _cached_classification(object_id, taxonomy_id, url)
+    if entry is None or entry[2] != classification or entry[3] != probability:
+        return False
+    with _skipped_classification_writes_lock:
+        _skipped_classification_writes += 1
+    return True
+
+
+def skipped_classification_writes():
+    """Return the number of classification updates skipped because nothing changed."""
+    return _skipped_classification_writes
+
+
+def _classification_lookup_result(
+    classifications: list,
+    object_id: str,
+    skyportal_name: str,
+    taxonomy_id: int,
+    url: str,
+    token: str,
+):
+    """Cache our classification found in a GET of the object's classifications and return (id, author_id)."""
+    classification = _find_classification_entry(
+        classifications, skyportal_name, taxonomy_id
+    )
+    if classification is None:
+        return None, None
+    _author_ids[(_base_url(url), token)] = classification["author_id"]
+    _cache_classification(
+        object_id,
+        taxonomy_id,
+        url,
+        classification["id"],
+        classification["author_id"],
+        classification.get("classification"),
+        classification.get("probability"),
+    )
+    return classification["id"], classification["author_id"]
+
+
+def _classification_posted(
+    status: int,
+    body,
+    object_id: str,
+    classification: str,
+    probability: float,
+    taxonomy_id: int,
+    url: str,
+    token: str,
+):
+    """Cache a classification we just posted, if SkyPortal returned its id and we know our author id."""
+    classification_id = None
+    if status == 200 and isinstance(body, dict):
+        classification_id = (body.get("data") or {}).get("classification_id")
+    author_id = _author_ids.get((_base_url(url), token))
+    if classification_id is None or author_id is None:
+        # looked up (and cached) on the next alert of the object instead
+        invalidate_classification(object_id, taxonomy_id, url)
+        return
+    _cache_classification(
+        object_id,
+        taxonomy_id,
+        url,
+        classification_id,
+        author_id,
+        classification,
+        probability,
+    )
+
+
+def _classification_updated(
+    status: int,
+    classification_id: int,
+    author_id: int,
+    object_id: str,
+    classification: str,
+    probability: float,
+    taxonomy_id: int,
+    url: str,
+    token: str,
+):
+    """Cache a classification we just updated, or drop it if the update failed."""
+    if status != 200:
+        # e.g. deleted in SkyPortal in the meantime: look it up again next time
+        invalidate_classification(object_id, taxonomy_id, url)
+        return
+    _author_ids[(_base_url(url), token)] = author_id
+    _cache_classification(
+        object_id,
+        taxonomy_id,
+        url,
+        classification_id,
+        author_id,
+        classification,
+        probability,
+    )
+
+
+def _source_payload(object_id: str, ra: float, dec: float, group_ids: list):
+    """Build the body of a POST /api/sources request."""
+    data = {
+        "ra": ra,
+        "dec": dec,
+        "id": object_id,
+        # "ra_dis": 0,
+        # "dec_dis": 0,
+        # "ra_err": 0,
+        # "dec_err": 0,
+        # "offset": 0,
+        # "redshift": 0,
+        # "redshift_error": 0,
+        # "altdata": null,
+        # "dist_nearest_source": 0,
+        # "mag_nearest_source": 0,
+        # "e_mag_nearest_source": 0,
+        # "transient": true,
+        # "varstar": true,
+        # "is_roid": true,
+        # "score": 0,
+        # "origin": "string",
+        # "alias": null,
+        # "detect_photometry_count": 0,
+        "group_ids": group_ids,
+    }
+    return data
+
+
+def _candidate_payload(
+    object_id: str, ra: float, dec: float, filter_ids: list, passed_at: str
+):
+    """Build the body of a POST /api/candidates request."""
+    data = {
+        "ra": ra,
+        "dec": dec,
+        "id": object_id,
+        # "ra_dis": 0,
+        # "dec_dis": 0,
+        # "ra_err": 0,
+        # "dec_err": 0,
+        # "offset": 0,
+        # "redshift": 0,
+        # "redshift_error": 0,
+        # "altdata": null,
+        # "dist_nearest_source": 0,
+        # "mag_nearest_source": 0,
+        # "e_mag_nearest_source": 0,
+        # "transient": true,
+        # "varstar": true,
+        # "is_roid": true,
+        # "score": 0,
+        # "origin": "string",
+        # "alias": null,
+        # "detect_photometry_count": 0,
+        # /!\ HARDCODED FILTER ID TO ONE, ISSUES WITH IT FOR THE MOMENT
+        "filter_ids": filter_ids,
+        # "passing_alert_id": 0,
+        "passed_at": passed_at,
+    }
+    return data
+
+
+def _photometry_payload(
+    object_id: str,
+    mjd: float,
+    instrument_id: int,
+    filter: str,
+    mag: float,
+    magerr: float,
+    limiting_mag: float,
+    magsys: str,
+    ra: float,
+    dec: float,
+    group_ids: list,
+    stream_ids: list,
+    is_flux: bool = False,
+):
+    """Build the body of a PUT /api/photometry request for one observation."""
+    data = {
+        "ra": ra,
+        "magsys": magsys,
+        "group_ids": group_ids,
+        "mjd": mjd,
+        "filter": filter,
+        "stream_ids": stream_ids,
+        "dec": dec,
+        "instrument_id": instrument_id,
+        "obj_id": object_id,
+    }
+    if is_flux:
+        data["flux"] = mag
+        data["fluxerr"] = magerr
+        data["zp"] = limiting_mag
+    else:
+        data["mag"] = mag
+        data["magerr"] = magerr
+        if limiting_mag is not None:
+            data["limiting_mag"] = limiting_mag
+    return data
+
+
+def _classification_payload(
+    object_id: str,
+    classification: str,
+    probability: float,
+    taxonomy_id: int,
+    group_ids: list,
+):
+    """Build the body of a POST /api/classification request."""
+    data = {
+        "classification": classification,
+        "author_name": "fink_client",
+        "taxonomy_id": taxonomy_id,
+        "obj_id": object_id,
+        "group_ids": group_ids,
+    }
+
+    if probability is not None:
+        data["probability"] = probability
+    return data
 
-    return classification_id, author_id
+
+def _classification_update_payload(
+    author_id: int,
+    object_id: str,
+    classification: str,
+    probability: float,
+    skyportal_name: str,
+    taxonomy_id: int,
+    group_ids: list,
+):
+    """Build the body of a PUT /api/classification/{id} request."""
+    data = {
+        "obj_id": object_id,
+        "classification": classification,
+        "taxonomy_id": taxonomy_id,
+        "group_ids": group_ids,
+        "author_id": author_id,
+        "author_name": skyportal_name,
+    }
+
+    if probability is not None:
+        data["probability"] = probability
+    return data
 
 
 def post_source(
@@ -305,31 +1025,7 @@ def post_source(
         data : int
             Source id
     """
-    data = {
-        "ra": ra,
-        "dec": dec,
-        "id": object_id,
-        # "ra_dis": 0,
-        # "dec_dis": 0,
-        # "ra_err": 0,
-        # "dec_err": 0,
-        # "offset": 0,
-        # "redshift": 0,
-        # "redshift_error": 0,
-        # "altdata": null,
-        # "dist_nearest_source": 0,
-        # "mag_nearest_source": 0,
-        # "e_mag_nearest_source": 0,
-        # "transient": true,
-        # "varstar": true,
-        # "is_roid": true,
-        # "score": 0,
-        # "origin": "string",
-        # "alias": null,
-        # "detect_photometry_count": 0,
-        "group_ids": group_ids,
-    }
-
+    data = _source_payload(object_id, ra, dec, group_ids)
     response = api("POST", f"{url}/api/sources", data, token=token)
     return (
         response.status_code,
@@ -373,34 +1069,7 @@ def post_candidate(
         data : int
             Candidate id
     """
-
-    data = {
-        "ra": ra,
-        "dec": dec,
-        "id": object_id,
-        # "ra_dis": 0,
-        # "dec_dis": 0,
-        # "ra_err": 0,
-        # "dec_err": 0,
-        # "offset": 0,
-        # "redshift": 0,
-        # "redshift_error": 0,
-        # "altdata": null,
-        # "dist_nearest_source": 0,
-        # "mag_nearest_source": 0,
-        # "e_mag_nearest_source": 0,
-        # "transient": true,
-        # "varstar": true,
-        # "is_roid": true,
-        # "score": 0,
-        # "origin": "string",
-        # "alias": null,
-        # "detect_photometry_count": 0,
-        # /!\ HARDCODED FILTER ID TO ONE, ISSUES WITH IT FOR THE MOMENT
-        "filter_ids": filter_ids,
-        # "passing_alert_id": 0,
-        "passed_at": passed_at,
-    }
+    data = _candidate_payload(object_id, ra, dec, filter_ids, passed_at)
     response = api("POST", f"{url}/api/candidates", data, token=token)
     return (
         response.status_code,
@@ -465,26 +1134,93 @@ def post_photometry(
         data : int
             Source id
     """
+    data = _photometry_payload(
+        object_id,
+        mjd,
+        instrument_id,
+        filter,
+        mag,
+        magerr,
+        limiting_mag,
+        magsys,
+        ra,
+        dec,
+        group_ids,
+        stream_ids,
+        is_flux,
+    )
+
+    response = api("PUT", f"{url}/api/photometry", data, token=token)
+    return (
+        response.status_code,
+        response.json()["data"]["ids"] if response.json()["data"] != {} else {},
+        response.text,
+    )
+
+
+def post_photometry_batch(
+    points,
+    instrument_id: int,
+    group_ids: list,
+    stream_ids: list,
+    url: str,
+    token: str,
+    is_flux: bool = False,
+):
+    """
+    Post several photometry points of one instrument to skyportal in a single
+    columnar request
+
+    Arguments
+    ----------
+        points : list or PhotometryBatch
+            List of dicts with the object_id, mjd, filter, mag, magerr,
+            limiting_mag, magsys, ra and dec of each observation (same meaning
+            as the arguments of post_photometry), or a PhotometryBatch of them,
+            whose columns are posted as they are
+        instrument_id : int
+            id of the instrument used to observe the objects
+        group_ids : list
+            List of group ids to post photometry to
+        stream_ids : list
+            List of stream ids to post photometry to
+        url : str
+            Skyportal url
+        token : str
+            Skyportal token
+        is_flux : bool
+            True if mag/magerr/limiting_mag hold flux/fluxerr/zp
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code
+        data : list
+            Photometry ids
+        text : str
+            Response body
+    """
+    if not isinstance(points, PhotometryBatch):
+        points = PhotometryBatch(points)
     data = {
-        "ra": ra,
-        "magsys": magsys,
+        "obj_id": points.column("object_id"),
+        "mjd": points.column("mjd"),
+        "filter": points.column("filter"),
+        "magsys": points.column("magsys"),
+        "ra": points.column("ra"),
+        "dec": points.column("dec"),
+        "instrument_id": instrument_id,
         "group_ids": group_ids,
-        "mjd": mjd,
-        "filter": filter,
         "stream_ids": stream_ids,
-        "dec": dec,
-        "instrument_id": instrument_id,
-        "obj_id": object_id,
     }
     if is_flux:
-        data["flux"] = mag
-        data["fluxerr"] = magerr
-        data["zp"] = limiting_mag
+        data["flux"] = points.column("mag")
+        data["fluxerr"] = points.column("magerr")
+        data["zp"] = points.column("limiting_mag")
     else:
-        data["mag"] = mag
-        data["magerr"] = magerr
-        if limiting_mag is not None:
-            data["limiting_mag"] = limiting_mag
+        data["mag"] = points.column("mag")
+        data["magerr"] = points.column("magerr")
+        data["limiting_mag"] = points.column("limiting_mag")
 
     response = api("PUT", f"{url}/api/photometry", data, token=token)
     return (
@@ -528,16 +1264,9 @@ def post_classification(
         data : int
             Classification id
     """
-    data = {
-        "classification": classification,
-        "author_name": "fink_client",
-        "taxonomy_id": taxonomy_id,
-        "obj_id": object_id,
-        "group_ids": group_ids,
-    }
-
-    if probability is not None:
-        data["probability"] = probability
+    data = _classification_payload(
+        object_id, classification, probability, taxonomy_id, group_ids
+    )
 
     response = api(
         "POST",
@@ -546,7 +1275,18 @@ def post_classification(
         token=token,
     )
 
-    return response.status_code, response.json()
+    body = response.json()
+    _classification_posted(
+        response.status_code,
+        body,
+        object_id,
+        classification,
+        probability,
+        taxonomy_id,
+        url,
+        token,
+    )
+    return response.status_code, body
 
 
 def post_streams(name: str, url: str, token: str):
@@ -826,17 +1566,15 @@ def update_classification(
             HTTP status code
     """
 
-    data = {
-        "obj_id": object_id,
-        "classification": classification,
-        "taxonomy_id": taxonomy_id,
-        "group_ids": group_ids,
-        "author_id": author_id,
-        "author_name": skyportal_name,
-    }
-
-    if probability is not None:
-        data["probability"] = probability
+    data = _classification_update_payload(
+        author_id,
+        object_id,
+        classification,
+        probability,
+        skyportal_name,
+        taxonomy_id,
+        group_ids,
+    )
 
     response = api(
         "PUT",
@@ -844,6 +1582,17 @@ def update_classification(
         data,
         token=token,
     )
+    _classification_updated(
+        response.status_code,
+        classification_id,
+        author_id,
+        object_id,
+        classification,
+        probability,
+        taxonomy_id,
+        url,
+        token,
+    )
     return response.status_code
 
 
@@ -1007,11 +1756,73 @@ def class_exists_in_fink_taxonomy_hierarchy(classification: str, branch: list):
     return (None, False)
 
 
+_TAXONOMY_PREFIXES = ("(TNS) ", "(SIMBAD) ")
+
+# Compiled taxonomy indexes, keyed by (SkyPortal base url, taxonomy id)
+_taxonomy_indexes = {}
+
+
+def compile_taxonomy_index(hierarchy: dict):
+    """
+    Flatten a fink taxonomy hierarchy into a dict mapping every name a
+    classification can be looked up with to its class in the taxonomy:
+    the class names, their "other names", and both without their
+    ``(TNS)``/``(SIMBAD)`` prefix. When several classes share a name, the
+    first one in depth-first order wins, as in class_exists_in_fink_taxonomy_hierarchy.
+
+    Arguments
+    ----------
+        hierarchy : dict
+            Root of a taxonomy hierarchy
+
+    Returns
+    ----------
+        index : dict
+            Lookup name to taxonomy class
+    """
+    index = {}
+    stack = [hierarchy]
+    while stack:
+        tax_class = stack.pop()
+        for name in [tax_class["class"], *tax_class.get("other names", [])]:
+            index.setdefault(name, tax_class["class"])
+            for prefix in _TAXONOMY_PREFIXES:
+                if name.startswith(prefix):
+                    index.setdefault(name[len(prefix) :], tax_class["class"])
+        stack.extend(reversed(tax_class.get("subclasses", [])))
+    return index
+
+
+def register_taxonomy_index(taxonomy_id: int, hierarchy: dict, url: str):
+    """
+    Compile and store the lookup index of a taxonomy posted to SkyPortal,
+    so classifications can be resolved without fetching the taxonomy.
+
+    Arguments
+    ----------
+        taxonomy_id : int
+            Id of the taxonomy in SkyPortal
+        hierarchy : dict
+            Hierarchy of the taxonomy
+        url : str
+            Skyportal url
+
+    Returns
+    ----------
+        index : dict
+            Lookup name to taxonomy class
+    """
+    index = compile_taxonomy_index(hierarchy)
+    _taxonomy_indexes[(_base_url(url), taxonomy_id)] = index
+    return index
+
+
 def get_classification_in_fink_taxonomy(
     classification: str, fink_taxonomy_id: int, url: str, token: str
 ):
     """
-    Get the classification of a fink taxonomy
+    Get the classification of a fink taxonomy. The taxonomy is only fetched from
+    SkyPortal if its index was not registered yet (see register_taxonomy_index).
 
     Arguments
     ----------
@@ -1029,15 +1840,13 @@ def get_classification_in_fink_taxonomy(
         classification:
             Classification of the fink taxonomy
     """
-    response = api("GET", f"{url}/api/taxonomy/{fink_taxonomy_id}", token=token)
-    hierarchy = response.json()["data"]["hierarchy"]
-    classification, exists = class_exists_in_fink_taxonomy_hierarchy(
-        classification, [hierarchy]
-    )
-    if exists:
-        return classification
-    else:
-        return None
+    index = _taxonomy_indexes.get((_base_url(url), fink_taxonomy_id))
+    if index is None:
+        response = api("GET", f"{url}/api/taxonomy/{fink_taxonomy_id}", token=token)
+        index = register_taxonomy_index(
+            fink_taxonomy_id, response.json()["data"]["hierarchy"], url
+        )
+    return index.get(classification)
 
 
 def get_fink_taxonomy_id(version: str, url: str, token: str):
@@ -1074,6 +1883,112 @@ def get_fink_taxonomy_id(version: str, url: str, token: str):
     return (status, id, latest)
 
 
+def post_fink_classification(
+    object_id: str,
+    classification: str,
+    probability: float,
+    group_id: int,
+    taxonomy_id: int,
+    url: str,
+    token: str,
+    skyportal_name: str,
+    log: callable,
+    on_error: callable = None,
+):
+    """
+    Post the classification given by fink to an object, or update the one
+    already posted by ``skyportal_name`` in the same taxonomy.
+
+    Arguments
+    ----------
+        object_id : str
+            Id of the object
+        classification : str
+            Classification of for the object
+        probability : float
+            Probability of the classification
+        group_id : int
+            Id of the group in skyportal that will contain the alerts from fink
+        taxonomy_id : int
+            Id of the taxonomy in skyportal that contains the alerts from fink
+        url : str
+            Skyportal url
+        token : str
+            Skyportal token
+        skyportal_name : str
+            Name of the user the classifications are authored by
+        log : function
+            Function to log messages
+        on_error : function
+            Called with ("classification", status, None) if the write failed
+
+    Returns
+    ----------
+        status_code : int
+            200 if the classification was written or left unchanged, otherwise
+            the status of the failed call
+    """
+    status = 200
+    if taxonomy_id is not None:
+        classification = get_classification_in_fink_taxonomy(
+            classification, taxonomy_id, url, token
+        )
+
+    if classification is None or taxonomy_id is None:
+        log(
+            "Classification not found in any skyportal taxonomy, added to SkyPortal without classification"
+        )
+    else:
+        classification_id, author_id = classification_exists_for_objs(
+            object_id, skyportal_name, taxonomy_id, url=url, token=token
+        )
+        log_debug(
+            log,
+            "Classification id: %s, author id: %s",
+            classification_id,
+            author_id,
+        )
+        if classification_id is not None and classification_unchanged(
+            object_id, taxonomy_id, url, classification, probability
+        ):
+            log_debug(log, "Classification of %s unchanged, not updated", object_id)
+        elif classification_id is not None:
+            status = update_classification(
+                classification_id,
+                author_id,
+                object_id,
+                classification,
+                probability,
+                skyportal_name,
+                taxonomy_id,
+                [group_id],
+                url=url,
+                token=token,
+            )
+            if status != 200 and on_error is not None:
+                on_error("classification", status, None)
+        else:
+            status = post_classification(
+                object_id,
+                classification,
+                probability,
+                taxonomy_id,
+                [group_id],
+                url=url,
+                token=token,
+            )[0]
+            if status != 200 and on_error is not None:
+                on_error("classification", status, None)
+        log_debug(
+            log,
+            "Candidate with source: %s, classified as a %s added to SkyPortal",
+            object_id,
+            classification,
+        )
+    return status
+
+
+@tracing.traced("alert", key="object_id")
 def from_fink_to_skyportal(
     object_id: str,
     mjd: float,
@@ -1097,6 +2012,10 @@ def from_fink_to_skyportal(
     skyportal_name: str,
     log: callable,
     is_flux: bool = False,
+    photometry_batcher=None,
+    photometry_tag=None,
+    object_registry=None,
+    on_error: callable = None,
 ):
     """
     Post an alert to skyportal using its API, that means posting
@@ -1135,117 +2054,141 @@ def from_fink_to_skyportal(
         taxonomy_id : int
             Id of the taxonomy in skyportal that contains the alerts from fink (taxonomy called Fink Taxonomy, but can also be omitted. If omitted, the classification will be searched in existing taxonomies)
         whitelisted: bool
-            True if your IP is whitelisted in SkyPortal, False otherwise. This allows you to skip the delay of one second set in between alerts as SkyPortal limits API calls.
+            True if your IP is whitelisted in SkyPortal, False otherwise. Kept for compatibility: the calls are now paced by the rate limiter set up by init_skyportal (see init_rate_limit).
         url : str
             Skyportal url
         token : str
             Skyportal token
         log : function
             Function to log messages
+        is_flux : bool
+            True if mag/magerr/limiting_mag hold flux/fluxerr/zp
+        photometry_batcher : PhotometryBatcher
+            If given, the photometry is queued in this batcher instead of being posted right away
+        photometry_tag :
+            Stored with the queued photometry point under the "tag" key, to recognise it once the batch is posted
+        object_registry : ObjectRegistry
+            If given, the source and candidate are only posted for objects it does not know yet
+            (and candidates again once its candidate_interval has passed)
+        on_error : function
+            Called with (stage, status, body) for each failed write, stage being
+            "instrument", "source", "candidate", "photometry" or "classification"
+            and body the response body (photometry only, None otherwise)
 
     Returns
     ----------
-        None
+        status_code : int
+            200 if all the calls succeeded, otherwise the status of the last failed call
+            (404 if the instrument does not exist in SkyPortal)
     """
-    if not whitelisted:
-        time.sleep(1)
     # Convert numpy scalars (e.g. np.int64) to native Python types for JSON serialisation.
     # Strings (e.g. MPC designation) are left unchanged.
     if hasattr(object_id, "item"):
         object_id = object_id.item()
-    overall_status = 200
-    overall_status, skyportal_instruments = get_all_instruments(url=url, token=token)
-    instrument_id = None
-    for existing_instrument in skyportal_instruments:
-        for instrument in instruments:
-            if instrument.lower() in existing_instrument.lower():
-                instrument_id = skyportal_instruments[existing_instrument]
-                break
+    overall_status, instrument_id = resolve_instrument_id(
+        instruments, url=url, token=token
+    )
     if instrument_id is not None:
-        status = post_source(object_id, ra, dec, [group_id], url=url, token=token)[0]
-        if status != 200:
-            overall_status = status
-            if log is not None:
-                log(f"Warning: post_source returned {status} for {object_id}")
-        else:
-            if log is not None:
-                log(f"Source {object_id} saved to group {group_id}")
-        passed_at = Time(mjd, format="mjd").isot
-        status = post_candidate(
-            object_id, ra, dec, [filter_id], passed_at, url=url, token=token
-        )[0]
-        if status != 200:
-            overall_status = status
-            if log is not None:
-                log(f"Warning: post_candidate returned {status} for {object_id}")
-        phot_status, _, phot_body = post_photometry(
-            object_id,
-            mjd,
-            instrument_id,
-            filter,
-            mag,
-            magerr,
-            limiting_mag,
-            magsys,
-            ra,
-            dec,
-            [group_id],
-            [stream_id],
-            url=url,
-            token=token,
-            is_flux=is_flux,
-        )
-        if phot_status != 200:
-            overall_status = phot_status
-            if log is not None:
-                log(
-                    f"Warning: post_photometry returned {phot_status} for {object_id}: {phot_body}"
-                )
-        if taxonomy_id is not None:
-            classification = get_classification_in_fink_taxonomy(
-                classification, taxonomy_id, url, token
+        if object_registry is None or not object_registry.has_source(
+            object_id, group_id
+        ):
+            status, _ = post_source(
+                object_id, ra, dec, [group_id], url=url, token=token
             )
-
-        if classification is None or taxonomy_id is None:
-            log(
-                "Classification not found in any skyportal taxonomy, added to SkyPortal without classification"
+            if status != 200:
+                overall_status = status
+                if on_error is not None:
+                    on_error("source", status, None)
+                if log is not None:
+                    log(f"Warning: post_source returned {status} for {object_id}")
+            else:
+                if object_registry is not None:
+                    object_registry.add_source(object_id, group_id)
+                if log is not None:
+                    log_debug(log, "Source %s saved to group %s", object_id, group_id)
+        if object_registry is None or object_registry.candidate_due(
+            object_id, filter_id, mjd
+        ):
+            passed_at = mjd_to_isot(mjd)
+            status = post_candidate(
+                object_id, ra, dec, [filter_id], passed_at, url=url, token=token
+            )[0]
+            if status != 200:
+                overall_status = status
+                if on_error is not None:
+                    on_error("candidate", status, None)
+                if log is not None:
+                    log(f"Warning: post_candidate returned {status} for {object_id}")
+            elif object_registry is not None:
+                object_registry.add_candidate(object_id, filter_id, mjd)
+        if photometry_batcher is not None:
+            photometry_batcher.add(
+                {
+                    "object_id": object_id,
+                    "mjd": mjd,
+                    "filter": filter,
+                    "mag": mag,
+                    "magerr": magerr,
+                    "limiting_mag": limiting_mag,
+                    "magsys": magsys,
+                    "ra": ra,
+                    "dec": dec,
+                    "tag": photometry_tag,
+                },
+                instrument_id,
+                group_id,
+                stream_id,
+                is_flux=is_flux,
             )
         else:
-            classification_id, author_id = classification_exists_for_objs(
-                object_id, skyportal_name, taxonomy_id, url=url, token=token
-            )
-            log(f"Classification id: {classification_id}, author id: {author_id}")
-            if classification_id is not None:
-                status = update_classification(
-                    classification_id,
-                    author_id,
-                    object_id,
-                    classification,
-                    probability,
-                    skyportal_name,
-                    taxonomy_id,
-                    [group_id],
-                    url=url,
-                    token=token,
-                )
-                if status != 200:
-                    overall_status = status
-            else:
-                status = post_classification(
-                    object_id,
-                    classification,
-                    probability,
-                    taxonomy_id,
-                    [group_id],
-                    url=url,
-                    token=token,
-                )[0]
-                if status != 200:
-                    overall_status = status
-            log(
-                f"Candidate with source: {object_id}, classified as a {classification} added to SkyPortal"
+            phot_status, _, phot_body = post_photometry(
+                object_id,
+                mjd,
+                instrument_id,
+                filter,
+                mag,
+                magerr,
+                limiting_mag,
+                magsys,
+                ra,
+                dec,
+                [group_id],
+                [stream_id],
+                url=url,
+                token=token,
+                is_flux=is_flux,
             )
+            if phot_status != 200:
+                overall_status = phot_status
+                if on_error is not None:
+                    on_error("photometry", phot_status, phot_body)
+                if _is_unknown_instrument_error(phot_status, phot_body):
+                    invalidate_instrument_id(instruments, url=url)
+                elif object_registry is not None:
+                    # e.g. the source was deleted: post it again next time
+                    object_registry.forget(object_id)
+                if log is not None:
+                    log(
+                        f"Warning: post_photometry returned {phot_status} for {object_id}: {phot_body}"
+                    )
+        status = post_fink_classification(
+            object_id,
+            classification,
+            probability,
+            group_id,
+            taxonomy_id,
+            url,
+            token,
+            skyportal_name,
+            log,
+            on_error=on_error,
+        )
+        if status != 200:
+            overall_status = status
     else:
+        overall_status = 404
+        if on_error is not None:
+            on_error("instrument", 404, None)
         log(
             "error: instruments named {} does not exist".format(" / ".join(instruments))
         )
@@ -0,0 +1,719 @@
+import asyncio
+import threading
+import time
+
+import aiohttp
+
+from . import metrics, skyportal_api, tracing
+from .log import log_debug
+from .skyportal_api import DEFAULT_POOL_SIZE, MAX_ATTEMPTS, _base_url
+from .times import mjd_to_isot
+
+DEFAULT_CONCURRENCY = 8
+
+# One aiohttp session per (SkyPortal base url, token). Sessions are bound to the
+# event loop they were created in, which is the AlertPoster loop in the client.
+_sessions = {}
+
+
+class Response:
+    """
+    Body and status of a SkyPortal response, read before the connection is
+    released. Mirrors the parts of requests.Response used by skyportal_api.
+    """
+
+    def __init__(self, status_code: int, headers: dict, text: str, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+async def init_session(url: str, token: str, pool_size: int = DEFAULT_POOL_SIZE):
+    """
+    Create the pooled aiohttp session used for all the async calls to a SkyPortal
+    instance. If a session already exists for this url and token, it is closed
+    and replaced.
+
+    Arguments
+    ----------
+        url : str
+            Skyportal url
+        token : str
+            Skyportal token
+        pool_size : int
+            Maximum number of connections kept alive to the SkyPortal host
+
+    Returns
+    ----------
+        session : aiohttp.ClientSession
+    """
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size),
+        headers={"Authorization": f"token {token}"},
+    )
+    previous = _sessions.pop((_base_url(url), token), None)
+    _sessions[(_base_url(url), token)] = session
+    if previous is not None:
+        await previous.close()
+    return session
+
+
+async def close_sessions():
+    """
+    Close all the async sessions and their connections.
+
+    Returns
+    ----------
+        None
+    """
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    for session in sessions:
+        await session.close()
+
+
+async def api(method, endpoint, data=None, token=None):
+    """
+    Make an async API call to skyportal. Goes through the same rate limiter as
+    skyportal_api.api() and retries on 429 after the Retry-After delay.
+
+    Arguments
+    ----------
+        method : str
+            HTTP method to use
+        endpoint : str
+            Endpoint to call
+        data : dict
+            Data to send with the request
+        token : str
+            Skyportal token
+
+    Returns
+    ----------
+        response : Response
+            Response from skyportal
+    """
+    session = _sessions.get((_base_url(endpoint), token))
+    if session is None:
+        session = await init_session(endpoint, token)
+    limiter = skyportal_api._rate_limiters.get(_base_url(endpoint))
+    label = metrics.endpoint_label(endpoint)
+    for attempt in range(MAX_ATTEMPTS):
+        if limiter is not None:
+            wait = limiter.reserve()
+            if wait > 0:
+                with tracing.span("rate_limit"):
+                    await asyncio.sleep(wait)
+        start = time.perf_counter()
+        try:
+            with tracing.span("skyportal", method=method, endpoint=label) as span:
+                async with session.request(method, endpoint, json=data) as raw:
+                    text = await raw.text()
+                    try:
+                        body = await raw.json(content_type=None)
+                    except ValueError:
+                        body = None
+                    response = Response(raw.status, raw.headers, text, body)
+                span.set(status=response.status_code)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            metrics.SKYPORTAL_REQUESTS.inc(method, label, "error")
+            raise
+        metrics.SKYPORTAL_REQUEST_DURATION.observe(
+            time.perf_counter() - start, method, label
+        )
+        metrics.SKYPORTAL_REQUESTS.inc(method, label, response.status_code)
+        if response.status_code != 429:
+            return response
+        metrics.SKYPORTAL_RATE_LIMITED.inc(label)
+        wait = skyportal_api._retry_after(response)
+        if wait is None:
+            wait = 2**attempt
+        metrics.SKYPORTAL_RETRY_SLEEP.inc(value=wait)
+        if limiter is not None:
+            limiter.defer(wait)
+        else:
+            await asyncio.sleep(wait)
+    return response
+
+
+def _response_data(response: Response, key: str, default=None):
+    """Return response.json()["data"][key], or default if the data is empty."""
+    data = (response.json() or {}).get("data") or {}
+    return data[key] if data != {} else default
+
+
+async def resolve_instrument_id(
+    instruments: list, url: str, token: str, ttl: float = None
+):
+    """
+    Async version of skyportal_api.resolve_instrument_id, sharing its cache.
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code (200 when the id comes from the cache)
+        instrument_id : int
+            Id of the instrument, None if no SkyPortal instrument matches
+    """
+    instrument_id = skyportal_api._cached_instrument_id(instruments, url)
+    if instrument_id is not None:
+        return 200, instrument_id
+    response = await api("GET", f"{url}/api/instrument", token=token)
+    skyportal_instruments = {}
+    if response.status_code == 200:
+        skyportal_instruments = {
+            instrument["name"]: instrument["id"]
+            for instrument in response.json()["data"]
+        }
+    return response.status_code, skyportal_api._cache_instrument_id(
+        instruments, url, skyportal_instruments, ttl
+    )
+
+
+async def get_classification_in_fink_taxonomy(
+    classification: str, fink_taxonomy_id: int, url: str, token: str
+):
+    """
+    Async version of skyportal_api.get_classification_in_fink_taxonomy, sharing
+    its taxonomy indexes.
+
+    Returns
+    ----------
+        classification:
+            Classification of the fink taxonomy
+    """
+    index = skyportal_api._taxonomy_indexes.get((_base_url(url), fink_taxonomy_id))
+    if index is None:
+        response = await api(
+            "GET", f"{url}/api/taxonomy/{fink_taxonomy_id}", token=token
+        )
+        index = skyportal_api.register_taxonomy_index(
+            fink_taxonomy_id, response.json()["data"]["hierarchy"], url
+        )
+    return index.get(classification)
+
+
+async def classification_exists_for_objs(
+    object_id: str, skyportal_name: str, taxonomy_id: int, url: str, token: str
+):
+    """
+    Async version of skyportal_api.classification_exists_for_objs.
+
+    Returns
+    ----------
+        classification_id : int
+            Classification id if it exists, None otherwise
+        author_id : int
+            Author id if it exists, None otherwise
+    """
+    entry = skyportal_api._cached_classification(object_id, taxonomy_id, url)
+    if entry is not None:
+        return entry[0], entry[1]
+    response = await api(
+        "GET", f"{url}/api/sources/{object_id}/classifications", token=token
+    )
+    data = []
+    if response.status_code == 200:
+        data = response.json()["data"]
+    return skyportal_api._classification_lookup_result(
+        data, object_id, skyportal_name, taxonomy_id, url, token
+    )
+
+
+async def post_source(
+    object_id: str, ra: float, dec: float, group_ids: list, url: str, token: str
+):
+    """
+    Async version of skyportal_api.post_source.
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code
+        data : int
+            Source id
+    """
+    data = skyportal_api._source_payload(object_id, ra, dec, group_ids)
+    response = await api("POST", f"{url}/api/sources", data, token=token)
+    return response.status_code, _response_data(response, "id", {})
+
+
+async def post_candidate(
+    object_id: str,
+    ra: float,
+    dec: float,
+    filter_ids: list,
+    passed_at: str,
+    url: str,
+    token: str,
+):
+    """
+    Async version of skyportal_api.post_candidate.
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code
+        data : list
+            Candidate ids
+    """
+    data = skyportal_api._candidate_payload(object_id, ra, dec, filter_ids, passed_at)
+    response = await api("POST", f"{url}/api/candidates", data, token=token)
+    return response.status_code, _response_data(response, "ids", {})
+
+
+async def post_photometry(
+    object_id: str,
+    mjd: float,
+    instrument_id: int,
+    filter: str,
+    mag: float,
+    magerr: float,
+    limiting_mag: float,
+    magsys: str,
+    ra: float,
+    dec: float,
+    group_ids: list,
+    stream_ids: list,
+    url: str,
+    token: str,
+    is_flux: bool = False,
+):
+    """
+    Async version of skyportal_api.post_photometry.
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code
+        data : list
+            Photometry ids
+        text : str
+            Response body
+    """
+    data = skyportal_api._photometry_payload(
+        object_id,
+        mjd,
+        instrument_id,
+        filter,
+        mag,
+        magerr,
+        limiting_mag,
+        magsys,
+        ra,
+        dec,
+        group_ids,
+        stream_ids,
+        is_flux,
+    )
+    response = await api("PUT", f"{url}/api/photometry", data, token=token)
+    return response.status_code, _response_data(response, "ids", {}), response.text
+
+
+async def post_classification(
+    object_id: str,
+    classification: str,
+    probability: float,
+    taxonomy_id: int,
+    group_ids: list,
+    url: str,
+    token: str,
+):
+    """
+    Async version of skyportal_api.post_classification.
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code
+        data : dict
+            Response body
+    """
+    data = skyportal_api._classification_payload(
+        object_id, classification, probability, taxonomy_id, group_ids
+    )
+    response = await api("POST", f"{url}/api/classification", data, token=token)
+    body = response.json()
+    skyportal_api._classification_posted(
+        response.status_code,
+        body,
+        object_id,
+        classification,
+        probability,
+        taxonomy_id,
+        url,
+        token,
+    )
+    return response.status_code, body
+
+
+async def update_classification(
+    classification_id: int,
+    author_id: int,
+    object_id: str,
+    classification: str,
+    probability: float,
+    skyportal_name: str,
+    taxonomy_id: int,
+    group_ids: list,
+    url: str,
+    token: str,
+):
+    """
+    Async version of skyportal_api.update_classification.
+
+    Returns
+    ----------
+        status_code : int
+            HTTP status code
+    """
+    data = skyportal_api._classification_update_payload(
+        author_id,
+        object_id,
+        classification,
+        probability,
+        skyportal_name,
+        taxonomy_id,
+        group_ids,
+    )
+    response = await api(
+        "PUT", f"{url}/api/classification/{classification_id}", data, token=token
+    )
+    skyportal_api._classification_updated(
+        response.status_code,
+        classification_id,
+        author_id,
+        object_id,
+        classification,
+        probability,
+        taxonomy_id,
+        url,
+        token,
+    )
+    return response.status_code
+
+
+async def _no_classification():
+    return None, None
+
+
+async def _unchanged_classification():
+    return 200
+
+
+async def _known_object():
+    return 200, None
+
+
+@tracing.traced("alert", key="object_id")
+async def from_fink_to_skyportal(
+    object_id: str,
+    mjd: float,
+    instruments: list,
+    filter: str,
+    mag: float,
+    magerr: float,
+    limiting_mag: float,
+    magsys: str,
+    ra: float,
+    dec: float,
+    classification: str,
+    probability: float,
+    group_id: int,
+    filter_id: int,
+    stream_id: int,
+    taxonomy_id: int,
+    whitelisted: bool,
+    url: str,
+    token: str,
+    skyportal_name: str,
+    log: callable,
+    is_flux: bool = False,
+    photometry_batcher=None,
+    photometry_tag=None,
+    object_registry=None,
+    on_error: callable = None,
+):
+    """
+    Async version of skyportal_api.from_fink_to_skyportal, taking the same arguments.
+    Independent calls are sent concurrently, in two rounds: the source, the
+    candidate and the classification lookup first, then the photometry and the
+    classification, which need the object created by the first round.
+
+    Returns
+    ----------
+        status_code : int
+            200 if all the calls succeeded, otherwise the status of the last failed call
+    """
+    if hasattr(object_id, "item"):
+        object_id = object_id.item()
+    overall_status, instrument_id = await resolve_instrument_id(
+        instruments, url=url, token=token
+    )
+    if instrument_id is None:
+        if on_error is not None:
+            on_error("instrument", 404, None)
+        log(
+            "error: instruments named {} does not exist".format(" / ".join(instruments))
+        )
+        return 404
+
+    if taxonomy_id is not None:
+        classification = await get_classification_in_fink_taxonomy(
+            classification, taxonomy_id, url, token
+        )
+    classify = classification is not None and taxonomy_id is not None
+
+    post_new_source = object_registry is None or not object_registry.has_source(
+        object_id, group_id
+    )
+    post_new_candidate = object_registry is None or object_registry.candidate_due(
+        object_id, filter_id, mjd
+    )
+    passed_at = mjd_to_isot(mjd)
+    (
+        (source_status, _),
+        (candidate_status, _),
+        (classification_id, author_id),
+    ) = await asyncio.gather(
+        post_source(object_id, ra, dec, [group_id], url=url, token=token)
+        if post_new_source
+        else _known_object(),
+        post_candidate(object_id, ra, dec, [filter_id], passed_at, url=url, token=token)
+        if post_new_candidate
+        else _known_object(),
+        classification_exists_for_objs(
+            object_id, skyportal_name, taxonomy_id, url=url, token=token
+        )
+        if classify
+        else _no_classification(),
+    )
+    if source_status != 200:
+        overall_status = source_status
+        if on_error is not None:
+            on_error("source", source_status, None)
+        if log is not None:
+            log(f"Warning: post_source returned {source_status} for {object_id}")
+    elif post_new_source:
+        if object_registry is not None:
+            object_registry.add_source(object_id, group_id)
+        if log is not None:
+            log_debug(log, "Source %s saved to group %s", object_id, group_id)
+    if candidate_status != 200:
+        overall_status = candidate_status
+        if on_error is not None:
+            on_error("candidate", candidate_status, None)
+        if log is not None:
+            log(f"Warning: post_candidate returned {candidate_status} for {object_id}")
+    elif post_new_candidate and object_registry is not None:
+        object_registry.add_candidate(object_id, filter_id, mjd)
+
+    writes = []
+    point = {
+        "object_id": object_id,
+        "mjd": mjd,
+        "filter": filter,
+        "mag": mag,
+        "magerr": magerr,
+        "limiting_mag": limiting_mag,
+        "magsys": magsys,
+        "ra": ra,
+        "dec": dec,
+        "tag": photometry_tag,
+    }
+    if photometry_batcher is not None:
+        # adding may flush a full batch with blocking calls, keep them off the loop
+        await asyncio.to_thread(
+            photometry_batcher.add,
+            point,
+            instrument_id,
+            group_id,
+            stream_id,
+            is_flux,
+        )
+    else:
+        writes.append(
+            post_photometry(
+                object_id,
+                mjd,
+                instrument_id,
+                filter,
+                mag,
+                magerr,
+                limiting_mag,
+                magsys,
+                ra,
+                dec,
+                [group_id],
+                [stream_id],
+                url=url,
+                token=token,
+                is_flux=is_flux,
+            )
+        )
+    if classify and classification_id is not None:
+        log_debug(
+            log,
+            "Classification id: %s, author id: %s",
+            classification_id,
+            author_id,
+        )
+    if (
+        classify
+        and classification_id is not None
+        and skyportal_api.classification_unchanged(
+            object_id, taxonomy_id, url, classification, probability
+        )
+    ):
+        log_debug(log, "Classification of %s unchanged, not updated", object_id)
+        writes.append(_unchanged_classification())
+    elif classify and classification_id is not None:
+        writes.append(
+            update_classification(
+                classification_id,
+                author_id,
+                object_id,
+                classification,
+                probability,
+                skyportal_name,
+                taxonomy_id,
+                [group_id],
+                url=url,
+                token=token,
+            )
+        )
+    elif classify:
+        writes.append(
+            post_classification(
+                object_id,
+                classification,
+                probability,
+                taxonomy_id,
+                [group_id],
+                url=url,
+                token=token,
+            )
+        )
+
+    results = await asyncio.gather(*writes)
+    if photometry_batcher is None:
+        phot_status, _, phot_body = results.pop(0)
+        if phot_status != 200:
+            overall_status = phot_status
+            if on_error is not None:
+                on_error("photometry", phot_status, phot_body)
+            if skyportal_api._is_unknown_instrument_error(phot_status, phot_body):
+                skyportal_api.invalidate_instrument_id(instruments, url=url)
+            elif object_registry is not None:
+                object_registry.forget(object_id)
+            if log is not None:
+                log(
+                    f"Warning: post_photometry returned {phot_status} for {object_id}: {phot_body}"
+                )
+    if classify:
+        result = results.pop(0)
+        status = result if classification_id is not None else result[0]
+        if status != 200:
+            overall_status = status
+            if on_error is not None:
+                on_error("classification", status, None)
+        log_debug(
+            log,
+            f"Candidate with source: {object_id}, classified as a {classification} added to SkyPortal",
+        )
+    else:
+        log(
+            "Classification not found in any skyportal taxonomy, added to SkyPortal without classification"
+        )
+    return overall_status
+
+
+class AlertPoster:
+    """
+    Post alerts to SkyPortal with the async client from synchronous code, such as
+    the polling loop. The event loop runs in a background thread and up to
+    ``concurrency`` alerts are in flight at once; submit blocks when that limit
+    is reached. Alerts of the same object are posted one after the other.
+
+    Arguments
+    ----------
+        concurrency : int
+            Maximum number of alerts posted at the same time
+        log : function
+            Function to log messages. Can be omitted.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, log: callable = None):
+        self.concurrency = concurrency
+        self.log = log
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="skyportal-async", daemon=True
+        )
+        self._thread.start()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        # object_id -> [asyncio.Lock, number of alerts using it], loop thread only
+        self._objects = {}
+
+    def run(self, coroutine):
+        """
+        Run a coroutine on the poster's event loop and wait for its result, e.g.
+        to create the async session with init_session.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def submit(self, *args, **kwargs):
+        """
+        Post an alert with from_fink_to_skyportal, taking the same arguments.
+
+        Returns
+        ----------
+            future : concurrent.futures.Future
+                Resolves to the overall status of the alert
+        """
+        self._slots.acquire()
+        future = asyncio.run_coroutine_threadsafe(self._post(args, kwargs), self._loop)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self._slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            if self.log is not None:
+                self.log(
+                    f"Exception while posting alert: {type(future.exception()).__name__}: "
+                    f"{future.exception()}"
+                )
+
+    async def _post(self, args: tuple, kwargs: dict):
+        object_id = args[0] if args else kwargs["object_id"]
+        entry = self._objects.setdefault(object_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await from_fink_to_skyportal(*args, **kwargs)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._objects[object_id]
+
+    def close(self):
+        """
+        Wait for the alerts in flight, close the sessions and stop the loop.
+
+        Returns
+        ----------
+            None
+        """
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+        self.run(close_sessions())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        for _ in range(self.concurrency):
+            self._slots.release()
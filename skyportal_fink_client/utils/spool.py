@@ -0,0 +1,359 @@
+import json
+import sqlite3
+import threading
+
+DEFAULT_RETRY_INTERVAL = 10.0
+DEFAULT_MAX_RETRY_INTERVAL = 300.0
+DEFAULT_DRAIN_BATCH_SIZE = 100
+# Failed posts after which a spooled alert is given up on
+DEFAULT_MAX_ATTEMPTS = 10
+
+
+def is_retryable(status):
+    """
+    Tell if a failed alert is worth posting again later: SkyPortal could not be
+    reached (None), rate limited it (429) or failed (5xx). Other errors come
+    from the alert itself and would fail again.
+    """
+    return status is None or status == 429 or status >= 500
+
+
+def _to_json(value):
+    """Convert numpy scalars, which json cannot serialise, to Python values."""
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+class AlertSpool:
+    """
+    First-in first-out queue of extracted alerts kept in a SQLite file, holding
+    the alerts that could not be written to SkyPortal until they can be posted
+    again. Safe to use from several threads.
+
+    Arguments
+    ----------
+        path : str
+            SQLite file of the spool, created if needed. Alerts left in it by
+            a previous run are kept.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS alerts "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, data TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(alerts)")]
+        if "attempts" not in columns:
+            # spool written by an older version
+            self._db.execute(
+                "ALTER TABLE alerts ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+            )
+        self._db.commit()
+        (self._count,) = self._db.execute("SELECT COUNT(*) FROM alerts").fetchone()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, topic: str, data: list):
+        """
+        Append an alert.
+
+        Arguments
+        ----------
+            topic : str
+                Topic the alert was received from
+            data : list
+                Extracted alert data, see extract_alert_data
+
+        Returns
+        ----------
+            None
+        """
+        row = (topic, json.dumps(list(data), default=_to_json))
+        with self._lock:
+            self._db.execute("INSERT INTO alerts (topic, data) VALUES (?, ?)", row)
+            self._db.commit()
+            self._count += 1
+
+    def peek(self, count: int, after_id: int = 0):
+        """
+        Return the ``count`` oldest alerts without removing them.
+
+        Arguments
+        ----------
+            count : int
+                Maximum number of alerts returned
+            after_id : int
+                Only return the alerts added after this one
+
+        Returns
+        ----------
+            list
+                (id, topic, data) tuples, oldest first
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, topic, data FROM alerts WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, count),
+            ).fetchall()
+        return [(id, topic, json.loads(data)) for id, topic, data in rows]
+
+    def record_failure(self, id: int):
+        """
+        Count a failed attempt to post an alert returned by peek.
+
+        Returns
+        ----------
+            int
+                Number of failed attempts of the alert so far
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE alerts SET attempts = attempts + 1 WHERE id = ?", (id,)
+            )
+            self._db.commit()
+            row = self._db.execute(
+                "SELECT attempts FROM alerts WHERE id = ?", (id,)
+            ).fetchone()
+        return row[0] if row is not None else 0
+
+    def remove(self, ids: list):
+        """Remove alerts returned by peek, once they were handled."""
+        if not ids:
+            return
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM alerts WHERE id = ?", [(id,) for id in ids]
+            )
+            self._db.commit()
+            (self._count,) = self._db.execute("SELECT COUNT(*) FROM alerts").fetchone()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SpoolDrainer:
+    """
+    Background thread posting the spooled alerts again, oldest first, once
+    SkyPortal accepts writes again.
+
+    The drainer also tells whether SkyPortal is available: it is marked
+    unavailable when a post fails with a retryable error (see
+    mark_unavailable), and available again once ``probe`` succeeds. Until
+    then the drainer probes it, doubling the delay from ``retry_interval`` up
+    to ``max_retry_interval``. Without a probe, posting the oldest spooled
+    alert is the check.
+
+    An alert that fails with a non-retryable error, or with retryable errors
+    ``max_attempts`` times while SkyPortal answers the probe, is dropped (and
+    logged) so that it does not block the spool.
+
+    With a ``photometry_batcher``, the photometry of the alerts read from the
+    spool at once is posted as one batch, and an alert is only removed from
+    the spool once its photometry is in. An alert whose photometry was
+    rejected stays in the spool until the next drain, and counts as a failed
+    attempt.
+
+    Arguments
+    ----------
+        spool : AlertSpool
+        post : callable
+            Called with (topic, data) for each alert; returns the status of the
+            SkyPortal writes (200 if they all succeeded), None or raises if
+            SkyPortal could not be reached. With a ``photometry_batcher``, also
+            called with the spool id of the alert, to tag its photometry
+            points with.
+        probe : callable
+            Called without arguments, returns True if SkyPortal answers. Can
+            be omitted.
+        retry_interval : float
+            Seconds between two checks of the spool, and first retry delay
+        max_retry_interval : float
+            Longest delay between two retries
+        batch_size : int
+            Number of alerts read from the spool at once
+        max_attempts : int
+            Failed posts after which a spooled alert is dropped
+        on_drop : callable
+            Called with (topic, data, status) for each alert dropped. Can be
+            omitted.
+        log : function
+            Function to log messages. Can be omitted.
+        photometry_batcher : PhotometryBatcher
+            Batcher used by ``post`` for the photometry, flushed by the drainer
+            only; its on_flush is set by the drainer. Can be omitted.
+    """
+
+    def __init__(
+        self,
+        spool: AlertSpool,
+        post: callable,
+        probe: callable = None,
+        retry_interval: float = DEFAULT_RETRY_INTERVAL,
+        max_retry_interval: float = DEFAULT_MAX_RETRY_INTERVAL,
+        batch_size: int = DEFAULT_DRAIN_BATCH_SIZE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        on_drop: callable = None,
+        log: callable = None,
+        photometry_batcher=None,
+    ):
+        self.spool = spool
+        self.post = post
+        self.probe = probe
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.on_drop = on_drop
+        self.log = log
+        self.photometry_batcher = photometry_batcher
+        # spool ids of the alerts whose photometry was rejected
+        self._rejected = set()
+        if photometry_batcher is not None:
+            photometry_batcher.on_flush = self._on_photometry_flush
+        self._stop = threading.Event()
+        self._available = threading.Event()
+        self._available.set()
+        self._thread = None
+
+    def available(self):
+        """Return False while SkyPortal is known to be unavailable."""
+        return self._available.is_set()
+
+    def mark_unavailable(self):
+        """Record that a post failed with a retryable error."""
+        self._available.clear()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="spool-drainer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread once the alert being posted is done."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _post(self, id, topic, data):
+        try:
+            if self.photometry_batcher is not None:
+                return self.post(topic, data, id)
+            return self.post(topic, data)
+        except Exception as e:
+            if self.log is not None:
+                self.log(f"Spooled alert {data[0]} could not be posted: {e}")
+            return None
+
+    def _drop(self, topic, data, status):
+        if self.log is not None:
+            self.log(f"Dropping spooled alert {data[0]}: SkyPortal returned {status}")
+        if self.on_drop is not None:
+            self.on_drop(topic, data, status)
+
+    def _on_photometry_flush(self, sent, failed):
+        self._rejected.update(point["tag"] for point in failed)
+
+    def _remove(self, rows, done):
+        """
+        Remove the handled alerts of a chunk from the spool, once the
+        photometry of the posted ones is posted as well.
+        """
+        if self.photometry_batcher is not None:
+            self.photometry_batcher.flush()
+            rejected, self._rejected = self._rejected, set()
+            for id, topic, data in rows:
+                if id not in rejected or id not in done:
+                    continue
+                if self.spool.record_failure(id) < self.max_attempts:
+                    if self.log is not None:
+                        self.log(
+                            f"Photometry of spooled alert {data[0]} was rejected, "
+                            "keeping it in the spool"
+                        )
+                    done.remove(id)
+                else:
+                    self._drop(topic, data, None)
+        self.spool.remove(done)
+        return len(done)
+
+    def _probe(self):
+        try:
+            return bool(self.probe())
+        except Exception:
+            return False
+
+    def drain(self):
+        """
+        Post spooled alerts until the spool is empty or a retryable error occurs.
+        An alert failing with a retryable error for the ``max_attempts``-th time
+        is dropped instead.
+
+        Returns
+        ----------
+            bool
+                True if every spooled alert was handled, apart from the ones
+                whose photometry was rejected, which are posted again by the
+                next drain
+        """
+        removed, after_id = 0, 0
+        while not self._stop.is_set():
+            rows = self.spool.peek(self.batch_size, after_id)
+            if not rows:
+                if removed and self.log is not None:
+                    self.log(f"Spool drained ({removed} alerts handled)")
+                return True
+            after_id = rows[-1][0]
+            done = []
+            for id, topic, data in rows:
+                if self._stop.is_set():
+                    break
+                status = self._post(id, topic, data)
+                if status != 200 and is_retryable(status):
+                    if self.spool.record_failure(id) < self.max_attempts:
+                        self._remove(rows, done)
+                        return False
+                    self._drop(topic, data, status)
+                elif status != 200:
+                    self._drop(topic, data, status)
+                done.append(id)
+            removed += self._remove(rows, done)
+        return False
+
+    def _run(self):
+        delay = self.retry_interval
+        while not self._stop.is_set():
+            if not self.available() and self.probe is not None:
+                if not self._probe():
+                    if self.log is not None:
+                        self.log(
+                            f"SkyPortal still unavailable, {len(self.spool)} alerts "
+                            f"spooled, retrying in {delay:.0f} seconds"
+                        )
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, self.max_retry_interval)
+                    continue
+                self._available.set()
+            if len(self.spool) and not self.drain():
+                self.mark_unavailable()
+                if self.log is not None and not self._stop.is_set():
+                    self.log(
+                        f"SkyPortal still unavailable, {len(self.spool)} alerts "
+                        f"spooled, retrying in {delay:.0f} seconds"
+                    )
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+            else:
+                if not len(self.spool):
+                    # without a probe, an empty spool is the only sign of recovery
+                    self._available.set()
+                delay = self.retry_interval
+                self._stop.wait(self.retry_interval)
@@ -1,6 +1,3 @@
-import numpy as np
-
-
 def fid_to_filter_ztf(fid: int):
     """
     Convert a ZTF fid integer to a filter name.
@@ -60,6 +57,8 @@ def flux_to_mag(flux_nJy: float) -> float:
     mag : float
         AB magnitude
     """
+    import numpy as np
+
     return -2.5 * np.log10(flux_nJy) + 31.4
 
 
@@ -79,4 +78,6 @@ def flux_err_to_mag_err(flux_nJy: float, flux_err_nJy: float) -> float:
     magerr : float
         Magnitude error
     """
+    import numpy as np
+
     return 2.5 / np.log(10) * abs(flux_err_nJy / flux_nJy)
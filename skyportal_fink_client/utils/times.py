@@ -0,0 +1,115 @@
+import math
+from datetime import datetime, timedelta
+
+# Julian date of the MJD origin, 1858-11-17T00:00:00
+MJD_OFFSET = 2400000.5
+
+_MJD_EPOCH = datetime(1858, 11, 17)
+_MS_PER_DAY = 86400000
+
+
+def _is_scalar(value):
+    return not hasattr(value, "__len__") or getattr(value, "ndim", 1) == 0
+
+
+def jd_to_mjd(jd):
+    """
+    Convert Julian dates to modified Julian dates.
+
+    The subtraction is exact in double precision for dates of the last few
+    centuries, as with astropy's Time(jd, format="jd").mjd, at a fraction of
+    its cost.
+
+    Arguments
+    ----------
+        jd : float, list or numpy.ndarray
+            Julian date(s)
+
+    Returns
+    ----------
+        float or numpy.ndarray
+            Modified Julian date(s), a float for a scalar input
+    """
+    if _is_scalar(jd):
+        return float(jd) - MJD_OFFSET
+    import numpy as np
+
+    return np.asarray(jd, dtype=float) - MJD_OFFSET
+
+
+def mjd_to_jd(mjd):
+    """
+    Convert modified Julian dates to Julian dates.
+
+    Arguments
+    ----------
+        mjd : float, list or numpy.ndarray
+            Modified Julian date(s)
+
+    Returns
+    ----------
+        float or numpy.ndarray
+            Julian date(s), a float for a scalar input
+    """
+    if _is_scalar(mjd):
+        return float(mjd) + MJD_OFFSET
+    import numpy as np
+
+    return np.asarray(mjd, dtype=float) + MJD_OFFSET
+
+
+def mjd_to_isot(mjd):
+    """
+    Convert modified Julian dates (UTC) to ISO 8601 strings with millisecond
+    precision, e.g. 2023-02-25T12:00:00.000, like astropy's
+    Time(mjd, format="mjd").isot. Days are taken as 86400 seconds, so times
+    within a leap second are off by up to one second.
+
+    A scalar is converted with the standard library, which is faster than
+    numpy for a single value; lists and arrays are converted at once with numpy.
+
+    Arguments
+    ----------
+        mjd : float, list or numpy.ndarray
+            Modified Julian date(s)
+
+    Returns
+    ----------
+        str or numpy.ndarray
+            ISO 8601 string(s), a str for a scalar input
+    """
+    # the day and its fraction are split before scaling, which is exact and
+    # keeps the rounding to the millisecond as precise as astropy's
+    if _is_scalar(mjd):
+        mjd = float(mjd)
+        days = math.floor(mjd)
+        milliseconds = round((mjd - days) * _MS_PER_DAY)
+        return (_MJD_EPOCH + timedelta(days, milliseconds=milliseconds)).isoformat(
+            timespec="milliseconds"
+        )
+    import numpy as np
+
+    mjd = np.asarray(mjd, dtype=float)
+    days = np.floor(mjd)
+    milliseconds = days.astype(np.int64) * _MS_PER_DAY + np.round(
+        (mjd - days) * _MS_PER_DAY
+    ).astype(np.int64)
+    dates = np.datetime64("1858-11-17", "ms") + milliseconds.astype("timedelta64[ms]")
+    return np.datetime_as_string(dates, unit="ms")
+
+
+def jd_to_isot(jd):
+    """
+    Convert Julian dates (UTC) to ISO 8601 strings, see mjd_to_isot.
+
+    Arguments
+    ----------
+        jd : float, list or numpy.ndarray
+            Julian date(s)
+
+    Returns
+    ----------
+        str or numpy.ndarray
+            ISO 8601 string(s), a str for a scalar input
+    """
+    return mjd_to_isot(jd_to_mjd(jd))
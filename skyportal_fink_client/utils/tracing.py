@@ -0,0 +1,308 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+DEFAULT_SAMPLE_RATE = 1.0
+
+# Trace being recorded in the current thread or asyncio task, None if none
+_current = contextvars.ContextVar("trace", default=None)
+_tracer = None
+
+
+class _NoSpan:
+    """Returned instead of a span when nothing is recorded, so that tracing costs nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Trace:
+    __slots__ = ("id", "name", "attrs", "spans", "start", "wall_start")
+
+    def __init__(self, name: str, attrs: dict):
+        self.id = f"{random.getrandbits(64):016x}"
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "start")
+
+    def __init__(self, trace: _Trace, name: str, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        record = {
+            "name": self.name,
+            "start": round(self.start - self.trace.start, 6),
+            "duration": round(end - self.start, 6),
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(self.attrs)
+        self.trace.spans.append(record)
+        return False
+
+    def set(self, **attrs):
+        """Add attributes known once the span started, e.g. a status code."""
+        self.attrs.update(attrs)
+
+
+class _TraceContext:
+    __slots__ = ("trace", "token")
+
+    def __init__(self, name: str, attrs: dict):
+        self.trace = _Trace(name, attrs)
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        trace = self.trace
+        record = {
+            "trace": trace.name,
+            "id": trace.id,
+            "start": round(trace.wall_start, 6),
+            "duration": round(time.perf_counter() - trace.start, 6),
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(trace.attrs)
+        record["spans"] = trace.spans
+        tracer = _tracer
+        if tracer is not None:
+            tracer.write(record)
+        return False
+
+    def set(self, **attrs):
+        self.trace.attrs.update(attrs)
+
+
+class Tracer:
+    """
+    Write sampled traces to a JSON-lines file, one line per trace with its
+    spans. Safe to use from several threads.
+
+    Arguments
+    ----------
+        path : str
+            File the traces are appended to
+        sample_rate : float
+            Fraction of the traces recorded, between 0 and 1
+    """
+
+    def __init__(self, path: str, sample_rate: float = DEFAULT_SAMPLE_RATE):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def write(self, record: dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def configure_tracing(path: str = None, sample_rate: float = DEFAULT_SAMPLE_RATE):
+    """
+    Turn tracing on, writing the sampled traces to ``path``, or off if ``path``
+    is None. The previous trace file, if any, is closed.
+
+    Arguments
+    ----------
+        path : str
+            JSON-lines file the traces are appended to
+        sample_rate : float
+            Fraction of the traces recorded, between 0 and 1
+
+    Returns
+    ----------
+        None
+    """
+    global _tracer
+    previous, _tracer = _tracer, None
+    if previous is not None:
+        previous.close()
+    if path is not None:
+        _tracer = Tracer(path, sample_rate)
+
+
+def _forget_tracer():
+    global _tracer
+    _tracer = None
+
+
+# a forked process (e.g. a decode process) does not write to the parent's trace file
+os.register_at_fork(after_in_child=_forget_tracer)
+
+
+def trace(name: str, **attrs):
+    """
+    Record a trace, e.g. of one alert, as a context manager: the spans opened
+    inside it, in the same thread or asyncio task, are written along with it.
+    Inside another trace, it is recorded as a span of that trace instead.
+    Returns a no-op context manager if tracing is off or the trace is not sampled.
+    """
+    current = _current.get()
+    if current is not None:
+        return _Span(current, name, attrs)
+    tracer = _tracer
+    if tracer is None or not tracer.sampled():
+        return _NO_SPAN
+    return _TraceContext(name, attrs)
+
+
+def span(name: str, **attrs):
+    """
+    Time a step of the current trace, as a context manager. Returns a no-op
+    context manager, at the cost of a context variable lookup, outside a
+    recorded trace.
+    """
+    current = _current.get()
+    if current is None:
+        return _NO_SPAN
+    return _Span(current, name, attrs)
+
+
+def traced(name: str, key: str = None):
+    """
+    Decorator recording each call of a function (or coroutine function) as a
+    trace, or as a span if called inside a trace.
+
+    Arguments
+    ----------
+        name : str
+            Name of the trace
+        key : str
+            Name of an argument recorded with the trace, e.g. "object_id".
+            Taken from the keyword arguments, or else the first positional one.
+    """
+
+    def attrs(args, kwargs):
+        if key is None:
+            return {}
+        return {key: kwargs[key] if key in kwargs else args[0] if args else None}
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await function(*args, **kwargs)
+                with trace(name, **attrs(args, kwargs)):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with trace(name, **attrs(args, kwargs)):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _percentile(values: list, fraction: float):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize_traces(paths):
+    """
+    Aggregate trace files: count, mean, median, 95th percentile and maximum
+    duration of each trace and span name.
+
+    Arguments
+    ----------
+        paths : str or list
+            JSON-lines trace files
+
+    Returns
+    ----------
+        dict
+            name -> {"count", "mean", "p50", "p95", "max"}, durations in
+            seconds; span names are prefixed with their trace name, e.g.
+            "alert/skyportal PUT /api/photometry"
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    durations = {}
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                record = json.loads(line)
+                durations.setdefault(record["trace"], []).append(record["duration"])
+                for span in record["spans"]:
+                    name = span["name"]
+                    if "method" in span and "endpoint" in span:
+                        name = f"{name} {span['method']} {span['endpoint']}"
+                    durations.setdefault(f"{record['trace']}/{name}", []).append(
+                        span["duration"]
+                    )
+    summary = {}
+    for name, values in sorted(durations.items()):
+        values.sort()
+        summary[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": _percentile(values, 0.5),
+            "p95": _percentile(values, 0.95),
+            "max": values[-1],
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    # python -m skyportal_fink_client.utils.tracing traces.jsonl [...]
+    summary = summarize_traces(sys.argv[1:])
+    width = max((len(name) for name in summary), default=0)
+    print(
+        f"{'name':<{width}} {'count':>8} {'mean ms':>9} {'p50 ms':>9} "
+        f"{'p95 ms':>9} {'max ms':>9}"
+    )
+    for name, stats in summary.items():
+        print(
+            f"{name:<{width}} {stats['count']:>8} "
+            + " ".join(
+                f"{stats[key] * 1000:>9.2f}" for key in ("mean", "p50", "p95", "max")
+            )
+        )
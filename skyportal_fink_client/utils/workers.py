@@ -0,0 +1,140 @@
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+
+from .log import make_log
+
+DEFAULT_RESTART_DELAY = 5.0
+DEFAULT_STOP_TIMEOUT = 20.0
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _run_worker(index: int, target: callable, kwargs: dict, index_kwarg: str = None):
+    """Entry point of a worker process: run target until SIGTERM or Ctrl+C."""
+    # poll_alerts cleans up (flush, commit, close) on KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _interrupt)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if index_kwarg is not None:
+        kwargs = {**kwargs, index_kwarg: index}
+    try:
+        target(log=make_log(f"fink-worker-{index}"), **kwargs)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(
+    num_workers: int,
+    target: callable,
+    kwargs: dict = None,
+    log: callable = None,
+    restart_delay: float = DEFAULT_RESTART_DELAY,
+    stop_timeout: float = DEFAULT_STOP_TIMEOUT,
+    index_kwarg: str = None,
+):
+    """
+    Run ``num_workers`` processes calling ``target(log=..., **kwargs)`` and keep
+    them running. Used with poll_alerts, the workers join the same Kafka consumer
+    group, so Kafka spreads the topic partitions across them.
+
+    Dead workers are restarted after ``restart_delay`` seconds. SIGHUP restarts
+    all the workers, e.g. to reload the config. SIGTERM and SIGINT stop them:
+    each worker gets SIGTERM, turned into a KeyboardInterrupt so it can finish
+    cleanly, and is killed if it is still running after ``stop_timeout`` seconds.
+
+    Arguments
+    ----------
+        num_workers : int
+            Number of worker processes
+        target : callable
+            Function run by each worker, e.g. poll_alerts
+        kwargs : dict
+            Keyword arguments passed to target
+        log : function
+            Function to log messages. Can be omitted.
+        restart_delay : float
+            Seconds to wait before restarting a worker that exited
+        stop_timeout : float
+            Seconds to wait for a worker to stop before killing it
+        index_kwarg : str
+            If set, each worker also gets its index (0 to num_workers - 1)
+            as this keyword argument, e.g. "worker_index" for poll_alerts
+
+    Returns
+    ----------
+        None
+    """
+    kwargs = kwargs or {}
+    signals = []
+
+    def on_signal(signum, frame):
+        signals.append(signum)
+
+    previous_handlers = {
+        signum: signal.signal(signum, on_signal)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+    }
+
+    def start(index):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(index, target, kwargs, index_kwarg),
+            name=f"fink-worker-{index}",
+        )
+        process.start()
+        if log is not None:
+            log(f"Started worker {index} (pid {process.pid})")
+        return process
+
+    def stop(processes):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + stop_timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                if log is not None:
+                    log(f"Worker pid {process.pid} did not stop, killing it")
+                process.kill()
+                process.join()
+
+    workers = [start(index) for index in range(num_workers)]
+    restart_at = {}
+    try:
+        while True:
+            if signal.SIGTERM in signals or signal.SIGINT in signals:
+                if log is not None:
+                    log("Stopping workers")
+                break
+            if signal.SIGHUP in signals:
+                signals.clear()
+                if log is not None:
+                    log("Reloading: restarting all workers")
+                stop(workers)
+                workers = [start(index) for index in range(num_workers)]
+                restart_at.clear()
+
+            now = time.monotonic()
+            for index, process in enumerate(workers):
+                if process.is_alive():
+                    continue
+                if index not in restart_at:
+                    if log is not None:
+                        log(
+                            f"Worker {index} (pid {process.pid}) exited with code "
+                            f"{process.exitcode}, restarting in {restart_delay} seconds"
+                        )
+                    restart_at[index] = now + restart_delay
+                elif now >= restart_at[index]:
+                    del restart_at[index]
+                    workers[index] = start(index)
+
+            wait([process.sentinel for process in workers], timeout=1.0)
+    finally:
+        stop(workers)
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
@@ -0,0 +1,107 @@
+# coding: utf-8
+"""
+Measure how many alerts per second the client posts to the SkyPortal stub,
+for each posting mode, e.g.::
+
+    python tests/benchmark.py --alerts 500 --latency 0.01
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from skyportal_stub import SkyPortalStub
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+import skyportal_fink_client.utils.skyportal_api_async as skyportal_api_async
+from skyportal_fink_client.utils.batching import PhotometryBatcher
+from skyportal_fink_client.utils.registry import ObjectRegistry
+
+TOKEN = "benchmark"
+NAME = "provisioned-admin"
+
+
+def _alerts(count, objects):
+    for i in range(count):
+        yield [
+            f"ZTF21bench{i % objects}",
+            60000.0 + i * 1e-3,
+            ["CFH12k", "ZTF"],
+            "ztfg",
+            18.0,
+            0.1,
+            20.0,
+            "ab",
+            10.0,
+            20.0,
+            "SN candidate",
+        ]
+
+
+def run(mode, count, objects, latency, concurrency):
+    """Post ``count`` alerts of ``objects`` objects in the given mode and print the throughput."""
+    with SkyPortalStub(latency=latency, user_name=NAME) as stub:
+        group_id, stream_id, filter_id, taxonomy_id = (
+            skyportal_fink_client.init_skyportal(
+                stub.url, TOKEN, "Fink", NAME, True, log=None, survey="ztf"
+            )[:4]
+        )
+        batcher = PhotometryBatcher(stub.url, TOKEN) if mode == "batched" else None
+        registry = ObjectRegistry() if mode in ("batched", "async") else None
+        poster = None
+        post = skyportal_api.from_fink_to_skyportal
+        if mode == "async":
+            poster = skyportal_api_async.AlertPoster(concurrency)
+            poster.run(skyportal_api_async.init_session(stub.url, TOKEN))
+            post = poster.submit
+
+        start = time.monotonic()
+        results = [
+            post(
+                *alert,
+                probability=None,
+                group_id=group_id,
+                filter_id=filter_id,
+                stream_id=stream_id,
+                taxonomy_id=taxonomy_id,
+                whitelisted=True,
+                url=stub.url,
+                token=TOKEN,
+                skyportal_name=NAME,
+                log=lambda message: None,
+                photometry_batcher=batcher,
+                object_registry=registry,
+            )
+            for alert in _alerts(count, objects)
+        ]
+        if poster is not None:
+            results = [future.result() for future in results]
+            poster.close()
+        if batcher is not None:
+            batcher.flush()
+        elapsed = time.monotonic() - start
+
+        skyportal_api.close_sessions()
+        skyportal_api.invalidate_instrument_id()
+        skyportal_api.invalidate_classification()
+        failed = sum(status != 200 for status in results)
+        print(
+            f"{mode:>8}: {count / elapsed:8.1f} alerts/s, "
+            f"{sum(stub.counts.values())} requests, {failed} failed"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SkyPortal client benchmark")
+    parser.add_argument("--alerts", type=int, default=300)
+    parser.add_argument("--objects", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", default=["sync", "batched", "async"])
+    args = parser.parse_args()
+    for mode in args.modes:
+        run(mode, args.alerts, args.objects, args.latency, args.concurrency)
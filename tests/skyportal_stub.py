@@ -0,0 +1,434 @@
+# coding: utf-8
+"""
+In-process stand-in for the SkyPortal API endpoints used by the client, to test
+and benchmark it without a SkyPortal instance or network access.
+
+Used from the tests::
+
+    with SkyPortalStub(latency=0.01) as stub:
+        skyportal_api.post_source("ZTF21abc", 10.0, 20.0, [1], stub.url, "token")
+        assert stub.counts["POST /api/sources"] == 1
+
+or as a standalone server to point a config.yaml at::
+
+    python tests/skyportal_stub.py --port 9000 --latency 0.02 --rate-limit-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubState:
+    """Objects stored by the stub, mimicking what SkyPortal returns for them."""
+
+    def __init__(self, instruments, user_id, user_name):
+        self.user_id = user_id
+        self.user_name = user_name
+        self._ids = 0
+        self.groups = {}
+        self.streams = {}
+        self.filters = {}
+        self.taxonomies = {}
+        self.telescopes = {}
+        self.instruments = {}
+        self.sources = {}
+        self.candidates = []
+        self.photometry = []
+        self.classifications = {}
+        for name in instruments:
+            self.instruments[self.next_id()] = {"name": name}
+
+    def next_id(self):
+        self._ids += 1
+        return self._ids
+
+
+def _column(data, key, length):
+    """Return a photometry field as a list, whether it was sent as a column or a scalar."""
+    value = data.get(key)
+    return value if isinstance(value, list) else [value] * length
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # send headers and body in one segment, or keep-alive clients wait for
+    # delayed ACKs on every request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    # (method, path regex, handler name)
+    routes = [
+        ("GET", r"/api/sysinfo", "get_sysinfo"),
+        ("GET", r"/api/groups", "get_groups"),
+        ("POST", r"/api/groups", "post_group"),
+        ("POST", r"/api/groups/(\d+)/streams", "post_group_stream"),
+        ("GET", r"/api/streams", "get_streams"),
+        ("POST", r"/api/streams", "post_stream"),
+        ("GET", r"/api/filters", "get_filters"),
+        ("POST", r"/api/filters", "post_filter"),
+        ("GET", r"/api/taxonomy", "get_taxonomies"),
+        ("GET", r"/api/taxonomy/(\d+)", "get_taxonomy"),
+        ("POST", r"/api/taxonomy", "post_taxonomy"),
+        ("POST", r"/api/telescope", "post_telescope"),
+        ("GET", r"/api/instrument", "get_instruments"),
+        ("POST", r"/api/instrument", "post_instrument"),
+        ("GET", r"/api/sources", "get_sources"),
+        ("POST", r"/api/sources", "post_source"),
+        ("GET", r"/api/sources/([^/]+)/classifications", "get_classifications"),
+        ("GET", r"/api/candidates", "get_candidates"),
+        ("POST", r"/api/candidates", "post_candidate"),
+        ("PUT", r"/api/photometry", "put_photometry"),
+        ("POST", r"/api/classification", "post_classification"),
+        ("PUT", r"/api/classification/(\d+)", "put_classification"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def _dispatch(self, method):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        data = json.loads(body) if body else {}
+        path = self.path.split("?")[0]
+        stub._record(method, path)
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        fault = stub._fault()
+        if fault == 429:
+            self._reply(
+                429,
+                {"status": "error", "message": "Too many requests", "data": {}},
+                {"Retry-After": str(stub.retry_after)},
+            )
+            return
+        if fault == 500:
+            self._error(500, "Injected error")
+            return
+
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                with stub._lock:
+                    status, payload = getattr(self, name)(
+                        stub.state, data, *match.groups()
+                    )
+                if status == 200:
+                    self._success(payload)
+                else:
+                    self._reply(status, payload)
+                return
+        self._error(404, f"No route for {method} {path}")
+
+    def _reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _success(self, data):
+        self._reply(200, {"status": "success", "data": data})
+
+    def _error(self, status, message):
+        self._reply(status, {"status": "error", "message": message, "data": {}})
+
+    @staticmethod
+    def _fail(status, message):
+        return status, {"status": "error", "message": message, "data": {}}
+
+    # groups, streams and filters
+
+    def get_sysinfo(self, state, data):
+        return 200, {"version": "stub"}
+
+    def get_groups(self, state, data):
+        groups = [{"id": id, **group} for id, group in state.groups.items()]
+        return 200, {"all_groups": groups, "user_accessible_groups": groups}
+
+    def post_group(self, state, data):
+        id = state.next_id()
+        state.groups[id] = {"name": data["name"], "streams": []}
+        return 200, {"id": id}
+
+    def post_group_stream(self, state, data, group_id):
+        group = state.groups.get(int(group_id))
+        if group is None:
+            return self._fail(400, "Invalid group id")
+        group["streams"].append(data["stream_id"])
+        return 200, {}
+
+    def get_streams(self, state, data):
+        return 200, [{"id": id, **stream} for id, stream in state.streams.items()]
+
+    def post_stream(self, state, data):
+        id = state.next_id()
+        state.streams[id] = {"name": data["name"]}
+        return 200, {"id": id}
+
+    def get_filters(self, state, data):
+        return 200, [{"id": id, **filter} for id, filter in state.filters.items()]
+
+    def post_filter(self, state, data):
+        id = state.next_id()
+        state.filters[id] = dict(data)
+        return 200, {"id": id}
+
+    # taxonomies, telescopes and instruments
+
+    def get_taxonomies(self, state, data):
+        return 200, [
+            {"id": id, **taxonomy} for id, taxonomy in state.taxonomies.items()
+        ]
+
+    def get_taxonomy(self, state, data, taxonomy_id):
+        taxonomy = state.taxonomies.get(int(taxonomy_id))
+        if taxonomy is None:
+            return self._fail(400, "Invalid taxonomy id")
+        return 200, {"id": int(taxonomy_id), **taxonomy}
+
+    def post_taxonomy(self, state, data):
+        id = state.next_id()
+        state.taxonomies[id] = {
+            "name": data["name"],
+            "hierarchy": data["hierarchy"],
+            "version": data["version"],
+        }
+        return 200, {"taxonomy_id": id}
+
+    def post_telescope(self, state, data):
+        id = state.next_id()
+        state.telescopes[id] = dict(data)
+        return 200, {"id": id}
+
+    def get_instruments(self, state, data):
+        return 200, [
+            {"id": id, **instrument} for id, instrument in state.instruments.items()
+        ]
+
+    def post_instrument(self, state, data):
+        id = state.next_id()
+        state.instruments[id] = {"name": data["name"]}
+        return 200, {"id": id}
+
+    # sources, candidates and photometry
+
+    def get_sources(self, state, data):
+        return 200, {"sources": [{"id": id} for id in state.sources]}
+
+    def post_source(self, state, data):
+        source = state.sources.setdefault(
+            data["id"], {"ra": data["ra"], "dec": data["dec"], "group_ids": set()}
+        )
+        source["group_ids"].update(data.get("group_ids", []))
+        return 200, {"id": data["id"]}
+
+    def get_candidates(self, state, data):
+        ids = sorted({candidate["id"] for candidate in state.candidates})
+        return 200, {"candidates": [{"id": id} for id in ids]}
+
+    def post_candidate(self, state, data):
+        ids = []
+        for filter_id in data["filter_ids"]:
+            if filter_id not in state.filters:
+                return self._fail(400, "Invalid filter ID")
+            state.candidates.append(
+                {
+                    "id": data["id"],
+                    "filter_id": filter_id,
+                    "passed_at": data["passed_at"],
+                }
+            )
+            ids.append(len(state.candidates))
+        return 200, {"ids": ids}
+
+    def put_photometry(self, state, data):
+        if data.get("instrument_id") not in state.instruments:
+            return self._fail(400, "Invalid instrument ID")
+        obj_ids = data["obj_id"]
+        obj_ids = obj_ids if isinstance(obj_ids, list) else [obj_ids]
+        for obj_id in obj_ids:
+            if obj_id not in state.sources:
+                return self._fail(400, f"Invalid obj_id: {obj_id}")
+        fields = [key for key in data if key not in ("group_ids", "stream_ids")]
+        columns = {key: _column(data, key, len(obj_ids)) for key in fields}
+        ids = []
+        for i in range(len(obj_ids)):
+            state.photometry.append({key: columns[key][i] for key in fields})
+            ids.append(len(state.photometry))
+        return 200, {"ids": ids}
+
+    # classifications
+
+    def get_classifications(self, state, data, object_id):
+        if object_id not in state.sources:
+            return self._fail(400, f"Invalid obj_id: {object_id}")
+        return 200, [
+            {"id": id, **classification}
+            for id, classification in state.classifications.items()
+            if classification["obj_id"] == object_id
+        ]
+
+    def post_classification(self, state, data):
+        if data["obj_id"] not in state.sources:
+            return self._fail(400, f"Invalid obj_id: {data['obj_id']}")
+        if data["taxonomy_id"] not in state.taxonomies:
+            return self._fail(400, "Invalid taxonomy id")
+        id = state.next_id()
+        state.classifications[id] = {
+            "obj_id": data["obj_id"],
+            "classification": data["classification"],
+            "probability": data.get("probability"),
+            "taxonomy_id": data["taxonomy_id"],
+            "author_id": state.user_id,
+            "author_name": state.user_name,
+        }
+        return 200, {"classification_id": id}
+
+    def put_classification(self, state, data, classification_id):
+        classification = state.classifications.get(int(classification_id))
+        if classification is None:
+            return self._fail(404, "Invalid classification ID")
+        classification["classification"] = data["classification"]
+        classification["probability"] = data.get("probability")
+        return 200, {}
+
+
+class SkyPortalStub:
+    """
+    SkyPortal stub served from a background thread on ``127.0.0.1``.
+
+    Arguments
+    ----------
+        port : int
+            Port to listen on. A free port is picked if 0.
+        latency : float
+            Seconds added to every request
+        error_rate : float
+            Fraction of requests answered with a 500 error
+        rate_limit_rate : float
+            Fraction of requests answered with a 429 and a Retry-After header
+        retry_after : float
+            Value of the Retry-After header of the 429 responses
+        instruments : tuple
+            Names of the instruments that exist from the start
+        user_name : str
+            Name of the user the classifications are authored by, i.e. the
+            ``skyportal_name`` of the client
+        seed : int
+            Seed of the error and 429 injection
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.01,
+        instruments: tuple = ("ZTF", "LSSTCam"),
+        user_name: str = "provisioned-admin",
+        seed: int = None,
+    ):
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.state = _StubState(instruments, user_id=1, user_name=user_name)
+        self.requests = []
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            name="skyportal-stub",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, method, path):
+        # ids in paths are folded so that counts are per endpoint
+        endpoint = re.sub(r"/api/sources/[^/]+/", "/api/sources/{id}/", path)
+        endpoint = re.sub(r"/\d+(?=/|$)", "/{id}", endpoint)
+        with self._lock:
+            self.requests.append((method, path))
+            self.counts[f"{method} {endpoint}"] += 1
+
+    def _fault(self):
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.rate_limit_rate:
+            return 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SkyPortal API stub")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+    stub = SkyPortalStub(
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+    ).start()
+    print(f"SkyPortal stub listening on {stub.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(10)
+            print(dict(stub.counts))
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,101 @@
+# coding: utf-8
+import os
+
+import pytest
+
+from skyportal_fink_client.skyportal_fink_client import (
+    _extract_ztf_data,
+    extract_alerts_data,
+    poll_alerts_batch,
+)
+
+TOPIC = "fink_extragalactic_new_candidate_lsst"
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample.avro")
+
+
+def _lsst_alert(object_id, flux=1000.0):
+    return {
+        "diaSource": {
+            "midpointMjdTai": 60000.0,
+            "band": "r",
+            "psfFlux": flux,
+            "psfFluxErr": 50.0,
+        },
+        "diaObject": {"diaObjectId": object_id, "ra": 10.5, "dec": -20.3},
+    }
+
+
+class _Message:
+    def __init__(self, offset):
+        self._offset = offset
+
+    def partition(self):
+        return 0
+
+    def offset(self):
+        return self._offset
+
+
+class _Consumer:
+    def __init__(self, alerts):
+        self.messages = [
+            (topic, alert, _Message(offset))
+            for offset, (topic, alert) in enumerate(alerts)
+        ]
+
+    def poll_messages(self, num_alerts, timeout):
+        batch, self.messages = self.messages[:num_alerts], self.messages[num_alerts:]
+        return batch
+
+
+def test_lsst_batch_keeps_order_and_drops_invalid():
+    alerts = [_lsst_alert(1), _lsst_alert(2, flux=-1.0), _lsst_alert(3)]
+    records = extract_alerts_data("lsst", [TOPIC] * 3, alerts)
+    assert records[0][0] == "1"
+    assert records[1] is None
+    assert records[2][0] == "3"
+
+
+def test_ztf_batch_without_valid_alert_skips_classifier():
+    assert extract_alerts_data("ztf", ["t", "t"], [None, {"objectId": "x"}]) == [
+        None,
+        None,
+    ]
+
+
+def test_unknown_survey_raises():
+    with pytest.raises(ValueError, match="Unknown survey"):
+        extract_alerts_data("decam", [], [])
+
+
+def test_poll_alerts_batch_returns_extracted_records():
+    consumer = _Consumer(
+        [
+            (TOPIC, _lsst_alert(1)),
+            # could not be decoded
+            (TOPIC, None),
+            (TOPIC, _lsst_alert(2, flux=0.0)),
+            (TOPIC, _lsst_alert(3)),
+        ]
+    )
+    unparsed = []
+    batch = poll_alerts_batch(
+        consumer, "lsst", 10, 1, on_unparsed=lambda *args: unparsed.append(args)
+    )
+    # the rest of the batch is kept
+    assert [(topic, data[0]) for topic, data in batch] == [(TOPIC, "1"), (TOPIC, "3")]
+    assert [(alert is None, token) for _, alert, token in unparsed] == [
+        (True, (TOPIC, 0, 1)),
+        (False, (TOPIC, 0, 2)),
+    ]
+    assert poll_alerts_batch(consumer, "lsst", 10, 1) == []
+
+
+def test_ztf_batch_matches_single_alert_extraction():
+    pytest.importorskip("fink_filters")
+    from fink_client.avro_utils import AlertReader
+
+    alerts = AlertReader(SAMPLE).to_list()
+    topics = ["fink_sn_candidates_ztf"] * len(alerts)
+    records = extract_alerts_data("ztf", topics, alerts)
+    assert records == [_extract_ztf_data(t, a) for t, a in zip(topics, alerts)]
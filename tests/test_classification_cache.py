@@ -0,0 +1,187 @@
+# coding: utf-8
+from collections import OrderedDict
+
+import pytest
+
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+
+URL = "http://localhost:5000"
+TOKEN = "abc123"
+NAME = "fink"
+TAXONOMY = 3
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def skyportal(monkeypatch):
+    """Fake classification endpoints, recording the calls."""
+    state = {"calls": [], "classifications": {}, "next_id": 100, "put_status": 200}
+
+    def api(method, endpoint, data=None, token=None):
+        state["calls"].append((method, endpoint))
+        if method == "GET":
+            object_id = endpoint.split("/")[-2]
+            return FakeResponse(
+                200, {"data": state["classifications"].get(object_id, [])}
+            )
+        if method == "POST":
+            state["next_id"] += 1
+            return FakeResponse(
+                200,
+                {"status": "success", "data": {"classification_id": state["next_id"]}},
+            )
+        return FakeResponse(state["put_status"], {})
+
+    monkeypatch.setattr(skyportal_api, "api", api)
+    monkeypatch.setattr(skyportal_api, "_classifications", OrderedDict())
+    monkeypatch.setattr(skyportal_api, "_author_ids", {})
+    monkeypatch.setattr(
+        skyportal_api,
+        "_classification_cache_size",
+        skyportal_api.DEFAULT_CLASSIFICATION_CACHE_SIZE,
+    )
+    monkeypatch.setattr(
+        skyportal_api,
+        "_classification_cache_ttl",
+        skyportal_api.DEFAULT_CLASSIFICATION_CACHE_TTL,
+    )
+    return state
+
+
+def _ours(classification_id, classification="SN", probability=0.5):
+    return {
+        "id": classification_id,
+        "author_id": 9,
+        "author_name": NAME,
+        "taxonomy_id": TAXONOMY,
+        "classification": classification,
+        "probability": probability,
+    }
+
+
+def _lookup(object_id):
+    return skyportal_api.classification_exists_for_objs(
+        object_id, NAME, TAXONOMY, URL, TOKEN
+    )
+
+
+def _gets(state):
+    return [call for call in state["calls"] if call[0] == "GET"]
+
+
+def test_lookup_result_is_cached(skyportal):
+    skyportal["classifications"]["ZTF1"] = [_ours(5)]
+    assert _lookup("ZTF1") == (5, 9)
+    assert _lookup("ZTF1") == (5, 9)
+    assert len(_gets(skyportal)) == 1
+
+
+def test_missing_classification_is_not_cached(skyportal):
+    assert _lookup("ZTF1") == (None, None)
+    assert _lookup("ZTF1") == (None, None)
+    assert len(_gets(skyportal)) == 2
+
+
+def test_post_fills_the_cache_once_author_is_known(skyportal):
+    skyportal["classifications"]["ZTF1"] = [_ours(5)]
+    _lookup("ZTF1")
+
+    status, _ = skyportal_api.post_classification(
+        "ZTF2", "SN", 0.7, TAXONOMY, [1], URL, TOKEN
+    )
+    assert status == 200
+    assert _lookup("ZTF2") == (101, 9)
+    assert len(_gets(skyportal)) == 1
+    entry = skyportal_api._cached_classification("ZTF2", TAXONOMY, URL)
+    assert entry[2:4] == ["SN", 0.7]
+
+
+def test_post_without_known_author_falls_back_to_lookup(skyportal):
+    skyportal_api.post_classification("ZTF2", "SN", 0.7, TAXONOMY, [1], URL, TOKEN)
+    skyportal["classifications"]["ZTF2"] = [_ours(101)]
+    assert _lookup("ZTF2") == (101, 9)
+    assert len(_gets(skyportal)) == 1
+
+
+def test_update_refreshes_the_cache(skyportal):
+    skyportal["classifications"]["ZTF1"] = [_ours(5)]
+    _lookup("ZTF1")
+    status = skyportal_api.update_classification(
+        5, 9, "ZTF1", "KN", 0.9, NAME, TAXONOMY, [1], URL, TOKEN
+    )
+    assert status == 200
+    assert skyportal_api._cached_classification("ZTF1", TAXONOMY, URL)[:4] == [
+        5,
+        9,
+        "KN",
+        0.9,
+    ]
+
+
+def test_failed_update_drops_the_entry(skyportal):
+    skyportal["classifications"]["ZTF1"] = [_ours(5)]
+    _lookup("ZTF1")
+    skyportal["put_status"] = 404
+    skyportal_api.update_classification(
+        5, 9, "ZTF1", "KN", 0.9, NAME, TAXONOMY, [1], URL, TOKEN
+    )
+    _lookup("ZTF1")
+    assert len(_gets(skyportal)) == 2
+
+
+def test_cache_is_bounded_lru(skyportal):
+    skyportal_api.init_classification_cache(size=2)
+    for object_id in ("ZTF1", "ZTF2", "ZTF3"):
+        skyportal["classifications"][object_id] = [_ours(1)]
+    _lookup("ZTF1")
+    _lookup("ZTF2")
+    _lookup("ZTF1")  # ZTF2 becomes the least recently used
+    _lookup("ZTF3")
+    assert skyportal_api._cached_classification("ZTF2", TAXONOMY, URL) is None
+    assert skyportal_api._cached_classification("ZTF1", TAXONOMY, URL) is not None
+    assert len(_gets(skyportal)) == 3
+
+
+def test_expired_entry_is_looked_up_again(skyportal):
+    skyportal_api.init_classification_cache(ttl=0)
+    skyportal["classifications"]["ZTF1"] = [_ours(5)]
+    _lookup("ZTF1")
+    _lookup("ZTF1")
+    assert len(_gets(skyportal)) == 2
+
+
+def test_unchanged_classification_is_skipped_and_counted(skyportal, monkeypatch):
+    monkeypatch.setattr(skyportal_api, "_skipped_classification_writes", 0)
+    skyportal["classifications"]["ZTF1"] = [_ours(5, "SN", 0.5)]
+    _lookup("ZTF1")
+    assert skyportal_api.classification_unchanged("ZTF1", TAXONOMY, URL, "SN", 0.5)
+    assert skyportal_api.skipped_classification_writes() == 1
+
+
+def test_changed_classification_is_not_skipped(skyportal, monkeypatch):
+    monkeypatch.setattr(skyportal_api, "_skipped_classification_writes", 0)
+    skyportal["classifications"]["ZTF1"] = [_ours(5, "SN", 0.5)]
+    _lookup("ZTF1")
+    assert not skyportal_api.classification_unchanged("ZTF1", TAXONOMY, URL, "KN", 0.5)
+    assert not skyportal_api.classification_unchanged("ZTF1", TAXONOMY, URL, "SN", 0.6)
+    # unknown object: nothing to compare with
+    assert not skyportal_api.classification_unchanged("ZTF2", TAXONOMY, URL, "SN", 0.5)
+    assert skyportal_api.skipped_classification_writes() == 0
+
+
+def test_update_then_same_classification_is_skipped(skyportal, monkeypatch):
+    monkeypatch.setattr(skyportal_api, "_skipped_classification_writes", 0)
+    skyportal["classifications"]["ZTF1"] = [_ours(5, "SN", 0.5)]
+    _lookup("ZTF1")
+    skyportal_api.update_classification(
+        5, 9, "ZTF1", "KN", None, NAME, TAXONOMY, [1], URL, TOKEN
+    )
+    assert skyportal_api.classification_unchanged("ZTF1", TAXONOMY, URL, "KN", None)
@@ -76,3 +76,128 @@ def test_topics_not_a_list_raises():
 def test_empty_string_field_raises(field):
     with pytest.raises(ValueError, match=field):
         validate_config(_config(**{field: ""}))
+
+
+@pytest.mark.parametrize("value", [0, -1, "10", 1.5, True])
+def test_invalid_pool_size_raises(value):
+    with pytest.raises(ValueError, match="skyportal_pool_size"):
+        validate_config(_config(skyportal_pool_size=value))
+
+
+def test_valid_pool_size_passes():
+    validate_config(_config(skyportal_pool_size=32))
+
+
+@pytest.mark.parametrize("value", [0, -2.0, "2", False])
+def test_invalid_batch_max_age_raises(value):
+    with pytest.raises(ValueError, match="photometry_batch_max_age"):
+        validate_config(_config(photometry_batch_max_age=value))
+
+
+def test_valid_batch_settings_pass():
+    validate_config(_config(photometry_batch_size=500, photometry_batch_max_age=0.5))
+
+
+def test_invalid_rate_limit_raises():
+    with pytest.raises(ValueError, match="skyportal_rate_limit"):
+        validate_config(_config(skyportal_rate_limit=0))
+
+
+def test_valid_rate_limit_passes():
+    validate_config(_config(skyportal_rate_limit=2.5, skyportal_rate_burst=5))
+
+
+def test_at_least_once_must_be_bool():
+    with pytest.raises(ValueError, match="fink_at_least_once"):
+        validate_config(_config(fink_at_least_once="yes"))
+
+
+def test_valid_delivery_settings_pass():
+    validate_config(_config(fink_at_least_once=True, fink_commit_interval=10))
+
+
+def test_invalid_log_level_raises():
+    with pytest.raises(ValueError, match="log_level"):
+        validate_config(_config(log_level="verbose"))
+
+
+def test_valid_log_settings_pass():
+    validate_config(
+        _config(
+            log_level="info",
+            log_max_bytes=1_000_000,
+            log_rotate_interval=86400,
+            log_backup_count=3,
+        )
+    )
+
+
+def test_invalid_classification_cache_size_raises():
+    with pytest.raises(ValueError, match="skyportal_classification_cache_size"):
+        validate_config(_config(skyportal_classification_cache_size=0))
+
+
+def test_invalid_object_registry_path_raises():
+    with pytest.raises(ValueError, match="object_registry_path"):
+        validate_config(_config(object_registry_path=""))
+
+
+def test_valid_object_registry_settings_pass():
+    validate_config(
+        _config(
+            object_registry=True,
+            object_registry_path="registry.sqlite",
+            object_registry_candidate_interval=0.5,
+        )
+    )
+
+
+def test_invalid_spool_settings_raise():
+    with pytest.raises(ValueError, match="spool_path"):
+        validate_config(_config(spool_path=""))
+    with pytest.raises(ValueError, match="spool_retry_interval"):
+        validate_config(_config(spool_retry_interval=0))
+    with pytest.raises(ValueError, match="spool_batch_size"):
+        validate_config(_config(spool_batch_size=0))
+
+
+def test_invalid_dead_letter_path_raises():
+    with pytest.raises(ValueError, match="dead_letter_path"):
+        validate_config(_config(dead_letter_path=3))
+
+
+def test_invalid_metrics_port_raises():
+    with pytest.raises(ValueError, match="metrics_port"):
+        validate_config(_config(metrics_port="9100"))
+
+
+def test_invalid_trace_sample_rate_raises():
+    with pytest.raises(ValueError, match="trace_sample_rate"):
+        validate_config(_config(trace_sample_rate=1.5))
+    validate_config(_config(trace_path="traces.jsonl", trace_sample_rate=0.01))
+
+
+def test_invalid_replay_chunk_size_raises():
+    with pytest.raises(ValueError, match="replay_chunk_size"):
+        validate_config(_config(replay_chunk_size=0))
+
+
+def test_warm_up_must_be_bool():
+    with pytest.raises(ValueError, match="warm_up"):
+        validate_config(_config(warm_up="no"))
+    validate_config(_config(warm_up=False))
+
+
+def test_projected_decoding_must_be_bool():
+    with pytest.raises(ValueError, match="fink_projected_decoding"):
+        validate_config(_config(fink_projected_decoding="yes"))
+
+
+def test_invalid_decode_processes_raises():
+    with pytest.raises(ValueError, match="fink_decode_processes"):
+        validate_config(_config(fink_decode_processes=0))
+
+
+def test_invalid_dedup_window_raises():
+    with pytest.raises(ValueError, match="fink_dedup_window"):
+        validate_config(_config(fink_dedup_window=-1))
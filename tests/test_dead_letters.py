@@ -0,0 +1,206 @@
+# coding: utf-8
+import numpy as np
+import pytest
+import yaml
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils.deadletter import DeadLetterStore
+
+TOKEN = "abc123"
+NAME = "provisioned-admin"
+
+
+def _alert(object_id="ZTF21abc", mjd=60000.0):
+    return [
+        object_id,
+        mjd,
+        ["CFH12k", "ZTF"],
+        "ztfg",
+        18.0,
+        0.1,
+        20.0,
+        "ab",
+        10.0,
+        20.0,
+        "SN candidate",
+        False,
+    ]
+
+
+def test_entries_keep_the_failure_details(tmp_path):
+    store = DeadLetterStore(str(tmp_path / "dead.sqlite"))
+    store.add(
+        "photometry",
+        "fink_sn_candidates_ztf",
+        status=400,
+        body={"message": "bad filter"},
+        data=_alert(),
+        token=("fink_sn_candidates_ztf", 2, 41),
+    )
+    (entry,) = store.entries()
+    assert entry["stage"] == "photometry"
+    assert entry["status"] == 400
+    assert entry["body"] == '{"message": "bad filter"}'
+    assert (entry["topic"], entry["partition"], entry["offset"]) == (
+        "fink_sn_candidates_ztf",
+        2,
+        41,
+    )
+    assert entry["data"] == _alert()
+    assert entry["attempts"] == 1
+
+    store.update(entry["id"], "classification", 500)
+    (entry,) = store.entries()
+    assert (entry["stage"], entry["status"], entry["attempts"]) == (
+        "classification",
+        500,
+        2,
+    )
+    store.remove([entry["id"]])
+    assert len(store) == 0
+    store.close()
+
+
+def test_raw_alerts_are_stored_without_cutouts(tmp_path):
+    store = DeadLetterStore(str(tmp_path / "dead.sqlite"))
+    store.add(
+        "extract",
+        "fink_sn_candidates_ztf",
+        alert={
+            "objectId": "ZTF21abc",
+            "candidate": {"jd": np.float64(2460000.5), "fid": np.int32(1)},
+            "cutoutScience": {"stampData": b"\x00" * 1000},
+        },
+    )
+    assert store.entries()[0]["alert"] == {
+        "objectId": "ZTF21abc",
+        "candidate": {"jd": 2460000.5, "fid": 1},
+    }
+
+
+def test_entries_filter_by_stage_and_id(tmp_path):
+    store = DeadLetterStore(str(tmp_path / "dead.sqlite"))
+    for stage in ("extract", "photometry", "source", "photometry"):
+        store.add(stage, "topic", data=_alert())
+    assert store.last_id() == 4
+    assert [e["id"] for e in store.entries(stages=["photometry"])] == [2, 4]
+    assert [e["id"] for e in store.entries(after_id=1, until_id=3)] == [2, 3]
+    assert [e["id"] for e in store.entries(count=1)] == [1]
+
+
+@pytest.fixture
+def stub():
+    with SkyPortalStub(user_name=NAME) as stub:
+        yield stub
+    skyportal_api.close_sessions()
+    skyportal_api.invalidate_instrument_id()
+    skyportal_api.invalidate_classification()
+
+
+def test_redrive_posts_the_dead_letters(stub, tmp_path):
+    path = str(tmp_path / "dead.sqlite")
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(
+        yaml.dump(
+            {
+                "skyportal_url": stub.url,
+                "skyportal_token": TOKEN,
+                "skyportal_group": "Fink",
+                "skyportal_name": NAME,
+                "whitelisted": True,
+                "dead_letter_path": path,
+            }
+        )
+    )
+    group_id, stream_id = skyportal_fink_client.init_skyportal(
+        stub.url, TOKEN, "Fink", NAME, True, log=None, survey="ztf"
+    )[:2]
+    instrument_id = next(iter(stub.state.instruments))
+
+    store = DeadLetterStore(path)
+    store.add("photometry", "fink_sn_candidates_ztf", status=400, data=_alert("ZTF1"))
+    store.add(
+        "photometry",
+        status=400,
+        data={
+            "point": {
+                "object_id": "ZTF1",
+                "mjd": 60001.0,
+                "filter": "ztfr",
+                "mag": 18.5,
+                "magerr": 0.1,
+                "limiting_mag": 20.0,
+                "magsys": "ab",
+                "ra": 10.0,
+                "dec": 20.0,
+            },
+            "key": [instrument_id, group_id, stream_id, False],
+        },
+    )
+    # still not a valid alert: kept for the next run
+    store.add("extract", "fink_sn_candidates_ztf", alert={"objectId": "ZTF2"})
+    # only the offset is known: skipped, and kept
+    store.add(
+        "decode", "fink_sn_candidates_ztf", token=("fink_sn_candidates_ztf", 0, 7)
+    )
+    store.close()
+
+    logs = []
+    posted, failed = skyportal_fink_client.redrive_dead_letters(
+        config_path=str(config_path), log=logs.append
+    )
+    assert (posted, failed) == (2, 1)
+    assert "ZTF1" in stub.state.sources
+    assert stub.counts["PUT /api/photometry"] == 1
+    assert any("Skipping 1 messages that could not be decoded" in line for line in logs)
+    extract, decode = DeadLetterStore(path).entries()
+    assert (extract["stage"], extract["attempts"]) == ("extract", 2)
+    assert (decode["stage"], decode["attempts"], decode["offset"]) == ("decode", 1, 7)
+    assert DeadLetterStore(path).entries(redrivable=True) == [extract]
+
+
+def test_redrive_needs_a_dead_letter_path(tmp_path):
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.dump({"skyportal_url": "http://localhost"}))
+    with pytest.raises(ValueError, match="dead_letter_path"):
+        skyportal_fink_client.redrive_dead_letters(config_path=str(config_path))
+
+
+def test_redrive_reads_the_stores_of_the_workers(stub, tmp_path):
+    path = str(tmp_path / "dead.sqlite")
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(
+        yaml.dump(
+            {
+                "skyportal_url": stub.url,
+                "skyportal_token": TOKEN,
+                "skyportal_group": "Fink",
+                "skyportal_name": NAME,
+                "whitelisted": True,
+                "dead_letter_path": path,
+            }
+        )
+    )
+    for index in (0, 1):
+        store = DeadLetterStore(skyportal_fink_client._worker_path(path, index))
+        store.add("post", "fink_sn_candidates_ztf", data=_alert(f"ZTF{index}"))
+        store.close()
+    (tmp_path / "dead.backup.sqlite").write_text("not a worker store")
+
+    assert skyportal_fink_client._worker_paths(path) == [
+        str(tmp_path / "dead.0.sqlite"),
+        str(tmp_path / "dead.1.sqlite"),
+    ]
+    posted, failed = skyportal_fink_client.redrive_dead_letters(
+        config_path=str(config_path), log=lambda message: None
+    )
+    assert (posted, failed) == (2, 0)
+    assert {"ZTF0", "ZTF1"} <= set(stub.state.sources)
+
+
+def test_worker_path():
+    assert skyportal_fink_client._worker_path("spool.sqlite", None) == "spool.sqlite"
+    assert skyportal_fink_client._worker_path("a/spool.sqlite", 3) == "a/spool.3.sqlite"
+    assert skyportal_fink_client._worker_path(None, 3) is None
@@ -0,0 +1,169 @@
+# coding: utf-8
+import glob
+import io
+import json
+import os
+import time
+
+import fastavro
+import pytest
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+from skyportal_fink_client.utils.decode_pool import DecodePool
+from skyportal_fink_client.utils.delivery import OffsetTracker
+from skyportal_fink_client.utils.records import AlertRecord
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample.avro")
+TOPIC = "fink_sn_candidates_ztf"
+
+
+def _extract(survey, topics, alerts):
+    # the first chunk is the slowest, so the chunks finish out of order
+    if alerts[0]["objectId"] == "ZTF18aaxypzn":
+        time.sleep(0.2)
+    return [
+        None
+        if alert["objectId"] == "ZTF19aawfxge"
+        else AlertRecord(alert["objectId"], *[None] * 9, topic, False)
+        for topic, alert in zip(topics, alerts)
+    ]
+
+
+class _Message:
+    def __init__(self, offset, key, value, partition=0):
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._partition = partition
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return TOPIC
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def timestamp(self):
+        # TIMESTAMP_CREATE_TIME, in milliseconds
+        return 1, 1_700_000_000_000 + self._offset
+
+
+class _KafkaConsumer:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.commits = []
+
+    def consume(self, num_alerts, timeout):
+        messages, self.messages = (
+            self.messages[:num_alerts],
+            self.messages[num_alerts:],
+        )
+        return messages
+
+    def commit(self, offsets, asynchronous=True):
+        self.commits.extend((tp.partition, tp.offset) for tp in offsets)
+
+
+class _Consumer:
+    def __init__(self, messages):
+        self._consumer = _KafkaConsumer(messages)
+
+    def consume_messages(self, num_alerts, timeout):
+        return self._consumer.consume(num_alerts, timeout)
+
+    def commit(self, offsets, asynchronous=True):
+        self._consumer.commit(offsets, asynchronous)
+
+
+@pytest.fixture(scope="module")
+def messages():
+    """The sample alerts as Kafka messages, with their schema as key."""
+    messages = []
+    for offset, path in enumerate(sorted(glob.glob(os.path.join(SAMPLE, "*.avro")))):
+        with open(path, "rb") as file:
+            reader = fastavro.reader(file)
+            schema = reader.metadata["avro.schema"]
+            alert = next(reader)
+        value = io.BytesIO()
+        fastavro.schemaless_writer(
+            value, fastavro.parse_schema(json.loads(schema)), alert
+        )
+        messages.append(_Message(offset, schema.encode(), value.getvalue()))
+    return messages
+
+
+@pytest.fixture
+def pool():
+    pool = DecodePool(_extract, "ztf", 2, fields=["objectId"])
+    yield pool
+    pool.close()
+
+
+def test_results_keep_the_order_of_the_messages(pool, messages):
+    broken = _Message(len(messages), None, b"not avro")
+    pool.submit(messages[:2], tokens=["a", "b"])
+    pool.submit(messages[2:] + [broken])
+    assert len(pool) == 4
+    results = []
+    while len(pool):
+        results.extend(pool.results(wait=True))
+    assert [token for *_, token in results[:2]] == ["a", "b"]
+    assert [data and data[::10] for _, _, data, _, _ in results] == [
+        ("ZTF18aaxypzn", TOPIC),
+        ("ZTF18abadigg", TOPIC),
+        ("ZTF18abtrvkm", TOPIC),
+        ("ZTF18acmwkqr", TOPIC),
+        None,
+        None,
+    ]
+    # the alert that could not be extracted comes back, projected
+    assert results[4][1:4:2] == (True, {"objectId": "ZTF19aawfxge"})
+    # the message that could not be decoded
+    assert results[5][1:4] == (False, None, None)
+
+
+def test_pooled_offsets_are_committed_in_order(pool, messages):
+    consumer = _Consumer(messages)
+    tracker = OffsetTracker()
+    unparsed = []
+    alerts_data = []
+    while consumer._consumer.messages or len(pool):
+        alerts_data += skyportal_fink_client._poll_pooled_alerts(
+            consumer,
+            pool,
+            2,
+            1,
+            tracker,
+            1,
+            lambda message: None,
+            on_unparsed=lambda *args: unparsed.append(args),
+        )
+    assert [data.object_id for _, data, _ in alerts_data] == [
+        "ZTF18aaxypzn",
+        "ZTF18abadigg",
+        "ZTF18abtrvkm",
+        "ZTF18acmwkqr",
+    ]
+    # the Kafka timestamps of the messages come along
+    assert [data.timestamp for _, data, _ in alerts_data] == [
+        1_700_000_000 + offset / 1000 for offset in range(4)
+    ]
+    assert [token for *_, token in unparsed] == [(TOPIC, 0, 4)]
+    # nothing is committed before the alerts are acknowledged
+    tracker.commit(consumer)
+    assert consumer._consumer.commits == []
+    for _, _, token in alerts_data:
+        tracker.ack(token)
+    tracker.commit(consumer)
+    assert consumer._consumer.commits == [(0, 5)]
@@ -0,0 +1,144 @@
+# coding: utf-8
+import glob
+import io
+import json
+import os
+
+import fastavro
+import pytest
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+from skyportal_fink_client.utils.decoding import (
+    ProjectedDecoder,
+    ProjectedDecodingMixin,
+    project_schema,
+    read_avro_file,
+)
+from skyportal_fink_client.utils.replay import read_alerts
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample.avro")
+ZTF_FIELDS = skyportal_fink_client._PROJECTED_FIELDS["ztf"]
+
+
+@pytest.fixture(scope="module")
+def sample():
+    """Schema, first alert and its Avro encoding, as sent by Fink."""
+    path = sorted(glob.glob(os.path.join(SAMPLE, "*.avro")))[0]
+    with open(path, "rb") as file:
+        reader = fastavro.reader(file)
+        schema = json.loads(reader.metadata["avro.schema"])
+        alert = next(reader)
+    value = io.BytesIO()
+    fastavro.schemaless_writer(value, fastavro.parse_schema(schema), alert)
+    return schema, alert, value.getvalue()
+
+
+class FakeMessage:
+    def __init__(self, value, key=None, topic="fink_sn_candidates_ztf"):
+        self._value = value
+        self._key = key
+        self._topic = topic
+
+    def error(self):
+        return None
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def topic(self):
+        return self._topic
+
+
+class FullDecoder:
+    def process_message(self, msg):
+        return msg.topic(), "full", None
+
+
+class Consumer(ProjectedDecodingMixin, FullDecoder):
+    def __init__(self, decoder):
+        self.decoder = decoder
+
+
+def test_projection_keeps_only_the_read_fields(sample):
+    schema, alert, value = sample
+    consumer = Consumer(ProjectedDecoder(ZTF_FIELDS))
+    message = FakeMessage(value, key=json.dumps(schema).encode())
+    topic, decoded, _ = consumer.process_message(message)
+    assert topic == "fink_sn_candidates_ztf"
+    assert set(decoded) == {field for field in ZTF_FIELDS if field in alert}
+    for field in decoded:
+        assert decoded[field] == alert[field]
+    assert "prv_candidates" not in decoded
+    assert "cutoutScience" not in decoded
+
+
+def test_extraction_only_needs_the_projected_fields(sample):
+    pytest.importorskip("fink_filters")
+    schema, alert, value = sample
+    decoder = ProjectedDecoder(ZTF_FIELDS)
+    decoded = decoder.decode(decoder.schemas(json.dumps(schema).encode()), value)
+    topic = "fink_sn_candidates_ztf"
+    full = skyportal_fink_client.extract_alerts_data("ztf", [topic], [alert])
+    projected = skyportal_fink_client.extract_alerts_data("ztf", [topic], [decoded])
+    assert projected == full
+
+
+def test_messages_without_a_schema_are_decoded_in_full(sample):
+    _, _, value = sample
+    consumer = Consumer(ProjectedDecoder(ZTF_FIELDS))
+    assert consumer.process_message(FakeMessage(value))[1] == "full"
+    assert consumer.process_message(FakeMessage(value, key=b"ZTF21"))[1] == "full"
+
+
+def test_a_bad_message_does_not_discard_the_batch(sample):
+    schema, alert, value = sample
+    key = json.dumps(schema).encode()
+    consumer = Consumer(ProjectedDecoder(ZTF_FIELDS))
+    messages = [FakeMessage(value, key), FakeMessage(b"not avro", key)]
+    messages.append(FakeMessage(value, key))
+
+    class _KafkaConsumer:
+        def consume(self, num_alerts, timeout):
+            return messages[:num_alerts]
+
+    consumer._consumer = _KafkaConsumer()
+    polled = consumer.poll_messages(3, 1)
+    assert [message for _, _, message in polled] == messages
+    assert [alert is None for _, alert, _ in polled] == [False, True, False]
+    assert polled[0][1]["objectId"] == alert["objectId"]
+
+
+def test_schemas_are_parsed_once_per_key(sample, monkeypatch):
+    schema, _, value = sample
+    decoder = ProjectedDecoder(ZTF_FIELDS, max_schemas=1)
+    key = json.dumps(schema).encode()
+    parsed = []
+    parse_schema = fastavro.parse_schema
+    monkeypatch.setattr(
+        fastavro, "parse_schema", lambda s: parsed.append(s) or parse_schema(s)
+    )
+    first = decoder.schemas(key)
+    assert decoder.schemas(key) is first
+    assert len(parsed) == 2  # writer and reader schemas
+    decoder.schemas(b"not a schema")
+    assert decoder.schemas(key) is not first
+
+
+def test_projection_of_missing_fields_is_ignored(sample):
+    schema, _, _ = sample
+    reader = project_schema(schema, ["objectId", "noSuchField"])
+    assert [field["name"] for field in reader["fields"]] == ["objectId"]
+
+
+def test_avro_files_are_read_projected():
+    (alerts,) = read_alerts(SAMPLE)
+    (projected,) = read_alerts(SAMPLE, fields=["objectId", "candidate"])
+    assert [set(alert) for alert in projected] == [{"objectId", "candidate"}] * 5
+    assert [alert["candidate"] for alert in projected] == [
+        alert["candidate"] for alert in alerts
+    ]
+    path = sorted(glob.glob(os.path.join(SAMPLE, "*.avro")))[0]
+    assert read_avro_file(path, ["objectId"]) == [{"objectId": alerts[0]["objectId"]}]
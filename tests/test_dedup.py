@@ -0,0 +1,170 @@
+# coding: utf-8
+import yaml
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils import dedup
+from skyportal_fink_client.utils.dedup import AlertDeduplicator
+from skyportal_fink_client.utils.records import AlertRecord
+
+SN = "fink_sn_candidates_ztf"
+EARLY_SN = "fink_early_sn_candidates_ztf"
+KN = "fink_kn_candidates_ztf"
+
+
+def _record(object_id, alert_id, classification="SN candidate"):
+    return AlertRecord(
+        object_id,
+        60000.0,
+        ["CFH12k", "ZTF"],
+        "ztfg",
+        18.0,
+        0.1,
+        20.0,
+        "ab",
+        10.0,
+        20.0,
+        classification,
+        False,
+        alert_id,
+    )
+
+
+def _deduplicator(**kwargs):
+    return AlertDeduplicator(
+        skyportal_fink_client._topic_ranker([SN, EARLY_SN, KN]), **kwargs
+    )
+
+
+def test_copies_of_a_poll_are_merged():
+    deduplicator = _deduplicator()
+    dropped = []
+    alerts_data = [
+        (SN, _record("ZTF1", 1), "a"),
+        (SN, _record("ZTF2", 2), "b"),
+        (EARLY_SN, _record("ZTF1", 1), "c"),
+        (KN, _record("ZTF2", 2, "Kilonova candidate"), "d"),
+        (SN, _record("ZTF2", 3), "e"),
+    ]
+    kept = deduplicator.dedup(alerts_data, lambda *copy: dropped.append(copy))
+    # the kilonova copy takes the place of the first one
+    assert kept == [alerts_data[0], alerts_data[3], alerts_data[4]]
+    assert [token for _, _, token in dropped] == ["c", "b"]
+    assert deduplicator.dropped == 2
+
+
+def test_later_copies_are_dropped_within_the_window(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(dedup.time, "monotonic", lambda: now[0])
+    deduplicator = _deduplicator(window=60)
+    reclassified = []
+    assert deduplicator.dedup([(SN, _record("ZTF1", 1), None)])
+    now[0] = 10
+    assert deduplicator.dedup([(EARLY_SN, _record("ZTF1", 1), None)]) == []
+    # a better classification only updates the classification
+    kn = (KN, _record("ZTF1", 1, "Kilonova candidate"), None)
+    assert (
+        deduplicator.dedup(
+            [kn], on_reclassified=lambda topic, *_: reclassified.append(topic)
+        )
+        == []
+    )
+    assert reclassified == [KN]
+    assert (
+        deduplicator.dedup(
+            [kn], on_reclassified=lambda topic, *_: reclassified.append(topic)
+        )
+        == []
+    )
+    assert deduplicator.dedup([(EARLY_SN, _record("ZTF1", 1), None)]) == []
+    assert reclassified == [KN]
+    assert deduplicator.dropped == 3
+    # forgotten once the window is over
+    now[0] = 61
+    assert len(deduplicator.dedup([(SN, _record("ZTF1", 1), None)])) == 1
+
+
+def test_records_without_alert_id_are_kept():
+    deduplicator = _deduplicator(max_alerts=1)
+    alerts_data = [(SN, _record("ZTF1", None), None)] * 2
+    assert deduplicator.dedup(alerts_data) == alerts_data
+    deduplicator.dedup([(SN, _record("ZTF1", 1), None), (SN, _record("ZTF2", 2), None)])
+    assert len(deduplicator) == 1
+
+
+def _post(stub, tmp_path, monkeypatch, chunks):
+    """Post the (topic, data) chunks through poll_alerts, as a replay."""
+    monkeypatch.setattr(
+        skyportal_fink_client, "replay_alerts", lambda *args, **kwargs: iter(chunks)
+    )
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(
+        yaml.safe_dump(
+            {
+                "fink_topics": [SN, EARLY_SN, KN],
+                "fink_username": "user",
+                "fink_password": None,
+                "fink_group_id": "group",
+                "fink_servers": "localhost:9093",
+                "survey": "ztf",
+                "skyportal_url": stub.url,
+                "skyportal_token": "abc123",
+                "skyportal_group": "Fink",
+                "skyportal_name": "provisioned-admin",
+                "testing": False,
+                "whitelisted": True,
+                "fink_dedup_window": 600,
+            }
+        )
+    )
+    try:
+        skyportal_fink_client.poll_alerts(
+            config_path=str(config_path),
+            log=lambda message: None,
+            replay_path="alerts.avro",
+        )
+    finally:
+        skyportal_api.invalidate_instrument_id()
+        skyportal_api.invalidate_classification()
+
+
+def test_copies_from_two_topics_are_written_once(tmp_path, monkeypatch):
+    with SkyPortalStub() as stub:
+        _post(
+            stub,
+            tmp_path,
+            monkeypatch,
+            [
+                [
+                    (SN, _record("ZTF1", 1)),
+                    (KN, _record("ZTF1", 1, "Kilonova candidate")),
+                ],
+                [(EARLY_SN, _record("ZTF1", 1))],
+            ],
+        )
+        assert stub.counts["POST /api/sources"] == 1
+        assert stub.counts["POST /api/candidates"] == 1
+        assert stub.counts["PUT /api/photometry"] == 1
+        assert stub.counts["POST /api/classification"] == 1
+        assert stub.counts["PUT /api/classification/{id}"] == 0
+        (classification,) = stub.state.classifications.values()
+        assert classification["classification"] == "Kilonova candidate"
+
+
+def test_later_kilonova_copy_only_updates_the_classification(tmp_path, monkeypatch):
+    with SkyPortalStub() as stub:
+        _post(
+            stub,
+            tmp_path,
+            monkeypatch,
+            [
+                [(SN, _record("ZTF1", 1))],
+                [(KN, _record("ZTF1", 1, "Kilonova candidate"))],
+            ],
+        )
+        assert stub.counts["POST /api/sources"] == 1
+        assert stub.counts["PUT /api/photometry"] == 1
+        assert stub.counts["PUT /api/classification/{id}"] == 1
+        (classification,) = stub.state.classifications.values()
+        assert classification["classification"] == "Kilonova candidate"
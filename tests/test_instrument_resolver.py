@@ -0,0 +1,75 @@
+# coding: utf-8
+import pytest
+
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+
+URL = "http://localhost:5000"
+TOKEN = "abc123"
+ZTF = ["CFH12k", "ZTF"]
+
+
+@pytest.fixture
+def instruments(monkeypatch):
+    calls = []
+    table = {"ZTF": 1, "LSSTCam": 2}
+
+    def get_all_instruments(url, token):
+        calls.append(url)
+        return 200, dict(table)
+
+    monkeypatch.setattr(skyportal_api, "_instrument_ids", {})
+    monkeypatch.setattr(skyportal_api, "get_all_instruments", get_all_instruments)
+    return calls, table
+
+
+def test_resolved_id_is_cached(instruments):
+    calls, _ = instruments
+    assert skyportal_api.resolve_instrument_id(ZTF, URL, TOKEN) == (200, 1)
+    assert skyportal_api.resolve_instrument_id(ZTF, URL, TOKEN) == (200, 1)
+    assert len(calls) == 1
+
+
+def test_cache_is_keyed_by_instrument_names(instruments):
+    calls, _ = instruments
+    skyportal_api.resolve_instrument_id(ZTF, URL, TOKEN)
+    assert skyportal_api.resolve_instrument_id(["LSSTCam", "LSST"], URL, TOKEN) == (
+        200,
+        2,
+    )
+    assert len(calls) == 2
+
+
+def test_expired_entry_is_refetched(instruments):
+    calls, _ = instruments
+    skyportal_api.resolve_instrument_id(ZTF, URL, TOKEN, ttl=0)
+    skyportal_api.resolve_instrument_id(ZTF, URL, TOKEN)
+    assert len(calls) == 2
+
+
+def test_unknown_instrument_is_not_cached(instruments):
+    calls, table = instruments
+    assert skyportal_api.resolve_instrument_id(["DECam"], URL, TOKEN)[1] is None
+    table["DECam"] = 3
+    assert skyportal_api.resolve_instrument_id(["DECam"], URL, TOKEN)[1] == 3
+    assert len(calls) == 2
+
+
+def test_invalidate_forces_lookup(instruments):
+    calls, table = instruments
+    skyportal_api.resolve_instrument_id(ZTF, URL, TOKEN)
+    table["ZTF"] = 7
+    skyportal_api.invalidate_instrument_id(ZTF, url=URL)
+    assert skyportal_api.resolve_instrument_id(ZTF, URL, TOKEN)[1] == 7
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize(
+    "status, body, expected",
+    [
+        (400, '{"message": "Invalid instrument ID: 3"}', True),
+        (400, '{"message": "Invalid filter"}', False),
+        (500, "instrument", False),
+    ],
+)
+def test_unknown_instrument_error(status, body, expected):
+    assert skyportal_api._is_unknown_instrument_error(status, body) is expected
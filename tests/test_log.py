@@ -0,0 +1,136 @@
+import os
+import threading
+
+import pytest
+
+from skyportal_fink_client.utils import log as log_module
+from skyportal_fink_client.utils.log import LogWriter, log_debug, make_log
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = LogWriter(directory=str(tmp_path), console=False)
+    yield writer
+    writer.close()
+
+
+def _lines(path):
+    with open(path) as f:
+        return [line.rstrip("\n").split(" ", 2)[2] for line in f]
+
+
+def test_messages_are_written_once_in_order(writer, tmp_path):
+    for i in range(100):
+        writer.write("app", f"message {i}")
+    writer.flush()
+    assert _lines(tmp_path / "app.log") == [f"message {i}" for i in range(100)]
+
+
+def test_file_stays_open_between_batches(writer, tmp_path):
+    writer.write("app", "first")
+    writer.flush()
+    handle = writer._files["app"][0]
+    writer.write("app", "second")
+    writer.flush()
+    assert writer._files["app"][0] is handle
+    assert _lines(tmp_path / "app.log") == ["first", "second"]
+
+
+def test_size_rotation_keeps_backup_count(tmp_path):
+    writer = LogWriter(
+        directory=str(tmp_path), max_bytes=100, backup_count=2, console=False
+    )
+    try:
+        for i in range(20):
+            writer.write("app", f"message {i:02d}")
+            # a new batch per message so each one can trigger a rotation
+            writer.flush()
+    finally:
+        writer.close()
+    assert sorted(os.listdir(tmp_path)) == ["app.log", "app.log.1", "app.log.2"]
+    assert os.path.getsize(tmp_path / "app.log.1") >= 100
+    assert _lines(tmp_path / "app.log")[-1] == "message 19"
+
+
+def test_time_rotation(tmp_path):
+    writer = LogWriter(directory=str(tmp_path), rotate_interval=60, console=False)
+    try:
+        writer.write("app", "old", timestamp=1000.0)
+        writer.flush()
+        writer.write("app", "new", timestamp=1061.0)
+        writer.flush()
+    finally:
+        writer.close()
+    assert _lines(tmp_path / "app.log.1") == ["old"]
+    assert _lines(tmp_path / "app.log") == ["new"]
+
+
+def test_configure_changes_directory(writer, tmp_path):
+    writer.write("app", "before")
+    writer.configure(directory=str(tmp_path / "other"))
+    writer.write("app", "after")
+    writer.flush()
+    assert _lines(tmp_path / "app.log") == ["before"]
+    assert _lines(tmp_path / "other" / "app.log") == ["after"]
+
+
+def test_level_filter(writer, monkeypatch):
+    monkeypatch.setattr(log_module, "_writer", writer)
+    monkeypatch.setattr(log_module, "_level", log_module._level)
+    app_log = make_log("app")
+
+    log_module.configure_logging(level="info")
+    log_debug(app_log, "per alert")
+    app_log("kept")
+    app_log("also kept", level="warning")
+    writer.flush()
+    assert _lines(os.path.join(writer.directory, "app.log")) == ["kept", "also kept"]
+
+    log_module.configure_logging(level="debug")
+    log_debug(app_log, "per alert")
+    writer.flush()
+    assert _lines(os.path.join(writer.directory, "app.log"))[-1] == "per alert"
+
+
+def test_log_debug_with_plain_callable():
+    messages = []
+    log_debug(messages.append, "hello")
+    log_debug(messages.append, "alert %s from %s", "ZTF1", "topic")
+    assert messages == ["hello", "alert ZTF1 from topic"]
+
+
+def test_log_debug_does_not_format_dropped_messages(writer, monkeypatch):
+    monkeypatch.setattr(log_module, "_writer", writer)
+    monkeypatch.setattr(log_module, "_level", log_module.LEVELS["info"])
+
+    class Unformattable:
+        def __str__(self):
+            raise AssertionError("formatted")
+
+    log_debug(make_log("app"), "alert %s", Unformattable())
+
+
+def test_full_queue_drops_and_counts_messages(tmp_path):
+    writer = LogWriter(directory=str(tmp_path), console=False, max_queue=3)
+    writer.write("app", "first")
+    # hold the writer thread so that the queue fills up
+    busy, resume = threading.Event(), threading.Event()
+    writer._queue.put((lambda: busy.set() or resume.wait(), (), threading.Event()))
+    busy.wait()
+    for i in range(5):
+        writer.write("app", f"message {i}")
+    assert writer.dropped == 2
+    resume.set()
+    writer.close()
+    assert _lines(tmp_path / "app.log") == [
+        "first",
+        "message 0",
+        "message 1",
+        "message 2",
+        "Warning: 2 log messages were dropped, the log queue was full",
+    ]
+
+
+def test_invalid_level():
+    with pytest.raises(ValueError):
+        log_module.configure_logging(level="verbose")
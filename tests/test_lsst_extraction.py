@@ -6,6 +6,7 @@ from skyportal_fink_client.skyportal_fink_client import _extract_lsst_data
 TOPIC = "fink_extragalactic_new_candidate_lsst"
 
 VALID_DIA_SOURCE = {
+    "diaSourceId": 987654,
     "midpointMjdTai": 60000.0,
     "band": "r",
     "psfFlux": 1000.0,
@@ -33,7 +34,10 @@ def _alert(**overrides):
 def test_valid_alert_returns_data():
     result = _extract_lsst_data(TOPIC, _alert())
     assert result is not None
-    assert len(result) == 12
+    assert len(result) == 14
+    assert result.alert_id == 987654
+    # filled in from the Kafka message once extracted
+    assert result.timestamp is None
 
 
 def test_object_id_is_string_of_int64():
@@ -0,0 +1,201 @@
+# coding: utf-8
+import time
+import urllib.request
+
+import pytest
+import yaml
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils import metrics
+from skyportal_fink_client.utils.delivery import OffsetTracker
+from skyportal_fink_client.utils.records import AlertRecord
+
+TOKEN = "abc123"
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_counter_renders_one_line_per_label_values():
+    counter = metrics.Counter("test_total", "Test", ("topic", "state"))
+    counter.inc("a", "polled")
+    counter.inc("a", "polled", value=2)
+    counter.inc('b"', "posted")
+    assert counter.value("a", "polled") == 3
+    assert counter.render() == [
+        'test_total{topic="a",state="polled"} 3',
+        'test_total{topic="b\\"",state="posted"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test", ("endpoint",), (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, "/api/photometry")
+    assert histogram.render() == [
+        'test_seconds_bucket{endpoint="/api/photometry",le="0.1"} 2',
+        'test_seconds_bucket{endpoint="/api/photometry",le="1"} 3',
+        'test_seconds_bucket{endpoint="/api/photometry",le="+Inf"} 4',
+        'test_seconds_sum{endpoint="/api/photometry"} 5.65',
+        'test_seconds_count{endpoint="/api/photometry"} 4',
+    ]
+
+
+def test_endpoint_label_drops_ids():
+    assert (
+        metrics.endpoint_label("http://host/api/sources/ZTF21abc/classifications")
+        == "/api/sources/{id}/classifications"
+    )
+    assert metrics.endpoint_label("http://host/api/photometry") == "/api/photometry"
+    assert (
+        metrics.endpoint_label("http://host/api/groups/3/streams?x=1")
+        == "/api/groups/{id}/streams"
+    )
+
+
+def test_gauge_is_read_when_rendered():
+    values = [1]
+    gauge = metrics.Gauge("test_gauge", "Test", lambda: values[-1])
+    values.append(7)
+    assert gauge.render() == ["test_gauge 7"]
+
+
+def test_skyportal_requests_are_counted():
+    with SkyPortalStub(rate_limit_rate=1.0, retry_after=0) as stub:
+        skyportal_api.api("GET", f"{stub.url}/api/groups", token=TOKEN)
+    skyportal_api.close_sessions()
+    attempts = skyportal_api.MAX_ATTEMPTS
+    assert metrics.SKYPORTAL_REQUESTS.value("GET", "/api/groups", 429) == attempts
+    assert metrics.SKYPORTAL_RATE_LIMITED.value("/api/groups") == attempts
+    assert metrics.SKYPORTAL_REQUEST_DURATION.count("GET", "/api/groups") == attempts
+    assert metrics.SKYPORTAL_RETRY_SLEEP.value() == 0
+
+
+class _Message:
+    def __init__(self, offset, timestamp):
+        self._offset = offset
+        self._timestamp = timestamp
+
+    def topic(self):
+        return "fink_sn_candidates_ztf"
+
+    def partition(self):
+        return 0
+
+    def offset(self):
+        return self._offset
+
+    def timestamp(self):
+        return 1, self._timestamp
+
+
+def test_alert_latency_is_recorded_once_all_parts_are_in():
+    tracker = OffsetTracker()
+    token = tracker.track(_Message(0, 1000), parts=2)
+    tracker.ack(token)
+    assert metrics.ALERT_LATENCY.count() == 0
+    tracker.ack(token)
+    assert metrics.ALERT_LATENCY.count() == 1
+    failed = tracker.track(_Message(1, 1000))
+    tracker.ack(failed, ok=False)
+    assert metrics.ALERT_LATENCY.count() == 1
+    assert "fink_alert_latency_seconds_count 1" in metrics.render()
+
+
+@pytest.mark.parametrize("photometry_batch_size", [0, 10])
+def test_alert_latency_is_recorded_without_at_least_once(
+    tmp_path, monkeypatch, photometry_batch_size
+):
+    consumer = type("Consumer", (), {"close": lambda self: None})()
+    monkeypatch.setattr(
+        skyportal_fink_client, "init_consumer", lambda **kwargs: consumer
+    )
+    sent = time.time() - 5
+    records = [
+        AlertRecord(
+            object_id,
+            60000.0,
+            ["CFH12k", "ZTF"],
+            "ztfg",
+            18.0,
+            0.1,
+            20.0,
+            "ab",
+            10.0,
+            20.0,
+            "SN candidate",
+            False,
+            timestamp=sent,
+        )
+        for object_id in ("ZTF1", "ZTF2")
+    ]
+    polls = iter([records])
+
+    def poll(*args):
+        records = next(polls, None)
+        if records is None:
+            raise KeyboardInterrupt
+        return [("fink_sn_candidates_ztf", data) for data in records]
+
+    monkeypatch.setattr(skyportal_fink_client, "poll_alerts_batch", poll)
+    with SkyPortalStub() as stub:
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(
+            yaml.safe_dump(
+                {
+                    "fink_topics": ["fink_sn_candidates_ztf"],
+                    "fink_username": "user",
+                    "fink_password": None,
+                    "fink_group_id": "group",
+                    "fink_servers": "localhost:9093",
+                    "fink_batch_size": 10,
+                    "photometry_batch_size": photometry_batch_size,
+                    "survey": "ztf",
+                    "skyportal_url": stub.url,
+                    "skyportal_token": TOKEN,
+                    "skyportal_group": "Fink",
+                    "skyportal_name": "provisioned-admin",
+                    "testing": False,
+                    "whitelisted": True,
+                }
+            )
+        )
+        try:
+            skyportal_fink_client.poll_alerts(
+                config_path=str(config_path), log=lambda message: None
+            )
+        finally:
+            skyportal_api.invalidate_instrument_id()
+            skyportal_api.invalidate_classification()
+    assert metrics.ALERT_LATENCY.count() == 2
+    assert 'fink_alert_latency_seconds_bucket{le="2"} 0' in metrics.render()
+
+
+def test_metrics_server_listens_on_loopback_by_default():
+    server = metrics.start_metrics_server(0)
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_metrics_server_serves_the_registry():
+    metrics.ALERTS.inc("fink_sn_candidates_ztf", "polled")
+    server = metrics.start_metrics_server(0, "127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert "# TYPE fink_alerts_total counter" in text
+    assert 'fink_alerts_total{topic="fink_sn_candidates_ztf",state="polled"} 1' in text
+    assert "# TYPE skyportal_request_duration_seconds histogram" in text
@@ -0,0 +1,127 @@
+# coding: utf-8
+import pytest
+
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils.registry import ObjectRegistry
+
+
+def test_sources_are_known_per_group():
+    registry = ObjectRegistry()
+    assert not registry.has_source("ZTF1", 1)
+    registry.add_source("ZTF1", 1)
+    assert registry.has_source("ZTF1", 1)
+    assert not registry.has_source("ZTF1", 2)
+    assert len(registry) == 1
+
+
+def test_candidate_is_due_again_after_the_interval():
+    registry = ObjectRegistry(candidate_interval=1.0)
+    assert registry.candidate_due("ZTF1", 1, 60000.0)
+    registry.add_candidate("ZTF1", 1, 60000.0)
+    assert not registry.candidate_due("ZTF1", 1, 60000.5)
+    assert registry.candidate_due("ZTF1", 1, 60001.0)
+    assert registry.candidate_due("ZTF1", 2, 60000.5)
+
+
+def test_forget_drops_the_object():
+    registry = ObjectRegistry()
+    registry.add_source("ZTF1", 1)
+    registry.add_candidate("ZTF1", 1, 60000.0)
+    registry.forget("ZTF1")
+    assert not registry.has_source("ZTF1", 1)
+    assert registry.candidate_due("ZTF1", 1, 60000.0)
+
+
+def test_registry_survives_a_restart(tmp_path):
+    path = str(tmp_path / "registry.sqlite")
+    registry = ObjectRegistry(path)
+    registry.add_source("ZTF1", 1)
+    registry.add_candidate("ZTF1", 1, 60000.0)
+    registry.add_source("ZTF2", 1)
+    registry.forget("ZTF2")
+    registry.close()
+
+    registry = ObjectRegistry(path)
+    assert registry.has_source("ZTF1", 1)
+    assert not registry.has_source("ZTF2", 1)
+    assert not registry.candidate_due("ZTF1", 1, 60000.5)
+    registry.close()
+
+
+def test_entries_are_written_by_groups(tmp_path):
+    path = str(tmp_path / "registry.sqlite")
+    registry = ObjectRegistry(path, sync_every=3)
+    registry.add_source("ZTF1", 1)
+    registry.add_source("ZTF2", 1)
+    assert len(ObjectRegistry(path)) == 0
+    registry.add_source("ZTF3", 1)
+    assert len(ObjectRegistry(path)) == 3
+    registry.close()
+
+
+@pytest.fixture
+def skyportal(monkeypatch):
+    calls = []
+
+    def record(name, result):
+        def call(*args, **kwargs):
+            calls.append(name)
+            return result
+
+        return call
+
+    monkeypatch.setattr(
+        skyportal_api, "resolve_instrument_id", record("instrument", (200, 1))
+    )
+    monkeypatch.setattr(skyportal_api, "post_source", record("source", (200, 1)))
+    monkeypatch.setattr(skyportal_api, "post_candidate", record("candidate", (200, 1)))
+    monkeypatch.setattr(
+        skyportal_api, "post_photometry", record("photometry", (200, [1], ""))
+    )
+    return calls
+
+
+def _post(mjd, registry):
+    return skyportal_api.from_fink_to_skyportal(
+        "ZTF1",
+        mjd,
+        ["ZTF"],
+        "ztfg",
+        18.0,
+        0.1,
+        20.0,
+        "ab",
+        10.0,
+        20.0,
+        "SN candidate",
+        probability=None,
+        group_id=1,
+        filter_id=2,
+        stream_id=3,
+        taxonomy_id=None,
+        whitelisted=True,
+        url="http://localhost:5000",
+        token="abc123",
+        skyportal_name="fink",
+        log=lambda message: None,
+        object_registry=registry,
+    )
+
+
+def test_repeat_detections_only_post_photometry(skyportal):
+    registry = ObjectRegistry()
+    assert _post(60000.0, registry) == 200
+    assert _post(60000.1, registry) == 200
+    assert skyportal == ["instrument", "source", "candidate", "photometry"] + [
+        "instrument",
+        "photometry",
+    ]
+    _post(60001.5, registry)
+    assert skyportal[-2:] == ["candidate", "photometry"]
+
+
+def test_without_registry_every_alert_is_posted(skyportal):
+    _post(60000.0, None)
+    _post(60000.1, None)
+    assert skyportal.count("source") == 2
+    assert skyportal.count("candidate") == 2
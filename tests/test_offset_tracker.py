@@ -0,0 +1,261 @@
+# coding: utf-8
+import pytest
+import yaml
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils.delivery import OffsetTracker
+from skyportal_fink_client.utils.records import AlertRecord
+
+
+class _Message:
+    def __init__(self, offset, partition=0, topic="fink_sn_candidates_ztf"):
+        self._offset = offset
+        self._partition = partition
+        self._topic = topic
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+
+class _Consumer:
+    def __init__(self):
+        self.commits = []
+
+    def commit(self, offsets, asynchronous=True):
+        if offsets:
+            self.commits.append(
+                sorted((tp.topic, tp.partition, tp.offset) for tp in offsets)
+            )
+
+
+@pytest.fixture
+def consumer():
+    return _Consumer()
+
+
+def test_commits_after_last_contiguous_ingested_offset(consumer):
+    tracker = OffsetTracker()
+    tokens = [tracker.track(_Message(offset)) for offset in range(4)]
+    tracker.ack(tokens[0])
+    tracker.ack(tokens[1])
+    tracker.ack(tokens[3])
+    tracker.commit(consumer)
+    assert consumer.commits == [[("fink_sn_candidates_ztf", 0, 2)]]
+    tracker.ack(tokens[2])
+    tracker.commit(consumer)
+    assert consumer.commits[-1] == [("fink_sn_candidates_ztf", 0, 4)]
+
+
+def test_nothing_to_commit(consumer):
+    tracker = OffsetTracker()
+    tracker.track(_Message(0))
+    assert tracker.commit(consumer) == []
+    assert consumer.commits == []
+
+
+def test_partitions_are_independent(consumer):
+    tracker = OffsetTracker()
+    blocked = tracker.track(_Message(10, partition=0))
+    tracker.ack(tracker.track(_Message(5, partition=1)))
+    tracker.commit(consumer)
+    assert consumer.commits == [[("fink_sn_candidates_ztf", 1, 6)]]
+    tracker.ack(blocked)
+    tracker.commit(consumer)
+    assert consumer.commits[-1] == [("fink_sn_candidates_ztf", 0, 11)]
+
+
+def test_message_needs_all_parts(consumer):
+    tracker = OffsetTracker()
+    token = tracker.track(_Message(0), parts=2)
+    tracker.ack(token)
+    assert tracker.commit(consumer) == []
+    tracker.ack_points([{"tag": token}], [])
+    assert len(tracker.commit(consumer)) == 1
+
+
+def test_failed_message_does_not_hold_the_partition_back(consumer):
+    logs = []
+    tracker = OffsetTracker(log=logs.append)
+    failed = tracker.track(_Message(0))
+    tracker.ack(failed, ok=False)
+    tracker.ack(tracker.track(_Message(1)))
+    tracker.commit(consumer)
+    assert consumer.commits == [[("fink_sn_candidates_ztf", 0, 2)]]
+    assert tracker.commit(consumer) == []
+    assert len(logs) == 1
+
+
+def test_dropped_message_is_done_right_away(consumer):
+    tracker = OffsetTracker()
+    tracker.track(_Message(0), parts=0)
+    assert len(tracker.commit(consumer)) == 1
+
+
+def test_released_message_no_longer_holds_back_the_commit(consumer):
+    tracker = OffsetTracker()
+    spooled = tracker.track(_Message(0), parts=2)
+    tracker.ack(tracker.track(_Message(1)))
+    tracker.ack(spooled, ok=False)
+    tracker.release(spooled)
+    tracker.ack(spooled, ok=False)
+    tracker.commit(consumer)
+    assert consumer.commits == [[("fink_sn_candidates_ztf", 0, 2)]]
+
+
+def test_commit_if_due(consumer):
+    tracker = OffsetTracker(commit_interval=3600, commit_every=2)
+    first = tracker.track(_Message(0))
+    tracker.ack(first)
+    assert tracker.commit_if_due(consumer) == []
+    tracker.ack(tracker.track(_Message(1)))
+    assert len(tracker.commit_if_due(consumer)) == 1
+
+
+def test_revoke_commits_and_forgets_partition(consumer):
+    class _Partition:
+        topic, partition = "fink_sn_candidates_ztf", 0
+
+    tracker = OffsetTracker()
+    tracker.ack(tracker.track(_Message(0)))
+    pending = tracker.track(_Message(1))
+    tracker.revoke(consumer, [_Partition()])
+    assert consumer.commits == [[("fink_sn_candidates_ztf", 0, 1)]]
+    tracker.ack(pending)
+    assert tracker.commit(consumer) == []
+
+
+def test_manual_commit_consumer_disables_auto_commit():
+    from skyportal_fink_client.utils.delivery import ManualCommitConsumer
+
+    consumer = ManualCommitConsumer(
+        ["fink_sn_candidates_ztf"],
+        {"bootstrap.servers": "localhost:1", "group.id": "test"},
+        survey="ztf",
+    )
+    try:
+        assert consumer._kafka_config["enable.auto.commit"] is False
+        # set up by AlertConsumer
+        assert consumer._topics == ["fink_sn_candidates_ztf"]
+        assert consumer.survey == "ztf"
+        assert consumer.dump_schema is False
+    finally:
+        consumer.close()
+
+
+def test_manual_commit_consumer_subscribes_once(monkeypatch):
+    import confluent_kafka
+
+    from skyportal_fink_client.utils.delivery import ManualCommitConsumer
+
+    consumers = []
+
+    class _KafkaConsumer:
+        def __init__(self, config):
+            self.config = config
+            self.subscriptions = []
+            consumers.append(self)
+
+        def subscribe(self, topics, **kwargs):
+            self.subscriptions.append(topics)
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(confluent_kafka, "Consumer", _KafkaConsumer)
+    consumer = ManualCommitConsumer(
+        ["fink_sn_candidates_ztf"],
+        {"bootstrap.servers": "localhost:1", "group.id": "test"},
+        survey="ztf",
+        on_revoke=lambda *args: None,
+    )
+    # only the consumer with auto-commit off joins the group
+    assert [c.subscriptions for c in consumers[:-1]] == [[]] * (len(consumers) - 1)
+    assert consumer._consumer is consumers[-1]
+    assert consumers[-1].config["enable.auto.commit"] is False
+    assert consumers[-1].subscriptions == [["fink_sn_candidates_ztf"]]
+
+
+def test_supported_fink_client_version():
+    import fink_client
+
+    # ManualCommitConsumer relies on AlertConsumer attributes (_consumer,
+    # _kafka_config, _topics): keep in line with requirements.txt
+    major = int(fink_client.__version__.split(".")[0])
+    assert 10 <= major < 13
+
+
+def _record(object_id, instruments=("CFH12k", "ZTF")):
+    return AlertRecord(
+        object_id,
+        60000.0,
+        list(instruments),
+        "ztfg",
+        18.0,
+        0.1,
+        20.0,
+        "ab",
+        10.0,
+        20.0,
+        "SN candidate",
+        False,
+    )
+
+
+def test_rejected_alert_does_not_hold_the_commits_back(tmp_path, monkeypatch):
+    consumer = _Consumer()
+    consumer.close = lambda: None
+    monkeypatch.setattr(
+        skyportal_fink_client, "init_consumer", lambda **kwargs: consumer
+    )
+    # the second alert is rejected (unknown instrument, 404) and not retried
+    records = [_record("ZTF1"), _record("ZTF2", ["Nope"]), _record("ZTF3")]
+    polls = iter([records])
+
+    def poll(consumer, survey, batch_size, timeout, offset_tracker, *args):
+        records = next(polls, None)
+        if records is None:
+            raise KeyboardInterrupt
+        return [
+            ("fink_sn_candidates_ztf", data, offset_tracker.track(_Message(offset)))
+            for offset, data in enumerate(records)
+        ]
+
+    monkeypatch.setattr(skyportal_fink_client, "_poll_tracked_alerts", poll)
+    with SkyPortalStub() as stub:
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(
+            yaml.safe_dump(
+                {
+                    "fink_topics": ["fink_sn_candidates_ztf"],
+                    "fink_username": "user",
+                    "fink_password": None,
+                    "fink_group_id": "group",
+                    "fink_servers": "localhost:9093",
+                    "fink_at_least_once": True,
+                    "survey": "ztf",
+                    "skyportal_url": stub.url,
+                    "skyportal_token": "abc123",
+                    "skyportal_group": "Fink",
+                    "skyportal_name": "provisioned-admin",
+                    "testing": False,
+                    "whitelisted": True,
+                }
+            )
+        )
+        try:
+            skyportal_fink_client.poll_alerts(
+                config_path=str(config_path), log=lambda message: None
+            )
+        finally:
+            skyportal_api.invalidate_instrument_id()
+            skyportal_api.invalidate_classification()
+        assert set(stub.state.sources) == {"ZTF1", "ZTF3"}
+    assert consumer.commits[-1] == [("fink_sn_candidates_ztf", 0, 3)]
@@ -0,0 +1,99 @@
+# coding: utf-8
+import pytest
+
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils.batching import PhotometryBatcher
+
+URL = "http://localhost:5000"
+TOKEN = "abc123"
+
+
+def _point(object_id, mjd=60000.0):
+    return {
+        "object_id": object_id,
+        "mjd": mjd,
+        "filter": "ztfg",
+        "mag": 18.0,
+        "magerr": 0.1,
+        "limiting_mag": 20.0,
+        "magsys": "ab",
+        "ra": 10.0,
+        "dec": 20.0,
+    }
+
+
+@pytest.fixture
+def requests_sent(monkeypatch):
+    sent = []
+    rejected = set()
+
+    def post_photometry_batch(points, instrument_id, group_ids, stream_ids, **kwargs):
+        sent.append((instrument_id, [p["object_id"] for p in points]))
+        if any(p["object_id"] in rejected for p in points):
+            return 400, {}, "rejected"
+        return 200, list(range(len(points))), "ok"
+
+    monkeypatch.setattr(skyportal_api, "post_photometry_batch", post_photometry_batch)
+    return sent, rejected
+
+
+def test_batch_is_posted_when_full(requests_sent):
+    sent, _ = requests_sent
+    batcher = PhotometryBatcher(URL, TOKEN, max_size=3, max_age=60)
+    for i in range(2):
+        assert batcher.add(_point(f"obj{i}"), 1, 1, 1) == ([], [])
+    posted, failed = batcher.add(_point("obj2"), 1, 1, 1)
+    assert len(posted) == 3 and failed == []
+    assert sent == [(1, ["obj0", "obj1", "obj2"])]
+    assert len(batcher) == 0
+
+
+def test_batches_are_split_by_instrument(requests_sent):
+    sent, _ = requests_sent
+    batcher = PhotometryBatcher(URL, TOKEN, max_size=10, max_age=60)
+    batcher.add(_point("obj0"), 1, 1, 1)
+    batcher.add(_point("obj1"), 2, 1, 1)
+    batcher.flush()
+    assert sorted(sent) == [(1, ["obj0"]), (2, ["obj1"])]
+
+
+def test_flush_if_due_only_posts_old_batches(requests_sent):
+    sent, _ = requests_sent
+    batcher = PhotometryBatcher(URL, TOKEN, max_size=10, max_age=60)
+    batcher.add(_point("obj0"), 1, 1, 1)
+    assert batcher.flush_if_due() == ([], [])
+    batcher.max_age = 0
+    posted, _ = batcher.flush_if_due()
+    assert len(posted) == 1
+    assert sent == [(1, ["obj0"])]
+
+
+def test_rejected_batch_is_split_per_object(requests_sent):
+    sent, rejected = requests_sent
+    rejected.add("bad")
+    batcher = PhotometryBatcher(URL, TOKEN, max_size=10, max_age=60)
+    for object_id in ("obj0", "bad", "obj0", "obj1"):
+        batcher.add(_point(object_id), 1, 1, 1)
+    posted, failed = batcher.flush()
+    assert [p["object_id"] for p in posted] == ["obj0", "obj0", "obj1"]
+    assert [p["object_id"] for p in failed] == ["bad"]
+    assert sent[1:] == [(1, ["obj0", "obj0"]), (1, ["bad"]), (1, ["obj1"])]
+
+
+def test_rejected_points_are_reported(requests_sent):
+    _, rejected = requests_sent
+    rejected.add("bad")
+    reports = []
+    batcher = PhotometryBatcher(
+        URL,
+        TOKEN,
+        max_size=10,
+        max_age=60,
+        on_reject=lambda points, key, status, body: reports.append(
+            ([p["object_id"] for p in points], key, status, body)
+        ),
+    )
+    batcher.add(_point("obj0"), 1, 2, 3)
+    batcher.add(_point("bad"), 1, 2, 3)
+    batcher.flush()
+    assert reports == [(["bad"], (1, 2, 3, False), 400, "rejected")]
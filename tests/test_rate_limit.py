@@ -0,0 +1,65 @@
+# coding: utf-8
+import time
+
+import pytest
+import requests
+
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils.ratelimit import TokenBucket
+
+URL = "http://localhost:5000"
+TOKEN = "abc123"
+
+
+def _response(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return response
+
+
+def test_burst_is_served_without_waiting():
+    bucket = TokenBucket(rate=1, burst=5)
+    assert sum(bucket.acquire() for _ in range(5)) == 0
+
+
+def test_tokens_are_paced_after_burst():
+    bucket = TokenBucket(rate=100, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start == pytest.approx(0.05, abs=0.03)
+
+
+def test_defer_holds_back_next_token():
+    bucket = TokenBucket(rate=1000, burst=10)
+    bucket.defer(0.05)
+    assert bucket.acquire() == pytest.approx(0.051, abs=0.01)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, None),
+        ({"Retry-After": "3"}, 3.0),
+        ({"Retry-After": "0.5"}, 0.5),
+        ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+        ({"Retry-After": "soon"}, None),
+    ],
+)
+def test_retry_after(headers, expected):
+    assert skyportal_api._retry_after(_response(429, headers)) == expected
+
+
+def test_api_honours_retry_after(monkeypatch):
+    responses = [_response(429, {"Retry-After": "0.05"}), _response(200)]
+    session = skyportal_api.init_session(URL, TOKEN)
+    monkeypatch.setattr(session, "request", lambda *a, **k: responses.pop(0))
+    skyportal_api.init_rate_limit(URL, rate=1000, burst=10)
+    try:
+        start = time.monotonic()
+        assert skyportal_api.api("GET", f"{URL}/api/sysinfo", token=TOKEN).ok
+        assert time.monotonic() - start >= 0.05
+    finally:
+        skyportal_api.init_rate_limit(URL, None)
+        skyportal_api.close_sessions()
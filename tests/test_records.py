@@ -0,0 +1,113 @@
+# coding: utf-8
+import json
+import tracemalloc
+
+from skyportal_fink_client.utils.records import AlertRecord, PhotometryBatch
+from skyportal_fink_client.utils.spool import AlertSpool
+
+RECORD = AlertRecord(
+    "ZTF21abc",
+    60000.0,
+    ["CFH12k", "ZTF"],
+    "ztfg",
+    18.0,
+    0.1,
+    20.0,
+    "ab",
+    10.0,
+    20.0,
+    "SN candidate",
+    False,
+    2345678901234567890,
+)
+
+
+def _point(i, **extra):
+    return {
+        "object_id": f"obj{i}",
+        "mjd": 60000.0 + i,
+        "filter": "ztfg",
+        "mag": 18.0,
+        "magerr": 0.1,
+        "limiting_mag": 20.0,
+        "magsys": "ab",
+        "ra": 10.0,
+        "dec": 20.0,
+        **extra,
+    }
+
+
+def test_record_reads_like_the_former_lists():
+    assert RECORD[10] == RECORD.classification == "SN candidate"
+    assert RECORD[:2] == ("ZTF21abc", 60000.0)
+    assert json.loads(json.dumps(RECORD)) == json.loads(json.dumps(list(RECORD)))
+
+
+def test_record_round_trips_through_the_spool(tmp_path):
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    spool.add("fink_sn_candidates_ztf", RECORD)
+    ((_, _, data),) = spool.peek(1)
+    spool.close()
+    assert AlertRecord(*data) == RECORD
+    # records spooled before alert_id was added
+    assert AlertRecord(*data[:12]) == RECORD._replace(alert_id=None)
+
+
+def test_batch_gives_points_back_as_added():
+    points = [_point(0), _point(1, tag=("t", 0, 1)), _point(2, tag=None, note="x")]
+    batch = PhotometryBatch(points)
+    assert len(batch) == 3
+    assert batch.points() == points
+    assert list(batch) == points
+    assert batch.column("mjd") == [60000.0, 60001.0, 60002.0]
+    assert batch.column("object_id") == ["obj0", "obj1", "obj2"]
+
+
+def test_missing_numbers_come_back_as_none():
+    batch = PhotometryBatch([_point(0, limiting_mag=None), _point(1)])
+    assert batch.column("limiting_mag") == [None, 20.0]
+    assert batch.point(0)["limiting_mag"] is None
+
+
+def test_select_and_group_by_object():
+    batch = PhotometryBatch([_point(0), _point(1), _point(0, tag=5)])
+    assert batch.indices_by_object() == {"obj0": [0, 2], "obj1": [1]}
+    selected = batch.select([0, 2])
+    assert selected.column("object_id") == ["obj0", "obj0"]
+    assert selected.point(1)["tag"] == 5
+
+
+def _allocated(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        return tracemalloc.get_traced_memory()[0] - before, kept
+    finally:
+        tracemalloc.stop()
+
+
+def test_batch_takes_a_fraction_of_the_memory_of_dicts():
+    object_ids = [f"obj{i % 100}" for i in range(5000)]
+    tags = [("fink_sn_candidates_ztf", 0, i) for i in range(5000)]
+
+    def dicts():
+        return [
+            {
+                "object_id": object_ids[i],
+                "mjd": 60000.0 + i / 1000,
+                "filter": "ztfg",
+                "mag": 18.0 + i / 1000,
+                "magerr": 0.1 + i / 1000,
+                "limiting_mag": 20.0 + i / 1000,
+                "magsys": "ab",
+                "ra": 10.0 + i / 1000,
+                "dec": 20.0 + i / 1000,
+                "tag": tags[i],
+            }
+            for i in range(5000)
+        ]
+
+    dict_size, points = _allocated(dicts)
+    batch_size, _ = _allocated(lambda: PhotometryBatch(points))
+    assert batch_size * 4 < dict_size
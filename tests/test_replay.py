@@ -0,0 +1,153 @@
+# coding: utf-8
+import os
+
+import pytest
+import yaml
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils.records import AlertRecord
+from skyportal_fink_client.utils.registry import ObjectRegistry
+from skyportal_fink_client.utils.replay import alert_files, read_alerts
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample.avro")
+
+
+def _object_ids(chunks):
+    return [alert["objectId"] for chunk in chunks for alert in chunk]
+
+
+def test_avro_file_is_read_in_chunks():
+    chunks = list(read_alerts(SAMPLE, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+def test_parquet_and_avro_directory(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    alerts = next(read_alerts(SAMPLE))
+    columns = ["objectId", "candid", "candidate", "cdsxmatch", "rf_snia_vs_nonia"]
+    table = pa.Table.from_pylist(
+        [{key: alert[key] for key in columns} for alert in alerts]
+    )
+    pq.write_table(table, tmp_path / "b.parquet", row_group_size=2)
+    os.symlink(SAMPLE, tmp_path / "a.avro")
+    (tmp_path / "notes.txt").write_text("not an alert file")
+
+    files = alert_files(str(tmp_path))
+    assert len(files) == 6
+    assert os.path.basename(files[-1]) == "b.parquet"
+    chunks = list(read_alerts(str(tmp_path), chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    object_ids = [alert["objectId"] for alert in alerts]
+    assert _object_ids(chunks) == object_ids + object_ids
+    # nested fields come back as dicts, like alerts decoded from Kafka
+    assert chunks[-1][0]["candidate"] == alerts[-1]["candidate"]
+
+
+def test_unknown_file_type_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        alert_files(str(tmp_path / "alerts.csv"))
+
+
+def _fake_extract(survey, topics, alerts):
+    return [
+        AlertRecord(
+            alert["objectId"],
+            alert["candidate"]["jd"] - 2400000.5,
+            ["CFH12k", "ZTF"],
+            "ztfg",
+            alert["candidate"]["magpsf"],
+            alert["candidate"]["sigmapsf"],
+            alert["candidate"]["diffmaglim"],
+            "ab",
+            alert["candidate"]["ra"],
+            alert["candidate"]["dec"],
+            "SN candidate",
+            False,
+        )
+        for alert in alerts
+    ]
+
+
+def test_replay_posts_every_alert_and_returns(tmp_path, monkeypatch):
+    monkeypatch.setattr(skyportal_fink_client, "extract_alerts_data", _fake_extract)
+    messages = []
+    with SkyPortalStub() as stub:
+        config = {
+            "fink_topics": ["fink_sn_candidates_ztf"],
+            "fink_username": "user",
+            "fink_password": None,
+            "fink_group_id": "group",
+            "fink_servers": "localhost:9093",
+            "survey": "ztf",
+            "skyportal_url": stub.url,
+            "skyportal_token": "abc123",
+            "skyportal_group": "Fink",
+            "skyportal_name": "provisioned-admin",
+            "testing": False,
+            "whitelisted": True,
+            "replay_chunk_size": 2,
+            "photometry_batch_size": 10,
+        }
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(yaml.safe_dump(config))
+        try:
+            skyportal_fink_client.poll_alerts(
+                config_path=str(config_path),
+                log=messages.append,
+                replay_path=SAMPLE,
+            )
+        finally:
+            skyportal_api.invalidate_instrument_id()
+            skyportal_api.invalidate_classification()
+        expected = {alert["objectId"] for alert in next(read_alerts(SAMPLE))}
+        assert set(stub.state.sources) == expected
+        assert len(stub.state.photometry) == 5
+    assert "Replay done" in messages
+
+
+def test_batch_rejection_forgets_the_object(tmp_path, monkeypatch):
+    monkeypatch.setattr(skyportal_fink_client, "extract_alerts_data", _fake_extract)
+    registry_path = str(tmp_path / "registry.sqlite")
+    with SkyPortalStub() as stub:
+        config = {
+            "fink_topics": ["fink_sn_candidates_ztf"],
+            "fink_username": "user",
+            "fink_password": None,
+            "fink_group_id": "group",
+            "fink_servers": "localhost:9093",
+            "survey": "ztf",
+            "skyportal_url": stub.url,
+            "skyportal_token": "abc123",
+            "skyportal_group": "Fink",
+            "skyportal_name": "provisioned-admin",
+            "testing": False,
+            "whitelisted": True,
+            "photometry_batch_size": 10,
+            "object_registry_path": registry_path,
+        }
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(yaml.safe_dump(config))
+        group_id = skyportal_fink_client.init_skyportal(
+            stub.url, "abc123", "Fink", "provisioned-admin", True, log=None
+        )[0]
+        # known to the registry, but deleted from SkyPortal since
+        registry = ObjectRegistry(registry_path)
+        registry.add_source("ZTF18aaxypzn", group_id)
+        registry.close()
+        try:
+            skyportal_fink_client.poll_alerts(
+                config_path=str(config_path),
+                log=lambda message: None,
+                replay_path=SAMPLE,
+            )
+        finally:
+            skyportal_api.invalidate_instrument_id()
+            skyportal_api.invalidate_classification()
+        assert "ZTF18aaxypzn" not in stub.state.sources
+        assert len(stub.state.photometry) == 4
+    registry = ObjectRegistry(registry_path)
+    assert not registry.has_source("ZTF18aaxypzn", group_id)
+    assert registry.has_source("ZTF18abadigg", group_id)
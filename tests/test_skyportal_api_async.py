@@ -0,0 +1,77 @@
+# coding: utf-8
+import asyncio
+import time
+
+from aiohttp import web
+
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+import skyportal_fink_client.utils.skyportal_api_async as skyportal_api_async
+
+DELAY = 0.1
+TOKEN = "abc123"
+HIERARCHY = {"class": "Fink Taxonomy", "subclasses": [{"class": "SN candidate"}]}
+
+
+def _app(calls):
+    async def handler(request):
+        calls.append((request.method, request.path))
+        await asyncio.sleep(DELAY)
+        if request.path == "/api/instrument":
+            return web.json_response({"data": [{"name": "ZTF", "id": 1}]})
+        if request.path.endswith("/classifications"):
+            return web.json_response({"data": []})
+        return web.json_response({"data": {"id": 1, "ids": [1]}})
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    return app
+
+
+async def _post_alert(calls):
+    runner = web.AppRunner(_app(calls))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    skyportal_api.register_taxonomy_index(1, HIERARCHY, url)
+    try:
+        await skyportal_api_async.init_session(url, TOKEN)
+        start = time.monotonic()
+        status = await skyportal_api_async.from_fink_to_skyportal(
+            "ZTF21abc",
+            60000.0,
+            ["CFH12k", "ZTF"],
+            "ztfg",
+            18.0,
+            0.1,
+            20.0,
+            "ab",
+            10.0,
+            20.0,
+            "SN candidate",
+            probability=None,
+            group_id=1,
+            filter_id=1,
+            stream_id=1,
+            taxonomy_id=1,
+            whitelisted=True,
+            url=url,
+            token=TOKEN,
+            skyportal_name="fink",
+            log=lambda message: None,
+        )
+        return status, time.monotonic() - start
+    finally:
+        await skyportal_api_async.close_sessions()
+        await runner.cleanup()
+
+
+def test_alert_calls_are_sent_concurrently():
+    calls = []
+    status, elapsed = asyncio.run(_post_alert(calls))
+    assert status == 200
+    assert ("POST", "/api/classification") in calls
+    assert ("PUT", "/api/photometry") in calls
+    # instrument lookup, then two concurrent rounds, instead of six calls in a row
+    assert len(calls) == 6
+    assert elapsed < 4.5 * DELAY
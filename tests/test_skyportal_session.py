@@ -0,0 +1,39 @@
+# coding: utf-8
+import pytest
+
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+
+URL = "http://localhost:5000"
+TOKEN = "abc123"
+
+
+@pytest.fixture(autouse=True)
+def _clean_sessions():
+    skyportal_api.close_sessions()
+    yield
+    skyportal_api.close_sessions()
+
+
+def test_session_is_reused_for_same_instance():
+    first = skyportal_api.get_session(f"{URL}/api/sources", TOKEN)
+    second = skyportal_api.get_session(f"{URL}/api/photometry", TOKEN)
+    assert first is second
+
+
+def test_session_per_token():
+    first = skyportal_api.get_session(URL, TOKEN)
+    second = skyportal_api.get_session(URL, "other-token")
+    assert first is not second
+
+
+def test_session_has_auth_header():
+    session = skyportal_api.get_session(URL, TOKEN)
+    assert session.headers["Authorization"] == f"token {TOKEN}"
+
+
+def test_init_session_sets_pool_size_and_replaces_previous():
+    previous = skyportal_api.get_session(URL, TOKEN)
+    session = skyportal_api.init_session(URL, TOKEN, pool_size=42)
+    assert session is not previous
+    assert skyportal_api.get_session(URL, TOKEN) is session
+    assert session.get_adapter(URL)._pool_maxsize == 42
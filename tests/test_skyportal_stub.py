@@ -0,0 +1,162 @@
+# coding: utf-8
+import asyncio
+
+import pytest
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+import skyportal_fink_client.utils.skyportal_api_async as skyportal_api_async
+from skyportal_fink_client.utils.batching import PhotometryBatcher
+
+TOKEN = "abc123"
+NAME = "provisioned-admin"
+
+
+@pytest.fixture
+def stub():
+    with SkyPortalStub() as stub:
+        yield stub
+    skyportal_api.close_sessions()
+    skyportal_api.invalidate_instrument_id()
+    skyportal_api.invalidate_classification()
+
+
+def _init(stub):
+    return skyportal_fink_client.init_skyportal(
+        stub.url,
+        TOKEN,
+        "Fink",
+        NAME,
+        True,
+        log=None,
+        survey="ztf",
+    )
+
+
+def _alert(object_id="ZTF21abc", mjd=60000.0, classification="SN candidate"):
+    return [
+        object_id,
+        mjd,
+        ["CFH12k", "ZTF"],
+        "ztfg",
+        18.0,
+        0.1,
+        20.0,
+        "ab",
+        10.0,
+        20.0,
+        classification,
+    ]
+
+
+def _post(stub, init, alert, **kwargs):
+    group_id, stream_id, filter_id, taxonomy_id = init[:4]
+    return skyportal_api.from_fink_to_skyportal(
+        *alert,
+        probability=None,
+        group_id=group_id,
+        filter_id=filter_id,
+        stream_id=stream_id,
+        taxonomy_id=taxonomy_id,
+        whitelisted=True,
+        url=stub.url,
+        token=TOKEN,
+        skyportal_name=NAME,
+        log=lambda message: None,
+        **kwargs,
+    )
+
+
+def test_init_skyportal_creates_the_entities(stub):
+    init = _init(stub)
+    group_id, stream_id, filter_id, taxonomy_id = init[:4]
+    assert stub.state.groups[group_id]["name"] == "Fink"
+    assert stream_id in stub.state.groups[group_id]["streams"]
+    assert stub.state.filters[filter_id]["name"] == "fink_filter"
+    assert stub.state.taxonomies[taxonomy_id]["name"] == "Fink Taxonomy"
+    # a second start reuses them
+    assert _init(stub)[:4] == init[:4]
+
+
+def test_alerts_are_ingested(stub):
+    init = _init(stub)
+    assert _post(stub, init, _alert()) == 200
+    assert _post(stub, init, _alert(mjd=60000.1)) == 200
+    assert (
+        _post(stub, init, _alert(mjd=60000.2, classification="Kilonova candidate"))
+        == 200
+    )
+
+    assert list(stub.state.sources) == ["ZTF21abc"]
+    assert [point["mjd"] for point in stub.state.photometry] == [
+        60000.0,
+        60000.1,
+        60000.2,
+    ]
+    (classification,) = stub.state.classifications.values()
+    assert classification["classification"] == "Kilonova candidate"
+    # our author id is only known after the first lookup that finds our
+    # classification, from then on the classification cache answers; the
+    # second alert did not change the classification, so it was not written
+    assert stub.counts["GET /api/sources/{id}/classifications"] == 2
+    assert stub.counts["POST /api/classification"] == 1
+    assert stub.counts["PUT /api/classification/{id}"] == 1
+
+
+def test_rate_limited_requests_are_retried(stub):
+    init = _init(stub)
+    stub.rate_limit_rate = 0.3
+    stub._random.seed(1)
+    for i in range(10):
+        assert _post(stub, init, _alert(f"ZTF21abc{i}")) == 200
+    assert len(stub.state.sources) == 10
+
+
+def test_injected_errors_are_reported(stub):
+    init = _init(stub)
+    stub.error_rate = 1.0
+    assert _post(stub, init, _alert()) == 500
+
+
+def test_photometry_batches(stub):
+    init = _init(stub)
+    batcher = PhotometryBatcher(stub.url, TOKEN, max_size=5)
+    for i in range(10):
+        _post(stub, init, _alert(mjd=60000 + i), photometry_batcher=batcher)
+    batcher.flush()
+    assert len(stub.state.photometry) == 10
+    assert stub.counts["PUT /api/photometry"] == 2
+
+
+def test_async_client(stub):
+    init = _init(stub)
+    group_id, stream_id, filter_id, taxonomy_id = init[:4]
+
+    async def post_alerts():
+        await skyportal_api_async.init_session(stub.url, TOKEN)
+        try:
+            return await asyncio.gather(
+                *(
+                    skyportal_api_async.from_fink_to_skyportal(
+                        *_alert(f"ZTF21abc{i}"),
+                        probability=None,
+                        group_id=group_id,
+                        filter_id=filter_id,
+                        stream_id=stream_id,
+                        taxonomy_id=taxonomy_id,
+                        whitelisted=True,
+                        url=stub.url,
+                        token=TOKEN,
+                        skyportal_name=NAME,
+                        log=lambda message: None,
+                    )
+                    for i in range(5)
+                )
+            )
+        finally:
+            await skyportal_api_async.close_sessions()
+
+    assert asyncio.run(post_alerts()) == [200] * 5
+    assert len(stub.state.sources) == 5
+    assert len(stub.state.classifications) == 5
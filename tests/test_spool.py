@@ -0,0 +1,323 @@
+# coding: utf-8
+import json
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+import yaml
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils.batching import PhotometryBatcher
+from skyportal_fink_client.utils.spool import AlertSpool, SpoolDrainer, is_retryable
+
+TOKEN = "abc123"
+NAME = "provisioned-admin"
+
+
+def _alert(object_id="ZTF21abc", mjd=60000.0):
+    return [
+        object_id,
+        mjd,
+        ["CFH12k", "ZTF"],
+        "ztfg",
+        18.0,
+        0.1,
+        20.0,
+        "ab",
+        10.0,
+        20.0,
+        "SN candidate",
+        False,
+    ]
+
+
+def test_is_retryable():
+    assert is_retryable(None)
+    assert is_retryable(429)
+    assert is_retryable(503)
+    assert not is_retryable(400)
+    assert not is_retryable(404)
+
+
+def test_spool_is_first_in_first_out(tmp_path):
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    for i in range(3):
+        spool.add("topic", _alert(f"ZTF{i}"))
+    assert len(spool) == 3
+    rows = spool.peek(2)
+    assert [data[0] for _, _, data in rows] == ["ZTF0", "ZTF1"]
+    spool.remove([id for id, _, _ in rows])
+    assert len(spool) == 1
+    assert spool.peek(10)[0][1:] == ("topic", _alert("ZTF2"))
+    spool.close()
+
+
+def test_spool_survives_a_restart(tmp_path):
+    path = str(tmp_path / "spool.sqlite")
+    spool = AlertSpool(path)
+    spool.add("topic", _alert(mjd=np.float64(60000.5)) + [np.int64(3)])
+    spool.close()
+
+    spool = AlertSpool(path)
+    assert len(spool) == 1
+    assert spool.peek(1)[0][2][1] == 60000.5
+    assert spool.peek(1)[0][2][-1] == 3
+    spool.close()
+
+
+def test_drain_stops_at_the_first_retryable_failure(tmp_path):
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    for i in range(3):
+        spool.add("topic", _alert(f"ZTF{i}"))
+    statuses = iter([200, 503])
+    posted = []
+
+    def post(topic, data):
+        posted.append(data[0])
+        return next(statuses)
+
+    drainer = SpoolDrainer(spool, post, batch_size=2)
+    assert not drainer.drain()
+    assert posted == ["ZTF0", "ZTF1"]
+    assert [data[0] for _, _, data in spool.peek(10)] == ["ZTF1", "ZTF2"]
+
+    drainer.post = lambda topic, data: 200
+    assert drainer.drain()
+    assert len(spool) == 0
+
+
+def test_drain_drops_alerts_failing_for_good(tmp_path):
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    spool.add("topic", _alert("ZTF0"))
+    spool.add("topic", _alert("ZTF1"))
+    dropped = []
+    drainer = SpoolDrainer(
+        spool,
+        lambda topic, data: 400 if data[0] == "ZTF0" else 200,
+        on_drop=lambda topic, data, status: dropped.append((data[0], status)),
+    )
+    assert drainer.drain()
+    assert dropped == [("ZTF0", 400)]
+
+
+def test_alert_failing_every_retry_is_dropped(tmp_path):
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    spool.add("topic", _alert("ZTF0"))
+    spool.add("topic", _alert("ZTF1"))
+    dropped = []
+    drainer = SpoolDrainer(
+        spool,
+        lambda topic, data: 503 if data[0] == "ZTF0" else 200,
+        max_attempts=3,
+        on_drop=lambda topic, data, status: dropped.append((data[0], status)),
+    )
+    assert not drainer.drain()
+    assert not drainer.drain()
+    assert len(spool) == 2
+    # the third failure gives up on it, and the next alerts go through
+    assert drainer.drain()
+    assert dropped == [("ZTF0", 503)]
+    assert len(spool) == 0
+
+
+def test_attempts_are_kept_across_restarts(tmp_path):
+    path = str(tmp_path / "spool.sqlite")
+    spool = AlertSpool(path)
+    spool.add("topic", _alert())
+    ((id, _, _),) = spool.peek(1)
+    assert spool.record_failure(id) == 1
+    spool.close()
+    assert AlertSpool(path).record_failure(id) == 2
+
+
+def test_spool_of_an_older_version_is_read(tmp_path):
+    path = str(tmp_path / "spool.sqlite")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE alerts "
+        "(id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, data TEXT)"
+    )
+    db.execute(
+        "INSERT INTO alerts (topic, data) VALUES (?, ?)",
+        ("topic", json.dumps(_alert())),
+    )
+    db.commit()
+    db.close()
+    spool = AlertSpool(path)
+    assert spool.peek(1)[0][1:] == ("topic", _alert())
+    assert spool.record_failure(spool.peek(1)[0][0]) == 1
+
+
+def test_probe_tells_when_skyportal_is_back(tmp_path):
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    spool.add("topic", _alert())
+    answers = [False, True]
+    posted = []
+    drainer = SpoolDrainer(
+        spool,
+        lambda topic, data: posted.append(data[0]) or 200,
+        probe=lambda: answers.pop(0) if answers else True,
+        retry_interval=0.01,
+    )
+    assert drainer.available()
+    drainer.mark_unavailable()
+    drainer.start()
+    for _ in range(500):
+        if drainer.available() and not len(spool):
+            break
+        time.sleep(0.01)
+    drainer.stop()
+    assert drainer.available()
+    assert posted == ["ZTF21abc"]
+    assert answers == []
+
+
+def test_drain_treats_exceptions_as_unavailable(tmp_path):
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    spool.add("topic", _alert())
+
+    def post(topic, data):
+        raise ConnectionError("refused")
+
+    logs = []
+    assert not SpoolDrainer(spool, post, log=logs.append).drain()
+    assert len(spool) == 1
+    assert "refused" in logs[0]
+
+
+@pytest.fixture
+def stub():
+    with SkyPortalStub() as stub:
+        yield stub
+    skyportal_api.close_sessions()
+    skyportal_api.invalidate_instrument_id()
+    skyportal_api.invalidate_classification()
+
+
+def test_drainer_posts_spooled_alerts_once_skyportal_is_back(stub, tmp_path):
+    group_id, stream_id, filter_id, taxonomy_id = skyportal_fink_client.init_skyportal(
+        stub.url, TOKEN, "Fink", NAME, True, log=None, survey="ztf"
+    )[:4]
+
+    def post(topic, data):
+        return skyportal_api.from_fink_to_skyportal(
+            *data[:11],
+            probability=None,
+            group_id=group_id,
+            filter_id=filter_id,
+            stream_id=stream_id,
+            taxonomy_id=taxonomy_id,
+            whitelisted=True,
+            url=stub.url,
+            token=TOKEN,
+            skyportal_name=NAME,
+            log=lambda message: None,
+            is_flux=data[11],
+        )
+
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    spool.add("fink_sn_candidates_ztf", _alert("ZTF21a"))
+    spool.add("fink_sn_candidates_ztf", _alert("ZTF21b"))
+    drainer = SpoolDrainer(spool, post)
+
+    stub.error_rate = 1.0
+    assert not drainer.drain()
+    assert len(spool) == 2
+
+    stub.error_rate = 0.0
+    assert drainer.drain()
+    assert len(spool) == 0
+    assert set(stub.state.sources) >= {"ZTF21a", "ZTF21b"}
+
+
+def test_drained_photometry_is_batched_per_chunk(tmp_path, monkeypatch):
+    sent = []
+
+    def post_photometry_batch(points, instrument_id, group_ids, stream_ids, **kwargs):
+        sent.append([p["object_id"] for p in points])
+        if "ZTF1" in sent[-1]:
+            return 400, {}, "rejected"
+        return 200, list(range(len(points))), "ok"
+
+    monkeypatch.setattr(skyportal_api, "post_photometry_batch", post_photometry_batch)
+    batcher = PhotometryBatcher("http://localhost:5000", TOKEN, max_size=10)
+
+    def post(topic, data, tag):
+        point = dict(zip(("object_id", "mjd"), data[:2]), tag=tag)
+        point.update(filter="ztfg", mag=18.0, magerr=0.1, limiting_mag=20.0)
+        point.update(magsys="ab", ra=10.0, dec=20.0)
+        batcher.add(point, 1, 1, 1)
+        return 200
+
+    spool = AlertSpool(str(tmp_path / "spool.sqlite"))
+    for i in range(3):
+        spool.add("topic", _alert(f"ZTF{i}"))
+    dropped = []
+    drainer = SpoolDrainer(
+        spool,
+        post,
+        batch_size=2,
+        max_attempts=2,
+        on_drop=lambda topic, data, status: dropped.append((data[0], status)),
+        photometry_batcher=batcher,
+    )
+    assert drainer.drain()
+    # one request per chunk, the rejected batch being posted object by object
+    assert sent == [["ZTF0", "ZTF1"], ["ZTF0"], ["ZTF1"], ["ZTF2"]]
+    # only the alert whose photometry was rejected is left
+    assert [data[0] for _, _, data in spool.peek(10)] == ["ZTF1"]
+    assert drainer.drain()
+    assert dropped == [("ZTF1", None)]
+    assert len(spool) == 0
+
+
+def test_spooled_photometry_has_its_own_batcher(tmp_path, monkeypatch):
+    calls = []
+
+    class Drainer(SpoolDrainer):
+        def start(self):
+            before = len(stub.state.photometry)
+            status = self.post("fink_sn_candidates_ztf", _alert("ZTF21spooled"), 1)
+            calls.append((status, len(stub.state.photometry) - before))
+            self.photometry_batcher.flush()
+            calls.append(len(stub.state.photometry) - before)
+            return super().start()
+
+    monkeypatch.setattr(skyportal_fink_client, "SpoolDrainer", Drainer)
+    with SkyPortalStub() as stub:
+        config = {
+            "fink_topics": ["fink_sn_candidates_ztf"],
+            "fink_username": "user",
+            "fink_password": None,
+            "fink_group_id": "group",
+            "fink_servers": "localhost:9093",
+            "survey": "ztf",
+            "skyportal_url": stub.url,
+            "skyportal_token": TOKEN,
+            "skyportal_group": "Fink",
+            "skyportal_name": NAME,
+            "testing": False,
+            "whitelisted": True,
+            "photometry_batch_size": 100,
+            "spool_path": str(tmp_path / "spool.sqlite"),
+            "warm_up": False,
+        }
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(yaml.safe_dump(config))
+        empty = tmp_path / "empty"
+        empty.mkdir()
+        try:
+            skyportal_fink_client.poll_alerts(
+                config_path=str(config_path),
+                log=lambda message: None,
+                replay_path=str(empty),
+            )
+        finally:
+            skyportal_api.close_sessions()
+            skyportal_api.invalidate_instrument_id()
+            skyportal_api.invalidate_classification()
+    # queued until the drainer flushes its batcher at the end of the chunk
+    assert calls == [(200, 0), 1]
@@ -0,0 +1,61 @@
+# coding: utf-8
+import os
+import subprocess
+import sys
+
+import yaml
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_reads_no_file_and_loads_no_heavy_module():
+    code = (
+        "import builtins, sys\n"
+        "opened = []\n"
+        "original = builtins.open\n"
+        "builtins.open = lambda path, *a, **k: opened.append(str(path)) or original(path, *a, **k)\n"
+        "import skyportal_fink_client.skyportal_fink_client\n"
+        "heavy = ('numpy', 'pandas', 'astropy', 'fink_client', 'fink_filters', 'confluent_kafka')\n"
+        "print([name for name in heavy if name in sys.modules])\n"
+        "print([path for path in opened if path.endswith('.yaml')])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.splitlines() == ["[]", "[]"]
+
+
+def test_load_config_reads_the_given_file(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump({"survey": "lsst"}))
+    assert skyportal_fink_client.load_config(str(path)) == {"survey": "lsst"}
+
+
+def test_taxonomy_is_read_once():
+    taxonomy = skyportal_fink_client.load_taxonomy()
+    assert "hierarchy" in taxonomy
+    assert skyportal_fink_client.load_taxonomy() is taxonomy
+    assert skyportal_fink_client.taxonomy_dict is taxonomy
+
+
+def test_warm_up_lsst_loads_the_kafka_client():
+    messages = []
+    assert skyportal_fink_client.warm_up("lsst", messages.append)
+    assert "fink_client.consumer" in sys.modules
+    assert messages[0].startswith("Warmed up")
+
+
+def test_warm_up_failure_is_only_reported(monkeypatch):
+    # None in sys.modules makes the import fail, as if fink_filters was missing
+    monkeypatch.setitem(sys.modules, "fink_filters", None)
+    monkeypatch.setitem(sys.modules, "fink_filters.ztf", None)
+    monkeypatch.setitem(sys.modules, "fink_filters.ztf.classification", None)
+    messages = []
+    assert not skyportal_fink_client.warm_up("ztf", messages.append)
+    assert messages[0].startswith("Warning: warm-up failed")
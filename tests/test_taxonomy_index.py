@@ -0,0 +1,78 @@
+# coding: utf-8
+import os
+
+import pytest
+
+import skyportal_fink_client.utils.files as files
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+
+taxonomy_dict = files.yaml_to_dict(
+    os.path.abspath(os.path.join(os.path.dirname(__file__)))
+    + "/../skyportal_fink_client/data/taxonomy.yaml"
+)
+
+HIERARCHY = {
+    "class": "Root",
+    "subclasses": [
+        {
+            "class": "Parent",
+            "other names": ["Alias"],
+            "subclasses": [{"class": "(TNS) SN Ia", "other names": ["(SIMBAD) SNIa"]}],
+        },
+        {"class": "SN Ia"},
+    ],
+}
+
+
+def _all_names(branch):
+    for tax_class in branch:
+        yield tax_class["class"]
+        yield from tax_class.get("other names", [])
+        yield from _all_names(tax_class.get("subclasses", []))
+
+
+@pytest.mark.parametrize(
+    "classification, expected",
+    [
+        ("Root", "Root"),
+        ("Alias", "Parent"),
+        ("(TNS) SN Ia", "(TNS) SN Ia"),
+        ("SN Ia", "(TNS) SN Ia"),
+        ("SNIa", "(TNS) SN Ia"),
+        ("Unknown", None),
+    ],
+)
+def test_index_lookup(classification, expected):
+    index = skyportal_api.compile_taxonomy_index(HIERARCHY)
+    assert index.get(classification) == expected
+
+
+def test_index_matches_recursive_lookup_on_fink_taxonomy():
+    hierarchy = taxonomy_dict["hierarchy"]
+    index = skyportal_api.compile_taxonomy_index(hierarchy)
+    names = set(_all_names([hierarchy]))
+    names |= {
+        name[len(prefix) :]
+        for name in names
+        for prefix in ("(TNS) ", "(SIMBAD) ")
+        if name.startswith(prefix)
+    }
+    for name in names | {"Not a class"}:
+        expected, _ = skyportal_api.class_exists_in_fink_taxonomy_hierarchy(
+            name, [hierarchy]
+        )
+        assert index.get(name) == expected
+
+
+def test_registered_index_skips_taxonomy_fetch(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("taxonomy should not be fetched")
+
+    monkeypatch.setattr(skyportal_api, "api", fail)
+    skyportal_api.register_taxonomy_index(42, HIERARCHY, "http://localhost:5000")
+    assert (
+        skyportal_api.get_classification_in_fink_taxonomy(
+            "Alias", 42, "http://localhost:5000", "token"
+        )
+        == "Parent"
+    )
@@ -0,0 +1,44 @@
+# coding: utf-8
+import numpy as np
+import pytest
+from astropy.time import Time
+
+from skyportal_fink_client.utils import times
+
+MJDS = np.random.default_rng(42).uniform(58000, 62000, 10000)
+
+
+def test_jd_to_mjd_matches_astropy():
+    jds = MJDS + times.MJD_OFFSET
+    expected = Time(jds, format="jd").mjd
+    assert np.array_equal(times.jd_to_mjd(jds), expected)
+    assert times.jd_to_mjd(float(jds[0])) == expected[0]
+    assert times.mjd_to_jd(times.jd_to_mjd(2460000.5)) == 2460000.5
+
+
+def test_mjd_to_isot_matches_astropy():
+    expected = Time(MJDS, format="mjd").isot
+    assert list(times.mjd_to_isot(MJDS)) == list(expected)
+    assert [times.mjd_to_isot(mjd) for mjd in MJDS[:1000]] == list(expected[:1000])
+
+
+@pytest.mark.parametrize(
+    "mjd, isot",
+    [
+        (60000, "2023-02-25T00:00:00.000"),
+        (60000.5, "2023-02-25T12:00:00.000"),
+        # rounds up to the next day, as astropy does
+        (60000.99999999999, "2023-02-26T00:00:00.000"),
+        (np.float64(51544.5), "2000-01-01T12:00:00.000"),
+    ],
+)
+def test_mjd_to_isot_scalars(mjd, isot):
+    assert times.mjd_to_isot(mjd) == isot
+    assert Time(mjd, format="mjd").isot == isot
+
+
+def test_jd_to_isot_of_a_list():
+    assert list(times.jd_to_isot([2460000.5, 2460001.0])) == [
+        "2023-02-25T00:00:00.000",
+        "2023-02-25T12:00:00.000",
+    ]
@@ -0,0 +1,170 @@
+# coding: utf-8
+import asyncio
+import json
+
+import pytest
+from skyportal_stub import SkyPortalStub
+
+import skyportal_fink_client.skyportal_fink_client as skyportal_fink_client
+import skyportal_fink_client.utils.skyportal_api as skyportal_api
+from skyportal_fink_client.utils import tracing
+
+TOKEN = "abc123"
+NAME = "provisioned-admin"
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracing.configure_tracing(str(path))
+    yield path
+    tracing.configure_tracing(None)
+
+
+def _traces(path):
+    tracing.configure_tracing(None)
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_nothing_is_recorded_when_tracing_is_off():
+    assert tracing.span("extract") is tracing._NO_SPAN
+    assert tracing.trace("alert") is tracing._NO_SPAN
+
+    @tracing.traced("alert")
+    def post(object_id):
+        with tracing.span("skyportal") as span:
+            span.set(status=200)
+        return object_id
+
+    assert post("ZTF1") == "ZTF1"
+
+
+def test_spans_are_written_with_their_trace(trace_file):
+    @tracing.traced("alert", key="object_id")
+    def post(object_id):
+        with tracing.span("skyportal", method="PUT") as span:
+            span.set(status=200)
+        with pytest.raises(ValueError):
+            with tracing.span("classification"):
+                raise ValueError
+        return 200
+
+    assert post("ZTF1") == 200
+    (record,) = _traces(trace_file)
+    assert record["trace"] == "alert"
+    assert record["object_id"] == "ZTF1"
+    assert [span["name"] for span in record["spans"]] == ["skyportal", "classification"]
+    assert record["spans"][0]["status"] == 200
+    assert record["spans"][1]["error"] == "ValueError"
+    assert all(span["duration"] <= record["duration"] for span in record["spans"])
+
+
+def test_nested_traces_become_spans(trace_file):
+    @tracing.traced("extract")
+    def extract():
+        pass
+
+    with tracing.trace("poll"):
+        extract()
+    (record,) = _traces(trace_file)
+    assert record["trace"] == "poll"
+    assert [span["name"] for span in record["spans"]] == ["extract"]
+
+
+def test_traces_are_sampled(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    tracing.configure_tracing(str(path), sample_rate=0.25)
+    draws = iter([0.5, 0.1])
+    monkeypatch.setattr(tracing.random, "random", lambda: next(draws))
+    for _ in range(2):
+        with tracing.trace("alert"):
+            pass
+    assert len(_traces(path)) == 1
+
+
+def test_spans_of_concurrent_tasks_are_recorded(trace_file):
+    async def call(name):
+        with tracing.span(name):
+            await asyncio.sleep(0)
+
+    @tracing.traced("alert")
+    async def post():
+        await asyncio.gather(call("source"), call("candidate"))
+
+    asyncio.run(post())
+    (record,) = _traces(trace_file)
+    assert sorted(span["name"] for span in record["spans"]) == ["candidate", "source"]
+
+
+def test_skyportal_calls_are_traced(trace_file):
+    with SkyPortalStub(user_name=NAME) as stub:
+        group_id, stream_id, filter_id, taxonomy_id = (
+            skyportal_fink_client.init_skyportal(
+                stub.url, TOKEN, "Fink", NAME, True, log=None, survey="ztf"
+            )[:4]
+        )
+        # init_skyportal is not traced, start from an empty file
+        tracing.configure_tracing(None)
+        trace_file.write_text("")
+        tracing.configure_tracing(str(trace_file))
+        status = skyportal_api.from_fink_to_skyportal(
+            "ZTF21abc",
+            60000.0,
+            ["ZTF"],
+            "ztfg",
+            18.0,
+            0.1,
+            20.0,
+            "ab",
+            10.0,
+            20.0,
+            "SN candidate",
+            probability=None,
+            group_id=group_id,
+            filter_id=filter_id,
+            stream_id=stream_id,
+            taxonomy_id=taxonomy_id,
+            whitelisted=True,
+            url=stub.url,
+            token=TOKEN,
+            skyportal_name=NAME,
+            log=lambda message: None,
+        )
+    skyportal_api.close_sessions()
+    skyportal_api.invalidate_instrument_id()
+    skyportal_api.invalidate_classification()
+    assert status == 200
+    (record,) = _traces(trace_file)
+    assert record["trace"] == "alert" and record["object_id"] == "ZTF21abc"
+    calls = [
+        (span["method"], span["endpoint"], span["status"])
+        for span in record["spans"]
+        if span["name"] == "skyportal"
+    ]
+    assert ("POST", "/api/sources", 200) in calls
+    assert ("PUT", "/api/photometry", 200) in calls
+
+
+def test_summarize_traces(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    records = [
+        {
+            "trace": "alert",
+            "duration": duration,
+            "spans": [
+                {
+                    "name": "skyportal",
+                    "method": "PUT",
+                    "endpoint": "/api/photometry",
+                    "duration": duration / 2,
+                }
+            ],
+        }
+        for duration in (0.1, 0.2, 0.3)
+    ]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    summary = tracing.summarize_traces(str(path))
+    assert summary["alert"]["count"] == 3
+    assert summary["alert"]["p50"] == 0.2
+    assert summary["alert"]["max"] == 0.3
+    assert summary["alert/skyportal PUT /api/photometry"]["mean"] == pytest.approx(0.1)
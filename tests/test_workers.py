@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from skyportal_fink_client.utils.workers import run_workers
+
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _count(directory, prefix):
+    return sum(1 for name in os.listdir(directory) if name.startswith(prefix))
+
+
+def _long_running(log, directory):
+    pid = os.getpid()
+    open(os.path.join(directory, f"started-{pid}"), "w").close()
+    try:
+        while True:
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        open(os.path.join(directory, f"stopped-{pid}"), "w").close()
+        raise
+
+
+def _short_lived(log, directory):
+    open(os.path.join(directory, f"started-{os.getpid()}"), "w").close()
+
+
+def _supervise(target, directory, num_workers):
+    run_workers(
+        num_workers,
+        target,
+        kwargs={"directory": directory},
+        restart_delay=0.1,
+        stop_timeout=5.0,
+    )
+
+
+def _start_supervisor(target, directory, num_workers=2):
+    supervisor = multiprocessing.Process(
+        target=_supervise, args=(target, str(directory), num_workers)
+    )
+    supervisor.start()
+    return supervisor
+
+
+def test_sigterm_stops_workers_cleanly(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    supervisor = _start_supervisor(_long_running, tmp_path)
+    try:
+        assert _wait_for(lambda: _count(tmp_path, "started-") == 2)
+        os.kill(supervisor.pid, signal.SIGTERM)
+        supervisor.join(10)
+        assert supervisor.exitcode == 0
+        # every worker went through its KeyboardInterrupt cleanup
+        assert _count(tmp_path, "stopped-") == 2
+    finally:
+        if supervisor.is_alive():
+            supervisor.kill()
+
+
+def test_sighup_restarts_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    supervisor = _start_supervisor(_long_running, tmp_path)
+    try:
+        assert _wait_for(lambda: _count(tmp_path, "started-") == 2)
+        os.kill(supervisor.pid, signal.SIGHUP)
+        assert _wait_for(lambda: _count(tmp_path, "started-") == 4)
+        assert _count(tmp_path, "stopped-") == 2
+        os.kill(supervisor.pid, signal.SIGTERM)
+        supervisor.join(10)
+        assert _count(tmp_path, "stopped-") == 4
+    finally:
+        if supervisor.is_alive():
+            supervisor.kill()
+
+
+def test_dead_workers_are_restarted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    supervisor = _start_supervisor(_short_lived, tmp_path, num_workers=1)
+    try:
+        assert _wait_for(lambda: _count(tmp_path, "started-") >= 3)
+        os.kill(supervisor.pid, signal.SIGTERM)
+        supervisor.join(10)
+        assert supervisor.exitcode == 0
+    finally:
+        if supervisor.is_alive():
+            supervisor.kill()